@@ -0,0 +1,202 @@
+# Admission control for /ask: per-client rate limits, a bounded in-flight limit and priority lanes
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from .deadlines import remaining
+from .intent_router import mentions_self_harm
+from .resilience import Rejected
+from .telemetry import ADMISSION_QUEUE, SHED, get_logger, span
+
+
+logger = get_logger("admission")
+
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() not in ("0", "false", "no")
+# Requests served at once; the rest wait in a queue of at most QUEUE_DEPTH
+# for up to QUEUE_TIMEOUT seconds, then are shed
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+ADMISSION_QUEUE_DEPTH = int(os.getenv("ADMISSION_QUEUE_DEPTH", "128"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+# Per-client token bucket: sustained requests/second and burst size
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "1"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+# Clients tracked at once; the least recently seen are forgotten (a full bucket)
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+
+# Lanes, most urgent first. Crisis messages skip the rate limit, are
+# served before anything else waiting, and are never shed. Batch messages
+# (/ask/batch) wait behind both.
+CRISIS, NORMAL, BATCH = 0, 1, 2
+LANES = {CRISIS: "crisis", NORMAL: "normal", BATCH: "batch"}
+
+
+class Shed(Rejected):
+    """The request was not admitted; `reason` is rate_limited, queue_full or queue_timeout."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"request shed: {reason}")
+        self.reason = reason
+
+
+class TokenBuckets:
+    """One token bucket per client key, LRU-bounded."""
+
+    def __init__(self, rate: float = RATE_LIMIT_PER_SECOND, burst: float = RATE_LIMIT_BURST,
+                 max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+
+    def take(self, key: str) -> bool:
+        """Spend one token for `key`; False if its bucket is empty."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1.0
+        self._buckets[key] = (tokens - 1.0 if allowed else tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionController:
+    """
+    Admits at most `max_in_flight` requests at a time. Others wait in a
+    priority queue (crisis lane first, then arrival order) of at most
+    `queue_depth` entries for up to `queue_timeout` seconds. Requests over
+    their client's rate limit, beyond the queue or waiting too long raise
+    Shed at once, so the caller can answer with its fallback instead of
+    timing out.
+    """
+
+    def __init__(self, enabled: bool = ADMISSION_ENABLED, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+                 queue_depth: int = ADMISSION_QUEUE_DEPTH, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.enabled = enabled
+        self.max_in_flight = max_in_flight
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.buckets = TokenBuckets()
+        self.in_flight = 0
+        self.waiting = {lane: 0 for lane in LANES}
+        self._waiters = []  # heap of (lane, seq, future)
+        self._seq = itertools.count()
+        self.counters = {
+            "admitted": 0,
+            "queued": 0,
+            "rate_limited": 0,
+            "queue_full": 0,
+            "queue_timeout": 0,
+            "crisis": 0,
+            "crisis_over_limit": 0,
+        }
+        self._max_waiting = 0
+        self._queue_seconds = 0.0
+
+    def lane(self, message: str) -> int:
+        return CRISIS if mentions_self_harm(message) else NORMAL
+
+    def _shed(self, reason: str):
+        self.counters[reason] += 1
+        SHED.inc(reason=reason)
+        raise Shed(reason)
+
+    def limit_rate(self, client: str):
+        """Spend one of the client's tokens; raises Shed if it has none left."""
+        if self.enabled and client and not self.buckets.take(client):
+            self._shed("rate_limited")
+
+    def _release(self):
+        # Hand the slot straight to the most urgent live waiter
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def _wait(self, lane: int):
+        if lane != CRISIS and sum(self.waiting.values()) >= self.queue_depth:
+            self._shed("queue_full")
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._seq), future))
+        self.counters["queued"] += 1
+        self.waiting[lane] += 1
+        self._max_waiting = max(self._max_waiting, sum(self.waiting.values()))
+        ADMISSION_QUEUE.set(self.waiting[lane], lane=LANES[lane])
+        start = time.perf_counter()
+        # No point queueing past the request's deadline (see deadlines.py)
+        left = remaining()
+        timeout = self.queue_timeout if left is None else max(min(self.queue_timeout, left), 0.0)
+        try:
+            with span("admission_queue"):
+                await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return  # handed a slot as the timeout fired
+            if lane == CRISIS:
+                # Never turn a crisis message away: serve it over the limit
+                self.counters["crisis_over_limit"] += 1
+                self.in_flight += 1
+                return
+            self._shed("queue_timeout")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # the client left after being handed a slot
+            raise
+        finally:
+            self.waiting[lane] -= 1
+            self._queue_seconds += time.perf_counter() - start
+            ADMISSION_QUEUE.set(self.waiting[lane], lane=LANES[lane])
+
+    @asynccontextmanager
+    async def admit(self, client: str, message: str, lane: int = None):
+        """
+        Hold an admission slot for the body; raises Shed if not admitted.
+        `lane` overrides the lane chosen from the message; without a
+        client key no rate limit applies (the caller has charged it).
+        """
+        if not self.enabled:
+            yield
+            return
+        if lane is None:
+            lane = self.lane(message)
+        if lane == CRISIS:
+            self.counters["crisis"] += 1
+        else:
+            self.limit_rate(client)
+        if self.in_flight < self.max_in_flight and not any(self.waiting.values()):
+            self.in_flight += 1
+        else:
+            await self._wait(lane)
+        self.counters["admitted"] += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        queued = self.counters["queued"]
+        return {
+            **self.counters,
+            "enabled": self.enabled,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "waiting": {LANES[lane]: n for lane, n in self.waiting.items()},
+            "max_waiting": self._max_waiting,
+            "avg_queue_wait_ms": self._queue_seconds / queued * 1000 if queued else 0.0,
+            "shed": sum(self.counters[k] for k in ("rate_limited", "queue_full", "queue_timeout")),
+            "clients_tracked": len(self.buckets),
+        }
+
+
+admission = AdmissionController()
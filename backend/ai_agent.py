@@ -1,31 +1,37 @@
-from .tools import query_medgemma, call_emergency, find_nearby_therapists
-from langchain_groq import ChatGroq
+from .tools import (THERAPY_FALLBACK, SEARCH_TIMEOUT_FALLBACK, aquery_medgemma, astream_medgemma,
+                    afind_nearby_therapists)
+from .clients import run_sync
+from .emergency import emergency_dispatcher
 from langchain_core.messages import HumanMessage, SystemMessage
-from .config import GROQ_API_KEY
+from .intent_router import route_degraded, route_locally
+from .deadlines import BACKSTOP_SLACK, DeadlineExceeded, record_exceeded, within
+from .gazetteer import NOT_A_PLACE, get_gazetteer
+from .resilience import breaker
+from .router_llm import ROUTER_MODE, ROUTER_PROMPT, get_router_llm, parse_decision, record_usage
+from .route_cache import ROUTE_CACHE_ENABLED, route_cache
+from .sessions import SESSION_ROUTER_TOKENS, USER, session_store
+from .speculation import therapy_speculator
+from .telemetry import get_logger, span
+import asyncio
+import os
 import re
+import time
 
 
-# --------------- LLM -------------------
+logger = get_logger("agent")
+
 
-# Lazy initialization - LLM will be created when first needed
-_llm = None
+# --------------- LLM -------------------
 
 def get_llm():
-    """Get or create the LLM instance."""
-    global _llm
-    if _llm is None:
-        if not GROQ_API_KEY:
-            raise ValueError("GROQ_API_KEY environment variable is not set")
-        _llm = ChatGroq(
-            model="llama-3.1-8b-instant",
-            groq_api_key=GROQ_API_KEY,
-            temperature=0.2,
-        )
-    return _llm
+    """Get the shared router LLM instance (created on first use, see router_llm.py)."""
+    return get_router_llm()
 
 
 # --------------- SYSTEM PROMPT -------------------
 
+# Free-text prompt for ROUTER_MODE=text; structured mode uses the compact
+# router_llm.ROUTER_PROMPT with a forced tool call instead
 SYSTEM_PROMPT = """
 You are a mental health AI assistant. You MUST follow these rules EXACTLY:
 
@@ -69,96 +75,344 @@ CRITICAL: When you detect emotional distress or therapist search, you MUST outpu
 
 # ---------------------- AGENT LOGIC ----------------------
 
-def get_agent_response(user_input: str) -> dict:
+TOOL_MARKERS = [
+    "ask_mental_health_specialist",
+    "emergency_call_tool",
+    "find_nearby_therapists_by_location",
+]
+
+EMERGENCY_RESPONSE = "I've immediately contacted emergency services. Please stay safe. Help is on the way. If you're in immediate danger, please call your local emergency number (911 in the US, 112 in Europe, etc.)."
+# Crisis answer when no call is placed (batch re-triage, see abatch_agent_responses)
+BATCH_EMERGENCY_RESPONSE = "This message was flagged as a crisis. No emergency call was placed for it. If you or someone else is in immediate danger, please call your local emergency number (911 in the US, 112 in Europe, etc.)."
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "32"))
+
+# Best answer per tool when the request's deadline passes while it runs
+# (the tools give their own partial answers first; see deadlines.py)
+DEADLINE_RESPONSES = {
+    "ask_mental_health_specialist": THERAPY_FALLBACK,
+    "find_nearby_therapists_by_location": SEARCH_TIMEOUT_FALLBACK,
+}
+
+ERROR_RESPONSE = "I'm here to support you. While I'm having some technical difficulties, please know that your feelings are valid. Would you like to tell me more about what you're going through?"
+
+
+def router_messages(user_input: str, session_id: str = None) -> list:
+    """Router prompt: system rules, what the user said earlier, the new message."""
+    messages = [SystemMessage(content=ROUTER_PROMPT if ROUTER_MODE == "structured" else SYSTEM_PROMPT)]
+    # Only the user's side of the history: earlier assistant replies would
+    # invite the router to answer instead of emitting a tool marker
+    summary, turns = session_store.history(session_id, SESSION_ROUTER_TOKENS, roles=(USER,))
+    earlier = " ".join([summary] + [text for _, text in turns]).strip()
+    if earlier:
+        messages.append(SystemMessage(
+            content=f"Earlier in this conversation the user said: {earlier}\n"
+                    "Use this only as context. Apply the rules to the latest message."
+        ))
+    messages.append(HumanMessage(content=user_input))
+    return messages
+
+
+async def aroute(user_input: str, session_id: str = None) -> str:
+    """
+    Decide what to do with a message. Returns the router output: either a
+    "USE_TOOL: ..." marker or a conversational reply.
+    """
+    # Obvious messages are routed locally without a Groq round trip
+    with span("local_router"):
+        response_text = route_locally(user_input)
+    
+    if response_text is not None:
+        logger.debug("routed locally", extra={"route": response_text})
+        return response_text
+    
+    # Get LLM instance (lazy initialization)
+    llm = get_llm()
+    
+    messages = router_messages(user_input, session_id)
+    
+    # Decisions that depend only on the message (no session context) are
+    # cached, including for close paraphrases
+    cacheable = ROUTE_CACHE_ENABLED and len(messages) == 2
+    if cacheable:
+        cached, probe = route_cache.lookup(user_input)
+        if cached is not None:
+            logger.debug("routed from cache", extra={"route": cached})
+            return cached
+    
+    # Get initial response from LLM. If Groq is down (open circuit, error
+    # or timeout) route with the local model instead of failing the turn.
+    start = time.perf_counter()
+    try:
+        with span("router_llm"):
+            response = await breaker("groq_router").call(lambda: llm.ainvoke(messages))
+        elapsed = time.perf_counter() - start
+        record_usage(response, elapsed)
+        # Typed decision from the tool call (or the marker in free text),
+        # rendered back into the USE_TOOL shape the rest of the agent uses
+        decision = parse_decision(response)
+    except DeadlineExceeded:
+        # Out of time: the local model's guess leaves the tool something to work with
+        record_exceeded("router")
+        return route_degraded(user_input)
+    except Exception as e:
+        response_text = route_degraded(user_input)
+        logger.warning("router LLM unavailable, routed locally", extra={"error": str(e), "route": response_text})
+        return response_text
+    response_text = decision.text
+    if cacheable:
+        route_cache.store(probe, response_text, elapsed)
+    
+    logger.debug("routed by LLM", extra={"route": response_text, "confidence": decision.confidence})
+    return response_text
+
+
+def detect_tool(response_text: str) -> str:
+    """Return the tool named in the router output, or "None"."""
+    # Check if LLM wants to use a tool (manual detection)
+    for tool in TOOL_MARKERS:
+        if f"USE_TOOL: {tool}" in response_text:
+            return tool
+    return "None"
+
+
+_CUED_LOCATION_RE = re.compile(r"\b(?:near|in|at|around)\s+([^\W\d_][\w'’.-]*(?:,?\s+[^\W\d_][\w'’.-]*){0,3})",
+                               re.IGNORECASE)
+# Words that end a place phrase ("New York please", "Boston who take insurance")
+_PLACE_END = {"please", "pls", "thanks", "thank", "today", "tonight", "now", "asap", "who", "that", "which",
+              "with", "for", "and", "or", "accepting", "taking", "if", "because"}
+
+
+def _cued_location(user_input: str) -> str:
+    """A place-like phrase after a location cue, or None."""
+    for match in _CUED_LOCATION_RE.finditer(user_input):
+        words = []
+        for word in match.group(1).split():
+            if word.lower().strip(",.") in _PLACE_END:
+                break
+            words.append(word)
+        if words and words[0].lower().strip(",.") not in NOT_A_PLACE:
+            return " ".join(words).strip(" ,.")
+    return None
+
+
+def extract_location(response_text: str, user_input: str) -> str:
+    """Location for a therapist search, or None to auto-detect."""
+    # Try to extract location from LLM response first
+    location_match = re.search(r'find_nearby_therapists_by_location\s+\[(.+?)\]', response_text)
+    
+    if location_match:
+        return location_match.group(1)
+    
+    # Extract location from user input: known place names first (one scan
+    # of the offline gazetteer), then a place-like phrase after "near X",
+    # "in X", "at X" or "around X"
+    location = None
+    gazetteer = get_gazetteer()
+    if gazetteer is not None:
+        place = gazetteer.mention(user_input)
+        if place is not None:
+            location = place["text"]
+    if location is None:
+        location = _cued_location(user_input)
+    
+    # If no location found, pass None for auto-detection
+    if not location:
+        logger.debug("no location specified, using auto-detection")
+        return None
+    logger.debug("extracted location", extra={"location": location})
+    return location
+
+
+async def arun_tool(tool_called: str, response_text: str, user_input: str, session_id: str = None,
+                    dispatch_emergency: bool = True, history_id: str = None, client_ip: str = None) -> str:
+    """
+    Run the tool chosen by the router and return the final response text.
+    With dispatch_emergency=False the emergency tool only reports its
+    decision, without claiming a call was placed (used when re-triaging
+    logged messages). history_id selects
+    the session history given to the therapy model; client_ip locates
+    "near me" therapist searches.
+    """
+    if tool_called == "ask_mental_health_specialist":
+        # Call MedGemma with what was said earlier in the session
+        return await aquery_medgemma(user_input, session_store.history(history_id))
+    
+    if tool_called == "emergency_call_tool":
+        # Queued for the dispatcher's worker; repeat messages share one call
+        if not dispatch_emergency:
+            return BATCH_EMERGENCY_RESPONSE
+        emergency_dispatcher.enqueue(session_id, user_input)
+        return EMERGENCY_RESPONSE
+    
+    if tool_called == "find_nearby_therapists_by_location":
+        location = extract_location(response_text, user_input)
+        # Call the actual function to find therapists
+        return await afind_nearby_therapists(location, client_ip=client_ip)
+    
+    return response_text
+
+
+def get_agent_response(user_input: str, session_id: str = None) -> dict:
     """
     Get response from the agent for a given user input.
     Returns a dict with 'response' and 'tool_called'.
     """
+    async def respond():
+        try:
+            return await aget_agent_response(user_input, session_id)
+        finally:
+            # The loop ends with this call, taking the dispatcher's worker
+            # with it: dial a queued emergency call before it does
+            await emergency_dispatcher.drain()
+    
+    return run_sync(respond())
+
+
+async def aget_agent_response(user_input: str, session_id: str = None, dispatch_emergency: bool = True,
+                              use_history: bool = True, client_ip: str = None, speculate: bool = True) -> dict:
+    """
+    Async version of get_agent_response. Every LLM and HTTP call is awaited,
+    so a slow upstream never blocks the server's event loop. With a
+    session_id and use_history, earlier turns of the session are given to
+    the router and therapy model and this exchange is added to them. With
+    speculate, a likely-distress message starts its therapy reply while
+    the router is still deciding (see speculation.py). Under a request
+    deadline (see deadlines.py) each stage gets only the time left, and a
+    tool still running when it passes is answered with DEADLINE_RESPONSES.
+    """
+    history_id = session_id if use_history else None
+    speculation = therapy_speculator.start(user_input, session_store.history(history_id)) if speculate else None
     try:
-        # Get LLM instance (lazy initialization)
-        llm = get_llm()
-        
-        messages = [
-            SystemMessage(content=SYSTEM_PROMPT),
-            HumanMessage(content=user_input)
-        ]
-        
-        # Get initial response from LLM
-        response = llm.invoke(messages)
-        response_text = response.content
-        
-        print(f"🤖 LLM Response: {response_text}")
-        
-        tool_called = "None"
-        final_response = response_text
-        
-        # Check if LLM wants to use a tool (manual detection)
-        if "USE_TOOL: ask_mental_health_specialist" in response_text:
-            print(f"🔧 Detected tool call: ask_mental_health_specialist")
-            tool_called = "ask_mental_health_specialist"
-            # Call MedGemma
-            tool_result = query_medgemma(user_input)
-            final_response = tool_result
-            
-        elif "USE_TOOL: emergency_call_tool" in response_text:
-            print(f"🔧 Detected tool call: emergency_call_tool")
-            tool_called = "emergency_call_tool"
-            call_emergency()
-            final_response = "I've immediately contacted emergency services. Please stay safe. Help is on the way. If you're in immediate danger, please call your local emergency number (911 in the US, 112 in Europe, etc.)."
-            
-        elif "USE_TOOL: find_nearby_therapists_by_location" in response_text:
-            print(f"🔧 Detected tool call: find_nearby_therapists_by_location")
-            tool_called = "find_nearby_therapists_by_location"
-            
-            # Try to extract location from LLM response first
-            location_match = re.search(r'find_nearby_therapists_by_location\s+\[(.+?)\]', response_text)
-            
-            if location_match:
-                location = location_match.group(1)
+        response_text = await aroute(user_input, history_id)
+        tool_called = detect_tool(response_text)
+        try:
+            if speculation is not None and tool_called == "ask_mental_health_specialist":
+                final_response = await within("agent", therapy_speculator.take(speculation), BACKSTOP_SLACK)
+                speculation = None
             else:
-                # Extract location from user input
-                # Look for patterns like "near X", "in X", "at X", "around X"
-                location_patterns = [
-                    r'(?:near|in|at|around|for)\s+([A-Za-z\s,]+?)(?:\s+(?:please|pls|thanks|thank you|\.|\?|$))',
-                    r'(?:near|in|at|around|for)\s+([A-Za-z\s,]+)',
-                    r'therapists?\s+(?:near|in|at|around)\s+([A-Za-z\s,]+)',
-                    r'(?:find|show|get|search)\s+.*?(?:near|in|at|around)\s+([A-Za-z\s,]+)',
-                ]
-                
-                location = None
-                for pattern in location_patterns:
-                    match = re.search(pattern, user_input, re.IGNORECASE)
-                    if match:
-                        location = match.group(1).strip()
-                        # Clean up common words at the end
-                        location = re.sub(r'\s+(please|pls|thanks|thank you)$', '', location, flags=re.IGNORECASE)
-                        break
-                
-                # If no location found, pass None for auto-detection
-                if not location:
-                    location = None
-                    print(f"📍 No location specified - will use auto-detection")
-                else:
-                    print(f"📍 Extracted location: {location}")
-            
-            # Call the actual function to find therapists
-            tool_result = find_nearby_therapists(location)
-            final_response = tool_result
-
+                if speculation is not None:
+                    await therapy_speculator.discard(speculation)
+                    speculation = None
+                run = arun_tool(tool_called, response_text, user_input, session_id,
+                                dispatch_emergency, history_id, client_ip)
+                # The emergency tool is never cut short
+                if tool_called in DEADLINE_RESPONSES:
+                    run = within("agent", run, BACKSTOP_SLACK)
+                final_response = await run
+        except DeadlineExceeded:
+            record_exceeded("agent")
+            final_response = DEADLINE_RESPONSES.get(tool_called, ERROR_RESPONSE)
+        session_store.add_exchange(history_id, user_input, final_response)
         
         return {
             "response": final_response,
             "tool_called": tool_called
         }
         
-    except Exception as e:
-        print(f"❌ Error in get_agent_response: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("agent response failed")
         return {
-            "response": f"I'm here to support you. While I'm having some technical difficulties, please know that your feelings are valid. Would you like to tell me more about what you're going through?",
+            "response": ERROR_RESPONSE,
             "tool_called": "Error"
         }
+    finally:
+        if speculation is not None:
+            # Routing failed or the request was cancelled
+            speculation.task.cancel()
+
+
+def get_agent_responses(messages: list, concurrency: int = None) -> list:
+    """
+    Get responses for many messages at once, in input order.
+    Emergency calls are not placed; see abatch_agent_responses.
+    """
+    async def collect():
+        results = [None] * len(messages)
+        async for index, result in abatch_agent_responses(messages, concurrency):
+            results[index] = result
+        return results
+    
+    return run_sync(collect())
+
+
+async def abatch_agent_responses(messages: list, concurrency: int = None, dispatch_emergency: bool = False,
+                                 guard=None):
+    """
+    Run the agent over a batch of messages, yielding (index, result) pairs
+    as they complete. At most `concurrency` messages are in flight,
+    identical messages are processed once, and geocode/Overpass lookups are
+    shared through their caches. Batches are usually re-triage of logged
+    traffic, so emergency calls are only placed with dispatch_emergency=True.
+    guard(text, respond) runs each message's respond() and returns its
+    result (the server uses it for admission control and deadlines).
+    """
+    semaphore = asyncio.Semaphore(concurrency or BATCH_CONCURRENCY)
+    groups = {}  # message text -> indices in the batch
+    for index, message in enumerate(messages):
+        groups.setdefault(message.strip(), []).append(index)
+    
+    async def run(text: str):
+        async with semaphore:
+            # Offline re-triage: not worth spending tokens to save latency
+            def respond():
+                return aget_agent_response(text, dispatch_emergency=dispatch_emergency, speculate=False)
+            
+            return text, await (guard(text, respond) if guard else respond())
+    
+    tasks = [asyncio.create_task(run(text)) for text in groups]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            text, result = await next_done
+            for index in groups[text]:
+                yield index, result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def astream_agent_response(user_input: str, session_id: str = None, use_history: bool = True,
+                                 client_ip: str = None):
+    """
+    Streaming version of aget_agent_response. Yields (event, data) pairs:
+    ("tool_called", name) once routing is done, then ("token", text) chunks
+    of the response. Therapy responses stream token by token; other tools
+    produce their whole response as a single chunk.
+    """
+    history_id = session_id if use_history else None
+    try:
+        response_text = await aroute(user_input, history_id)
+        tool_called = detect_tool(response_text)
+    except Exception:
+        logger.exception("streaming route failed")
+        yield "tool_called", "Error"
+        yield "token", ERROR_RESPONSE
+        return
+    
+    yield "tool_called", tool_called
+    
+    chunks = []
+    try:
+        if tool_called == "ask_mental_health_specialist":
+            async for token in astream_medgemma(user_input, session_store.history(history_id)):
+                chunks.append(token)
+                yield "token", token
+        else:
+            # The emergency tool is never cut short
+            run = arun_tool(tool_called, response_text, user_input, session_id,
+                            history_id=history_id, client_ip=client_ip)
+            try:
+                if tool_called in DEADLINE_RESPONSES:
+                    run = within("agent", run, BACKSTOP_SLACK)
+                chunks.append(await run)
+            except DeadlineExceeded:
+                record_exceeded("agent")
+                chunks.append(DEADLINE_RESPONSES[tool_called])
+            yield "token", chunks[-1]
+        session_store.add_exchange(history_id, user_input, "".join(chunks))
+    except Exception:
+        logger.exception("streaming response failed")
+        yield "token", ERROR_RESPONSE
 
 
 # ---------------------- CLI LOOP ----------------------
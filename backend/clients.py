@@ -0,0 +1,189 @@
+# Process-wide client registry: pooled HTTP, LLM and Twilio clients
+import asyncio
+import importlib.util
+import os
+import threading
+
+import httpx
+
+# httpx speaks HTTP/2 when the h2 package (httpx[http2]) is installed
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+# Backstop per request; each dependency's breaker usually applies a shorter
+# deadline (see resilience.py)
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+OLLAMA_POOL_MAX_CONNECTIONS = int(os.getenv("OLLAMA_POOL_MAX_CONNECTIONS", "16"))
+# Point the Twilio client at a different API host (e.g. a local fake)
+TWILIO_API_BASE_URL = os.getenv("TWILIO_API_BASE_URL", "")
+# Twilio's HTTP client waits forever by default; a hung dial would hold its
+# worker thread (and the emergency attempt) indefinitely
+TWILIO_TIMEOUT = float(os.getenv("TWILIO_TIMEOUT", "15"))
+
+_stats = {
+    "http_requests": 0,
+    "new_connections": 0,
+    "tls_handshakes": 0,
+    "http_clients_created": 0,
+    "ollama_clients_created": 0,
+    "groq_clients_created": 0,
+    "twilio_clients_created": 0,
+    "clients_discarded": 0,
+}
+
+
+async def _trace(event_name: str, info: dict):
+    # httpcore reports every new TCP connection and TLS handshake here
+    if event_name == "connection.connect_tcp.complete":
+        _stats["new_connections"] += 1
+    elif event_name == "connection.start_tls.complete":
+        _stats["tls_handshakes"] += 1
+
+
+async def _on_request(request: httpx.Request):
+    _stats["http_requests"] += 1
+    request.extensions["trace"] = _trace
+
+
+def _limits(max_connections: int) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=min(HTTP_POOL_MAX_KEEPALIVE, max_connections),
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+# Async clients hold connections bound to one event loop. The server runs a
+# single loop, so these are effectively singletons; the sync wrappers run a
+# fresh loop per call through run_sync(), which closes its clients before
+# the loop ends.
+_http = (None, None)  # (loop, client)
+_ollama = (None, None)
+
+
+def _replaced(current: tuple, loop) -> bool:
+    """Whether the (loop, client) pair must be replaced for `loop`."""
+    if current[0] is loop:
+        return False
+    if current[0] is not None and current[0].is_closed():
+        # Its loop ended without aclose_clients(); the connections died with it
+        _stats["clients_discarded"] += 1
+    return True
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared keep-alive client for Nominatim, Overpass and ipapi."""
+    global _http
+    loop = asyncio.get_running_loop()
+    if _replaced(_http, loop):
+        client = httpx.AsyncClient(
+            limits=_limits(HTTP_POOL_MAX_CONNECTIONS),
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            event_hooks={"request": [_on_request]},
+        )
+        _http = (loop, client)
+        _stats["http_clients_created"] += 1
+    return _http[1]
+
+
+def get_ollama_client():
+    """Shared ollama.AsyncClient with a pooled connection to the Ollama server."""
+    global _ollama
+    import ollama
+
+    loop = asyncio.get_running_loop()
+    if _replaced(_ollama, loop):
+        _ollama = (loop, ollama.AsyncClient(limits=_limits(OLLAMA_POOL_MAX_CONNECTIONS)))
+        _stats["ollama_clients_created"] += 1
+    return _ollama[1]
+
+
+_groq = {}
+
+
+def get_groq_llm(temperature: float, max_tokens: int = None):
+    """ChatGroq instance per (temperature, max_tokens), created once per process."""
+    llm = _groq.get((temperature, max_tokens))
+    if llm is None:
+        from .config import GROQ_API_KEY
+        from langchain_groq import ChatGroq
+
+        if not GROQ_API_KEY:
+            raise ValueError("GROQ_API_KEY environment variable is not set")
+        llm = _groq[(temperature, max_tokens)] = ChatGroq(
+            model="llama-3.1-8b-instant",
+            groq_api_key=GROQ_API_KEY,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        _stats["groq_clients_created"] += 1
+    return llm
+
+
+_twilio = None
+_twilio_lock = threading.Lock()
+
+
+def get_twilio_client():
+    """Twilio REST client, created once so its HTTP session is reused."""
+    global _twilio
+    # Called from worker threads, so creation is guarded
+    with _twilio_lock:
+        if _twilio is None:
+            from twilio.http.http_client import TwilioHttpClient
+            from twilio.rest import Client
+            from .config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN
+
+            client = Client(
+                TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN,
+                http_client=TwilioHttpClient(timeout=TWILIO_TIMEOUT),
+            )
+            if TWILIO_API_BASE_URL:
+                client.api.base_url = TWILIO_API_BASE_URL
+            _twilio = client
+            _stats["twilio_clients_created"] += 1
+    return _twilio
+
+
+async def aclose_clients():
+    """Close this loop's pooled async clients (called on server shutdown and by run_sync)."""
+    global _http, _ollama
+    loop = asyncio.get_running_loop()
+    # Another loop's clients (the server's, while a sync wrapper runs in a
+    # worker thread) are left alone
+    if _http[0] is loop:
+        client, _http = _http[1], (None, None)
+        await client.aclose()
+    if _ollama[0] is loop:
+        client, _ollama = _ollama[1], (None, None)
+        await client.close()
+
+
+def run_sync(coro):
+    """
+    asyncio.run() for the sync wrappers: runs `coro` on a fresh loop and
+    closes the pooled clients it opened before that loop ends.
+    """
+    async def main():
+        try:
+            return await coro
+        finally:
+            await aclose_clients()
+
+    return asyncio.run(main())
+
+
+def client_stats() -> dict:
+    requests = _stats["http_requests"]
+    reused = max(0, requests - _stats["new_connections"])
+    return {
+        **_stats,
+        "http2_enabled": HTTP2_AVAILABLE,
+        "reused_connections": reused,
+        "reuse_ratio": reused / requests if requests else 0.0,
+    }
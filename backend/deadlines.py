@@ -0,0 +1,168 @@
+# Per-request deadlines: the time left for a request, shared by every stage it runs
+import asyncio
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from .telemetry import DEADLINE_EXCEEDED, get_logger
+
+
+logger = get_logger("deadlines")
+
+
+# Seconds a request may take end to end, per endpoint. A client can ask for
+# a different budget with the X-Request-Timeout header (seconds), up to
+# DEADLINE_MAX.
+DEADLINE_ASK = float(os.getenv("DEADLINE_ASK", "20"))
+DEADLINE_ASK_STREAM = float(os.getenv("DEADLINE_ASK_STREAM", "60"))
+DEADLINE_MAX = float(os.getenv("DEADLINE_MAX", "120"))
+DEADLINE_HEADER = "x-request-timeout"
+# How long past the deadline a backstop (see ai_agent.py) waits, so the
+# stage it wraps can give its own partial answer first
+BACKSTOP_SLACK = 0.05
+
+# time.monotonic() by which the current request must be answered, or None
+deadline_var = contextvars.ContextVar("deadline", default=None)
+
+_stats = {"requests": 0, "header_overrides": 0, "invalid_headers": 0}
+_exceeded = {}  # stage -> count
+_unwinding = set()  # abandoned work still being cancelled
+_END = object()
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed; `stage` is where the work was abandoned."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"deadline exceeded in {stage}")
+        self.stage = stage
+
+
+def record_exceeded(stage: str):
+    """Count a stage abandoned (or answered with a partial result) at the deadline."""
+    _exceeded[stage] = _exceeded.get(stage, 0) + 1
+    DEADLINE_EXCEEDED.inc(stage=stage)
+    logger.info("deadline exceeded", extra={"stage": stage})
+
+
+def expires_at(header: str = None, default: float = DEADLINE_ASK) -> float:
+    """
+    When a request that arrived now must be answered: `default` seconds
+    from now, or the X-Request-Timeout value (clamped to DEADLINE_MAX).
+    """
+    _stats["requests"] += 1
+    budget = default
+    if header:
+        try:
+            requested = float(header)
+        except ValueError:
+            requested = 0.0
+        if requested > 0:
+            _stats["header_overrides"] += 1
+            budget = min(requested, DEADLINE_MAX)
+        else:
+            _stats["invalid_headers"] += 1
+    return time.monotonic() + budget
+
+
+@contextmanager
+def request_deadline(expires: float):
+    """Run the body under a deadline (never later than one already set)."""
+    current = deadline_var.get()
+    token = deadline_var.set(expires if current is None else min(current, expires))
+    try:
+        yield
+    finally:
+        deadline_var.reset(token)
+
+
+def clear_deadline():
+    """
+    Drop the deadline from the current context. Used by shared work (a
+    cache fill several requests wait on) that should not be cut short by
+    whichever request happened to start it.
+    """
+    deadline_var.set(None)
+
+
+def remaining() -> float:
+    """Seconds left before the current request's deadline, or None without one."""
+    expires = deadline_var.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+def _unwound(task: asyncio.Task):
+    _unwinding.discard(task)
+    if not task.cancelled():
+        task.exception()  # retrieved: it was abandoned on purpose
+
+
+def _abandon(task: asyncio.Task):
+    # Stop waiting now: some clients take a while to unwind a cancelled
+    # call, and the answer should not wait for that
+    task.cancel()
+    _unwinding.add(task)
+    task.add_done_callback(_unwound)
+
+
+async def within(stage: str, awaitable, slack: float = 0.0):
+    """
+    Await `awaitable` for at most the time left (plus `slack`); raises
+    DeadlineExceeded. Not counted here: the caller records it when it
+    decides what the stage answers instead.
+    """
+    budget = remaining()
+    if budget is None:
+        return await awaitable
+    budget += slack
+    if budget <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded(stage)
+    task = asyncio.ensure_future(awaitable)
+    try:
+        done, _ = await asyncio.wait((task,), timeout=budget)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if not done:
+        _abandon(task)
+        raise DeadlineExceeded(stage)
+    return task.result()
+
+
+async def _next(generator):
+    try:
+        return await generator.__anext__()
+    except StopAsyncIteration:
+        return _END
+
+
+async def iterate_within(stage: str, generator):
+    """Yield from an async generator until it ends or the deadline passes (raises DeadlineExceeded)."""
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(_next(generator))
+            item = await within(stage, step)
+            if item is _END:
+                return
+            yield item
+    finally:
+        if step is not None and not step.done():
+            # Abandoned at the deadline: close the generator once the step unwinds
+            step.add_done_callback(lambda _: _abandon(asyncio.ensure_future(generator.aclose())))
+        else:
+            await generator.aclose()
+
+
+def deadline_stats() -> dict:
+    return {
+        **_stats,
+        "ask_s": DEADLINE_ASK,
+        "ask_stream_s": DEADLINE_ASK_STREAM,
+        "max_s": DEADLINE_MAX,
+        "exceeded": dict(_exceeded),
+        "exceeded_total": sum(_exceeded.values()),
+    }
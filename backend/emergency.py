@@ -0,0 +1,284 @@
+# Emergency call dispatcher: durable SQLite queue drained by a background worker
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from .route_cache import normalize_text
+from .telemetry import get_logger
+
+
+logger = get_logger("emergency")
+
+
+EMERGENCY_QUEUE_PATH = os.getenv(
+    "EMERGENCY_QUEUE_PATH",
+    os.path.join(os.path.dirname(__file__), "data", "emergency_queue.sqlite3"),
+)
+# Repeat crisis messages from one session within this window share one call
+EMERGENCY_DEDUPE_WINDOW = int(os.getenv("EMERGENCY_DEDUPE_WINDOW", "900"))
+# Without a session, the same message within this window (a client retrying
+# after a timeout) shares one call
+EMERGENCY_MESSAGE_DEDUPE_WINDOW = int(os.getenv("EMERGENCY_MESSAGE_DEDUPE_WINDOW", "120"))
+EMERGENCY_MAX_ATTEMPTS = int(os.getenv("EMERGENCY_MAX_ATTEMPTS", "5"))
+EMERGENCY_BACKOFF_BASE = float(os.getenv("EMERGENCY_BACKOFF_BASE", "2"))
+EMERGENCY_BACKOFF_MAX = float(os.getenv("EMERGENCY_BACKOFF_MAX", "60"))
+# An attempt still dialing after this many seconds is abandoned and retried
+EMERGENCY_DIAL_TIMEOUT = float(os.getenv("EMERGENCY_DIAL_TIMEOUT", "30"))
+
+PENDING, DIALING, DELIVERED, FAILED = "pending", "dialing", "delivered", "failed"
+
+
+class EmergencyDispatcher:
+    """
+    Queues emergency calls so the request path only does a local insert.
+    A worker task dials queued calls with retry and exponential backoff,
+    each attempt in its own task so one slow dial does not hold up the rest.
+    """
+
+    def __init__(self, path: str = EMERGENCY_QUEUE_PATH, dial=None):
+        self.path = path
+        self._dial = dial  # callable returning a call SID; defaults to tools.call_emergency
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._wakeup = None
+        self._worker = None
+        self._inflight = {}  # call id -> attempt task
+        self.counters = {
+            "enqueued": 0,
+            "deduplicated": 0,
+            "delivered": 0,
+            "failed": 0,
+            "retries": 0,
+            "timeouts": 0,
+        }
+        self._dial_latency_total = 0.0
+        self._dial_latency_max = 0.0
+
+    # --------------- STORAGE -------------------
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS emergency_calls ("
+                " id TEXT PRIMARY KEY,"
+                " session_id TEXT,"
+                " status TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " enqueued_at REAL NOT NULL,"
+                " next_attempt_at REAL NOT NULL,"
+                " dialed_at REAL,"
+                " call_sid TEXT,"
+                " last_error TEXT,"
+                " message_hash TEXT)"
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(emergency_calls)")}
+            if "message_hash" not in columns:  # queue created by an older version
+                db.execute("ALTER TABLE emergency_calls ADD COLUMN message_hash TEXT")
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS emergency_calls_due"
+                " ON emergency_calls (status, next_attempt_at)"
+            )
+            # A call interrupted mid-dial by a restart is retried: a duplicate
+            # call is safer than a lost one.
+            db.execute("UPDATE emergency_calls SET status = ? WHERE status = ?", (PENDING, DIALING))
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._db_lock:
+            db = self._conn()
+            rows = db.execute(sql, params).fetchall()
+            db.commit()
+        return rows
+
+    # --------------- PUBLIC API -------------------
+
+    def enqueue(self, session_id: str = None, message: str = None) -> dict:
+        """
+        Queue an emergency call and return immediately with its record.
+        A session that already has a live call within the dedupe window gets
+        that call back instead of a new one; without a session, so does the
+        same message (normalized, stored only as a hash) within
+        EMERGENCY_MESSAGE_DEDUPE_WINDOW.
+        """
+        now = time.time()
+        message_hash = None
+        if message:
+            message_hash = hashlib.sha256(normalize_text(message).encode()).hexdigest()
+        if session_id:
+            rows = self._execute(
+                "SELECT * FROM emergency_calls WHERE session_id = ? AND status != ?"
+                " AND enqueued_at > ? ORDER BY enqueued_at DESC LIMIT 1",
+                (session_id, FAILED, now - EMERGENCY_DEDUPE_WINDOW),
+            )
+        elif message_hash:
+            rows = self._execute(
+                "SELECT * FROM emergency_calls WHERE session_id IS NULL AND message_hash = ? AND status != ?"
+                " AND enqueued_at > ? ORDER BY enqueued_at DESC LIMIT 1",
+                (message_hash, FAILED, now - EMERGENCY_MESSAGE_DEDUPE_WINDOW),
+            )
+        else:
+            rows = []
+        if rows:
+            self.counters["deduplicated"] += 1
+            return {**dict(rows[0]), "deduplicated": True}
+
+        call_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO emergency_calls (id, session_id, status, enqueued_at, next_attempt_at, message_hash)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (call_id, session_id, PENDING, now, now, message_hash),
+        )
+        self.counters["enqueued"] += 1
+        self.ensure_worker()
+        self._wakeup.set()
+        return {**self.status(call_id), "deduplicated": False}
+
+    def status(self, call_id: str) -> dict:
+        rows = self._execute("SELECT * FROM emergency_calls WHERE id = ?", (call_id,))
+        return dict(rows[0]) if rows else None
+
+    # --------------- WORKER -------------------
+
+    def ensure_worker(self):
+        """Start the worker on the running event loop if it is not running."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+    async def _stop_worker(self):
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+
+    async def stop(self):
+        await self._stop_worker()
+        # Calls cut off mid-dial are retried on the next start
+        attempts = list(self._inflight.values())
+        for task in attempts:
+            task.cancel()
+        await asyncio.gather(*attempts, return_exceptions=True)
+
+    async def drain(self):
+        """
+        Make the first attempt at every due call queued on this loop and wait
+        for it. For callers whose loop ends with the request (the sync
+        wrappers in ai_agent.py): the worker would be cancelled with the loop
+        before it dials. Calls that need a retry stay queued for the
+        server's worker.
+        """
+        if self._worker is None or self._worker.get_loop() is not asyncio.get_running_loop():
+            return  # nothing was queued on this loop
+        await self._stop_worker()
+        while True:
+            self._start_due()
+            if not self._inflight:
+                return
+            await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+
+    def _start_due(self):
+        """Start an attempt task for every call whose next attempt is due."""
+        due = self._execute(
+            "SELECT * FROM emergency_calls WHERE status = ? AND next_attempt_at <= ?"
+            " ORDER BY enqueued_at",
+            (PENDING, time.time()),
+        )
+        for row in due:
+            # Marked before the next query so a call is never dialed twice at once
+            self._execute("UPDATE emergency_calls SET status = ? WHERE id = ?", (DIALING, row["id"]))
+            task = asyncio.get_running_loop().create_task(self._attempt(dict(row)))
+            self._inflight[row["id"]] = task
+            task.add_done_callback(lambda _, call_id=row["id"]: self._attempted(call_id))
+
+    def _attempted(self, call_id: str):
+        self._inflight.pop(call_id, None)
+        if self._wakeup is not None:
+            self._wakeup.set()  # a retry may now be due sooner
+
+    async def _run(self):
+        while True:
+            self._start_due()
+
+            # Sleep until the next retry is due, a new call is queued or an
+            # attempt finishes
+            nxt = self._execute(
+                "SELECT MIN(next_attempt_at) FROM emergency_calls WHERE status = ?", (PENDING,)
+            )[0][0]
+            timeout = None if nxt is None else max(0.0, nxt - time.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _attempt(self, row: dict):
+        attempts = row["attempts"] + 1
+        try:
+            dial = self._dial
+            if dial is None:
+                from .tools import call_emergency as dial
+            # The thread cannot be interrupted; a dial that finishes after
+            # this gives up may mean a duplicate call, which is safer than none
+            call_sid = await asyncio.wait_for(asyncio.to_thread(dial), EMERGENCY_DIAL_TIMEOUT)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                self.counters["timeouts"] += 1
+                e = TimeoutError(f"no answer from the dialer after {EMERGENCY_DIAL_TIMEOUT}s")
+            logger.error("emergency call attempt failed", extra={"attempt": attempts, "error": str(e)})
+            if attempts >= EMERGENCY_MAX_ATTEMPTS:
+                status, next_at = FAILED, row["next_attempt_at"]
+                self.counters["failed"] += 1
+            else:
+                status = PENDING
+                next_at = time.time() + min(EMERGENCY_BACKOFF_MAX, EMERGENCY_BACKOFF_BASE ** attempts)
+                self.counters["retries"] += 1
+            self._execute(
+                "UPDATE emergency_calls SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?"
+                " WHERE id = ?",
+                (status, attempts, next_at, str(e), row["id"]),
+            )
+            return
+
+        dialed_at = time.time()
+        latency = dialed_at - row["enqueued_at"]
+        self._dial_latency_total += latency
+        self._dial_latency_max = max(self._dial_latency_max, latency)
+        self.counters["delivered"] += 1
+        self._execute(
+            "UPDATE emergency_calls SET status = ?, attempts = ?, dialed_at = ?, call_sid = ? WHERE id = ?",
+            (DELIVERED, attempts, dialed_at, call_sid, row["id"]),
+        )
+        logger.info("emergency call placed", extra={
+            "call_sid": call_sid, "enqueue_to_dial_ms": round(latency * 1000, 1)
+        })
+
+    def stats(self) -> dict:
+        depth = self._execute(
+            "SELECT COUNT(*) FROM emergency_calls WHERE status IN (?, ?)", (PENDING, DIALING)
+        )[0][0]
+        delivered = self.counters["delivered"]
+        return {
+            **self.counters,
+            "queue_depth": depth,
+            "worker_running": self._worker is not None and not self._worker.done(),
+            "dialing": len(self._inflight),
+            "avg_enqueue_to_dial_ms": self._dial_latency_total / delivered * 1000 if delivered else 0.0,
+            "max_enqueue_to_dial_ms": self._dial_latency_max * 1000,
+        }
+
+
+emergency_dispatcher = EmergencyDispatcher()
@@ -0,0 +1,233 @@
+# Overpass result cache keyed on geohash cell + radius bucket, served stale-while-revalidate
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .deadlines import clear_deadline
+
+
+FACILITY_CACHE_SIZE = int(os.getenv("FACILITY_CACHE_SIZE", "4096"))
+FACILITY_CACHE_FRESH_TTL = int(os.getenv("FACILITY_CACHE_FRESH_TTL", str(7 * 24 * 3600)))
+FACILITY_CACHE_STALE_TTL = int(os.getenv("FACILITY_CACHE_STALE_TTL", str(60 * 24 * 3600)))
+# An empty result (often a sparse or partial mirror answer) is kept this
+# long and never served stale
+FACILITY_CACHE_NEGATIVE_TTL = int(os.getenv("FACILITY_CACHE_NEGATIVE_TTL", str(3600)))
+# Empty to keep the cache in memory only
+FACILITY_CACHE_PATH = os.getenv("FACILITY_CACHE_PATH", "")
+
+# Search radii are rounded up to one of these (miles)
+RADIUS_BUCKETS = (1, 2, 5, 10, 25, 50, 100)
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+# --------------- GEOHASH -------------------
+
+def geohash_encode(lat: float, lon: float, precision: int) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def geohash_center(code: str) -> tuple:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for ch in code:
+        idx = _BASE32.index(ch)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (idx >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def radius_bucket(radius_miles: float) -> int:
+    for bucket in RADIUS_BUCKETS:
+        if radius_miles <= bucket:
+            return bucket
+    return RADIUS_BUCKETS[-1]
+
+
+def _precision_for(radius_miles: int) -> int:
+    # Snapping the query to the cell centre moves it by at most half a cell
+    # diagonal: ~0.7 km at geohash-6, ~3.4 km at geohash-5.
+    return 6 if radius_miles <= 10 else 5
+
+
+def cache_key(lat: float, lon: float, radius_miles: float) -> tuple:
+    """(key, snapped_lat, snapped_lon, bucket_radius) for a search."""
+    bucket = radius_bucket(radius_miles)
+    cell = geohash_encode(lat, lon, _precision_for(bucket))
+    center_lat, center_lon = geohash_center(cell)
+    return f"{cell}:{bucket}", center_lat, center_lon, bucket
+
+
+# --------------- CACHE -------------------
+
+def _retrieve(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()  # mark retrieved when every waiter has given up
+
+
+class FacilityCache:
+    """
+    LRU cache of facility lists. Entries younger than fresh_ttl are served
+    directly; entries up to stale_ttl are served immediately while a single
+    background refresh updates them. Empty lists only live for negative_ttl.
+    """
+
+    def __init__(self, max_entries: int = FACILITY_CACHE_SIZE, fresh_ttl: int = FACILITY_CACHE_FRESH_TTL,
+                 stale_ttl: int = FACILITY_CACHE_STALE_TTL, path: str = FACILITY_CACHE_PATH,
+                 negative_ttl: int = FACILITY_CACHE_NEGATIVE_TTL):
+        self.max_entries = max_entries
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.path = path
+        self._memory = OrderedDict()  # key -> (fetched_at, facilities)
+        self._inflight = {}  # key -> asyncio.Task
+        self._db = None
+        self._db_lock = threading.Lock()
+        self.counters = {
+            "fresh_hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+        }
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS facilities ("
+                " key TEXT PRIMARY KEY, facilities TEXT NOT NULL, fetched_at REAL NOT NULL)"
+            )
+            self._db = db
+        return self._db
+
+    def _get(self, key: str):
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+        if self.path:
+            with self._db_lock:
+                row = self._conn().execute(
+                    "SELECT fetched_at, facilities FROM facilities WHERE key = ?", (key,)
+                ).fetchone()
+            if row is not None:
+                entry = (row[0], json.loads(row[1]))
+                self._put_memory(key, entry)
+                return entry
+        return None
+
+    def _put_memory(self, key: str, entry: tuple):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _put(self, key: str, facilities: list):
+        entry = (time.time(), facilities)
+        self._put_memory(key, entry)
+        if self.path:
+            with self._db_lock:
+                db = self._conn()
+                db.execute(
+                    "INSERT OR REPLACE INTO facilities (key, facilities, fetched_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(facilities), entry[0]),
+                )
+                db.commit()
+
+    def _start_fetch(self, key: str, fetch, *args) -> asyncio.Task:
+        async def run():
+            # Shared by every request waiting on this key: not cut short by
+            # the deadline of the one that started it (each waiter gives up
+            # at its own, see deadlines.py)
+            clear_deadline()
+            try:
+                facilities = await fetch(*args)
+                self._put(key, facilities)
+                return facilities
+            finally:
+                self._inflight.pop(key, None)
+
+        task = asyncio.create_task(run())
+        self._inflight[key] = task
+        task.add_done_callback(_retrieve)
+        return task
+
+    def _refresh_done(self, task: asyncio.Task):
+        if task.cancelled() or task.exception() is not None:
+            # Keep serving the stale entry; the next stale hit retries
+            self.counters["refresh_errors"] += 1
+
+    async def get_or_fetch(self, lat: float, lon: float, radius_miles: float, fetch) -> list:
+        """
+        Facilities for a search, calling `await fetch(lat, lon, radius_miles)`
+        with the snapped cell centre and bucketed radius when needed.
+        """
+        key, center_lat, center_lon, bucket = cache_key(lat, lon, radius_miles)
+        entry = self._get(key)
+        now = time.time()
+
+        if entry is not None and not entry[1] and now - entry[0] >= self.negative_ttl:
+            entry = None  # an old empty result is refetched, never served stale
+        if entry is not None:
+            age = now - entry[0]
+            if age < self.fresh_ttl:
+                self.counters["fresh_hits"] += 1
+                return entry[1]
+            if age < self.stale_ttl:
+                self.counters["stale_hits"] += 1
+                if key not in self._inflight:
+                    self.counters["refreshes"] += 1
+                    task = self._start_fetch(key, fetch, center_lat, center_lon, bucket)
+                    task.add_done_callback(self._refresh_done)
+                return entry[1]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+        else:
+            self.counters["misses"] += 1
+            task = self._start_fetch(key, fetch, center_lat, center_lon, bucket)
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        lookups = sum(self.counters[k] for k in ("fresh_hits", "stale_hits", "misses", "coalesced"))
+        hits = lookups - self.counters["misses"]
+        return {
+            **self.counters,
+            "entries": len(self._memory),
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+facility_cache = FacilityCache()
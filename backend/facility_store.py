@@ -0,0 +1,390 @@
+# Offline facility store: memory-mapped columns plus a lat/lon grid index
+"""
+Answers "mental-health facilities within R of (lat, lon)" from local files
+instead of the Overpass API.
+
+Build a store with:
+    python -m backend.facility_store ingest backend/data/facilities extract.osm dump.json \
+        [--coverage SOUTH,WEST,NORTH,EAST ...]
+
+Inputs can be OSM XML extracts (.osm) or saved Overpass JSON responses in the
+shape of openstreetmap_response.json. The store only answers searches inside
+its coverage: the <bounds> of OSM XML extracts plus any --coverage boxes
+(the bbox the Overpass dumps were queried for). A dump's own facilities say
+nothing about where it is complete, so they never count as coverage.
+
+Ingest streams its inputs and sorts through temporary chunk files, so
+memory use does not grow with input size.
+"""
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from array import array
+from bisect import bisect_left
+
+import numpy as np
+
+from .ranking import haversine_many
+from .telemetry import get_logger
+
+
+logger = get_logger("facility_store")
+
+
+FACILITY_STORE_PATH = os.getenv(
+    "FACILITY_STORE_PATH",
+    os.path.join(os.path.dirname(__file__), "data", "facilities"),
+)
+
+CELL_DEG = 0.25  # grid cell size in degrees (~28 km of latitude)
+CHUNK_RECORDS = 100_000  # records per sorted run during ingest
+EARTH_RADIUS_M = 6371008.8
+
+_SPECIALITY_RE = re.compile(r"psychiatry|psychology|mental_health")
+
+
+def is_mental_health_facility(tags: dict) -> bool:
+    """Same selection as the Overpass query in tools.search_openstreetmap."""
+    if tags.get("healthcare") in ("psychotherapist", "counselling"):
+        return True
+    return (
+        tags.get("amenity") in ("doctors", "clinic")
+        and bool(_SPECIALITY_RE.search(tags.get("healthcare:speciality", "")))
+    )
+
+
+def facility_from_tags(tags: dict, lat: float, lon: float) -> dict:
+    """Facility dict in the shape used by search_openstreetmap."""
+    return {
+        "name": tags.get("name", "Mental Health Facility"),
+        "address": tags.get("addr:street", "Address not available"),
+        "city": tags.get("addr:city", ""),
+        "phone": tags.get("phone", "N/A"),
+        "website": tags.get("website", "N/A"),
+        "specialty": tags.get("healthcare:speciality", "Mental Health"),
+        "lat": lat,
+        "lon": lon,
+    }
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+# --------------- GRID -------------------
+
+_N_COLS = int(math.ceil(360 / CELL_DEG))
+_N_ROWS = int(math.ceil(180 / CELL_DEG))
+
+
+def _row(lat: float) -> int:
+    return min(_N_ROWS - 1, max(0, int((lat + 90) // CELL_DEG)))
+
+
+def _col(lon: float) -> int:
+    return int((lon + 180) // CELL_DEG) % _N_COLS
+
+
+def cell_of(lat: float, lon: float) -> int:
+    return _row(lat) * _N_COLS + _col(lon)
+
+
+def _cells_around(lat: float, lon: float, radius_m: float):
+    """Grid cells intersecting the bounding box of a circle, row by row."""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+    rows = range(_row(lat - dlat), _row(lat + dlat) + 1)
+    span = int(dlon * 2 // CELL_DEG) + 2
+    if span >= _N_COLS:
+        cols = range(_N_COLS)
+    else:
+        c0 = _col(lon - dlon)
+        cols = [(c0 + i) % _N_COLS for i in range(span)]
+    for r in rows:
+        for c in cols:
+            yield r * _N_COLS + c
+
+
+# --------------- INPUT READERS -------------------
+
+def _iter_overpass_json(path: str, chunk_size: int = 1 << 20):
+    """Stream elements out of an Overpass JSON response without loading it whole."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        # Find the start of the "elements" array
+        while True:
+            idx = buf.find('"elements"')
+            if idx >= 0:
+                bracket = buf.find("[", idx)
+                if bracket >= 0:
+                    buf = buf[bracket + 1:]
+                    break
+            data = f.read(chunk_size)
+            if not data:
+                return
+            buf += data
+
+        eof = False
+        while True:
+            buf = buf.lstrip(" \t\r\n,")
+            if buf.startswith("]"):
+                return
+            try:
+                element, end = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                data = f.read(chunk_size)
+                eof = not data
+                buf += data
+                continue
+            buf = buf[end:]
+            yield element
+
+
+def _overpass_json_facilities(path: str):
+    for element in _iter_overpass_json(path):
+        tags = element.get("tags", {})
+        if not is_mental_health_facility(tags):
+            continue
+        if element.get("type") == "node":
+            lat, lon = element.get("lat"), element.get("lon")
+        else:
+            center = element.get("center", {})
+            lat, lon = center.get("lat"), center.get("lon")
+        if lat is None or lon is None:
+            continue
+        yield f"{element.get('type')}/{element.get('id')}", lat, lon, tags
+
+
+def _osm_xml_facilities(path: str, bounds: list):
+    """
+    Two streaming passes over an OSM XML extract: the first yields matching
+    nodes and remembers node refs of matching ways, the second resolves those
+    refs so ways can be placed at the centre of their nodes.
+    """
+    wanted_ways = {}  # way id -> (tags, node refs)
+    root = None
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+        if elem.tag == "bounds":
+            bounds.append([float(elem.get(k)) for k in ("minlat", "minlon", "maxlat", "maxlon")])
+        elif elem.tag in ("node", "way"):
+            tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+            if is_mental_health_facility(tags):
+                if elem.tag == "node":
+                    yield f"node/{elem.get('id')}", float(elem.get("lat")), float(elem.get("lon")), tags
+                else:
+                    wanted_ways[elem.get("id")] = (tags, [nd.get("ref") for nd in elem.iter("nd")])
+            root.clear()
+        elif elem.tag == "relation":
+            root.clear()
+
+    if not wanted_ways:
+        return
+    needed = {ref for _, refs in wanted_ways.values() for ref in refs}
+    coords = {}
+    root = None
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+        if elem.tag == "node":
+            if elem.get("id") in needed:
+                coords[elem.get("id")] = (float(elem.get("lat")), float(elem.get("lon")))
+            root.clear()
+        elif elem.tag in ("way", "relation"):
+            root.clear()
+    for way_id, (tags, refs) in wanted_ways.items():
+        points = [coords[r] for r in refs if r in coords]
+        if not points:
+            continue
+        lat = sum(p[0] for p in points) / len(points)
+        lon = sum(p[1] for p in points) / len(points)
+        yield f"way/{way_id}", lat, lon, tags
+
+
+# --------------- INGEST -------------------
+
+def _write_run(records: list, tmpdir: str) -> str:
+    records.sort()
+    fd, path = tempfile.mkstemp(dir=tmpdir, suffix=".run")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False))
+            f.write("\n")
+    return path
+
+
+def _read_run(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+
+def ingest(out_dir: str, inputs: list, coverage: list = None) -> dict:
+    """
+    Build a facility store in `out_dir` from OSM XML and Overpass JSON files.
+    `coverage` is a list of [south, west, north, east] boxes the data is
+    known to cover, added to the <bounds> of OSM XML inputs. Overpass JSON
+    dumps carry no coverage of their own: without `coverage` their
+    facilities are stored but never answer a search on their own.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    boxes = list(coverage or [])
+    runs = []
+    seq = 0  # tie-breaker so records never compare by their dicts
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmpdir:
+        for path in inputs:
+            file_bounds = []
+            if path.endswith(".json"):
+                source = _overpass_json_facilities(path)
+            else:
+                source = _osm_xml_facilities(path, file_bounds)
+
+            chunk = []
+            for osm_key, lat, lon, tags in source:
+                chunk.append((cell_of(lat, lon), osm_key, seq, lat, lon, facility_from_tags(tags, lat, lon)))
+                seq += 1
+                if len(chunk) >= CHUNK_RECORDS:
+                    runs.append(_write_run(chunk, tmpdir))
+                    chunk = []
+            if chunk:
+                runs.append(_write_run(chunk, tmpdir))
+            for b in file_bounds:
+                if b not in boxes:
+                    boxes.append(b)
+            if not file_bounds and not coverage:
+                logger.warning("input has no coverage bounds; pass --coverage for it to answer searches",
+                               extra={"path": path})
+
+        lats, lons = array("d"), array("d")
+        offsets = array("Q", [0])
+        cells, cell_starts = array("q"), array("I")
+        count = 0
+        last_key = None
+        with open(os.path.join(out_dir, "records.jsonl"), "wb") as records:
+            for cell, osm_key, _, lat, lon, facility in heapq.merge(*(_read_run(r) for r in runs)):
+                if osm_key == last_key:
+                    continue  # same element in several inputs
+                last_key = osm_key
+                if not cells or cells[-1] != cell:
+                    cells.append(cell)
+                    cell_starts.append(count)
+                lats.append(lat)
+                lons.append(lon)
+                line = json.dumps(facility, ensure_ascii=False).encode("utf-8") + b"\n"
+                records.write(line)
+                offsets.append(offsets[-1] + len(line))
+                count += 1
+        cell_starts.append(count)
+
+    for name, column in (("lat.f8", lats), ("lon.f8", lons), ("offsets.u8", offsets),
+                         ("cells.i8", cells), ("cell_starts.u4", cell_starts)):
+        with open(os.path.join(out_dir, name), "wb") as f:
+            column.tofile(f)
+    meta = {"version": 1, "count": count, "cell_deg": CELL_DEG, "coverage": boxes}
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+
+# --------------- QUERY -------------------
+
+class FacilityStore:
+    """Read-only view of an ingested store; columns are memory-mapped."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("cell_deg") != CELL_DEG:
+            raise ValueError(f"Facility store {path} was built with a different grid size")
+        self.count = self.meta["count"]
+        self.coverage = self.meta["coverage"]
+        self._maps = []
+        self.lat = self._column(path, "lat.f8", "d")
+        self.lon = self._column(path, "lon.f8", "d")
+        self.offsets = self._column(path, "offsets.u8", "Q")
+        self.cells = self._column(path, "cells.i8", "q")
+        self.cell_starts = self._column(path, "cell_starts.u4", "I")
+        self._records = self._column(path, "records.jsonl", "B")
+        self._lat = np.frombuffer(self.lat, dtype=np.float64)
+        self._lon = np.frombuffer(self.lon, dtype=np.float64)
+
+    def _column(self, path: str, name: str, fmt: str):
+        with open(os.path.join(path, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"").cast(fmt)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mm)
+        return memoryview(mm).cast(fmt)
+
+    def covers(self, lat: float, lon: float) -> bool:
+        return any(s <= lat <= n and w <= lon <= e for s, w, n, e in self.coverage)
+
+    def record(self, i: int) -> dict:
+        return json.loads(bytes(self._records[self.offsets[i]:self.offsets[i + 1]]))
+
+    def nearby(self, lat: float, lon: float, radius_m: float, limit: int = None) -> list:
+        """Facilities within radius_m, nearest first, as (distance_m, facility)."""
+        cells = self.cells
+        ranges = []
+        for cell in _cells_around(lat, lon, radius_m):
+            k = bisect_left(cells, cell)
+            if k < len(cells) and cells[k] == cell:
+                ranges.append(np.arange(self.cell_starts[k], self.cell_starts[k + 1]))
+        if not ranges:
+            return []
+        idx = np.concatenate(ranges)
+        distance = haversine_many(lat, lon, self._lat[idx], self._lon[idx])
+        inside = distance <= radius_m
+        idx, distance = idx[inside], distance[inside]
+        order = np.argsort(distance, kind="stable")
+        if limit is not None:
+            order = order[:limit]
+        return [(float(distance[j]), self.record(int(idx[j]))) for j in order]
+
+
+_store = None
+_store_loaded = False
+
+
+def get_facility_store() -> FacilityStore:
+    """The store at FACILITY_STORE_PATH, or None if none has been built."""
+    global _store, _store_loaded
+    if not _store_loaded:
+        _store_loaded = True
+        if os.path.exists(os.path.join(FACILITY_STORE_PATH, "meta.json")):
+            _store = FacilityStore(FACILITY_STORE_PATH)
+            logger.info("loaded facility store", extra={"facilities": _store.count})
+    return _store
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    coverage = []
+    while "--coverage" in args:
+        i = args.index("--coverage")
+        coverage.append([float(v) for v in args[i + 1].split(",")])
+        del args[i:i + 2]
+    if len(args) < 3 or args[0] != "ingest" or any(len(box) != 4 for box in coverage):
+        print("Usage: python -m backend.facility_store ingest OUT_DIR INPUT [INPUT ...] "
+              "[--coverage SOUTH,WEST,NORTH,EAST ...]")
+        sys.exit(1)
+    result = ingest(args[1], args[2:], coverage)
+    print(f"Ingested {result['count']} facilities into {args[1]} ({len(result['coverage'])} coverage boxes)")
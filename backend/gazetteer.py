@@ -0,0 +1,327 @@
+# Offline place-name gazetteer: memory-mapped token trie with coordinates
+"""
+Finds place names in free text and resolves them to coordinates without a
+Nominatim call.
+
+Build a gazetteer with:
+    python -m backend.gazetteer build backend/data/gazetteer cities15000.txt places.json
+
+Inputs can be GeoNames dumps (.txt, e.g. cities15000.txt or allCountries.txt)
+or saved Overpass JSON responses of place=* nodes. Names are indexed as
+sequences of folded words (lowercase, accents removed), so multi-word and
+non-ASCII names ("Rio de Janeiro", "São Paulo", "München") are matched and
+"sao paulo" finds "São Paulo". The build holds the name index in memory;
+cities15000 (~25k places with alternate names) builds in seconds and loads
+as a few MB of memory-mapped arrays.
+"""
+import json
+import mmap
+import os
+import re
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+from .facility_store import _iter_overpass_json, haversine_m
+from .telemetry import get_logger
+
+
+logger = get_logger("gazetteer")
+
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH",
+    os.path.join(os.path.dirname(__file__), "data", "gazetteer"),
+)
+# Share of a name's population held by its top place needed to skip Nominatim
+GAZETTEER_CONFIDENCE = float(os.getenv("GAZETTEER_CONFIDENCE", "0.8"))
+
+MAX_NAME_TOKENS = 6
+# A lowercase match only counts as a place after one of these ("in hope"
+# is a place, "no hope" is not)
+LOCATION_CUES = {"in", "near", "at", "around", "from", "to", "nearby"}
+# Words that show a phrase is not a place even when a gazetteer entry has
+# that name ("in a while", "near me", "I need...", "Of course")
+NOT_A_PLACE = {"a", "an", "the", "my", "me", "your", "our", "this", "that", "it", "here", "there", "general",
+               "person", "touch", "mind", "need", "case", "order", "fact", "time", "bed", "love", "life",
+               "i", "of", "can", "you", "we", "he", "she", "they", "do", "is", "are", "so"}
+# Same-name places closer than this are one place seen in two inputs
+MERGE_DISTANCE_M = 10_000
+GEONAMES_FEATURES = {"P", "A"}  # populated places, administrative areas
+OSM_PLACES = {"city", "town", "village", "hamlet", "suburb", "county", "state", "country"}
+
+# Runs of anything but whitespace and punctuation, so combining marks in
+# Indic and other scripts stay inside their word
+_WORD_RE = re.compile(r"[^\s.,;:!?\"“”()\[\]{}<>/\\|@#$%^&*+=~`_]+")
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents so spelling variants compare equal."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> list:
+    """(folded word, start, end) for each word in the text."""
+    return [(fold(m.group()), m.start(), m.end()) for m in _WORD_RE.finditer(text)]
+
+
+# --------------- INPUT READERS -------------------
+
+def _geonames_places(path: str):
+    """(names, lat, lon, population, display name) from a GeoNames TSV dump."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 15 or cols[6] not in GEONAMES_FEATURES:
+                continue
+            names = {cols[1], cols[2]}
+            names.update(n for n in cols[3].split(",") if n and len(n) <= 60)
+            population = int(cols[14]) if cols[14].isdigit() else 0
+            display = f"{cols[1]}, {cols[8]}" if cols[8] else cols[1]
+            yield names, float(cols[4]), float(cols[5]), population, display
+
+
+def _overpass_places(path: str):
+    for element in _iter_overpass_json(path):
+        tags = element.get("tags", {})
+        if tags.get("place") not in OSM_PLACES or "name" not in tags or "lat" not in element:
+            continue
+        names = {tags["name"]}
+        names.update(v for k, v in tags.items() if k.startswith("name:") or k == "int_name")
+        names.update(n.strip() for n in tags.get("alt_name", "").split(";") if n.strip())
+        digits = re.sub(r"\D", "", tags.get("population", ""))
+        country = tags.get("is_in:country") or tags.get("addr:country", "")
+        display = f"{tags['name']}, {country}" if country else tags["name"]
+        yield names, element["lat"], element["lon"], int(digits) if digits else 0, display
+
+
+# --------------- BUILD -------------------
+
+def build(out_dir: str, inputs: list) -> dict:
+    """Build a gazetteer in `out_dir` from GeoNames (.txt) and Overpass (.json) files."""
+    places = []  # [lat, lon, population, display]
+    by_name = {}  # folded token tuple -> list of place indices
+
+    for path in inputs:
+        source = _overpass_places(path) if path.endswith(".json") else _geonames_places(path)
+        for names, lat, lon, population, display in source:
+            keys = {tuple(t for t, _, _ in tokenize(n)) for n in names}
+            keys = {k for k in keys if 0 < len(k) <= MAX_NAME_TOKENS}
+            if not keys:
+                continue
+            # Reuse a same-name place from an earlier input if it is close by
+            idx = None
+            for key in keys:
+                for i in by_name.get(key, ()):
+                    if haversine_m(lat, lon, places[i][0], places[i][1]) < MERGE_DISTANCE_M:
+                        idx = i
+                        break
+                if idx is not None:
+                    break
+            if idx is None:
+                idx = len(places)
+                places.append([lat, lon, population, display])
+            else:
+                places[idx][2] = max(places[idx][2], population)
+            for key in keys:
+                bucket = by_name.setdefault(key, [])
+                if idx not in bucket:
+                    bucket.append(idx)
+
+    # Trie over word ids; node ids are assigned breadth first so the
+    # children of each node are contiguous in the edge arrays
+    vocab = sorted({t for key in by_name for t in key})
+    token_id = {t: i for i, t in enumerate(vocab)}
+    root = {}
+    for key, indices in by_name.items():
+        node = root
+        for t in key:
+            node = node.setdefault(token_id[t], {})
+        pops = [places[i][2] for i in indices]
+        best = max(range(len(indices)), key=pops.__getitem__)
+        total = sum(pops)
+        share = pops[best] / total if total else 1.0 / len(indices)
+        node[-1] = (indices[best], share)
+
+    child_start, edge_token, edge_child = array("I", [0]), array("I"), array("I")
+    node_place, node_share = array("i"), array("f")
+    queue = [root]
+    for node in queue:  # grows while iterating: breadth-first order
+        place, share = node.get(-1, (-1, 0.0))
+        node_place.append(place)
+        node_share.append(share)
+        for tok in sorted(k for k in node if k != -1):
+            edge_token.append(tok)
+            edge_child.append(len(queue))
+            queue.append(node[tok])
+        child_start.append(len(edge_token))
+
+    os.makedirs(out_dir, exist_ok=True)
+    vocab_blob = "\n".join(vocab).encode("utf-8")
+    vocab_offsets = array("I", [0])
+    for t in vocab:
+        vocab_offsets.append(vocab_offsets[-1] + len(t.encode("utf-8")) + 1)
+    lats = array("d", (p[0] for p in places))
+    lons = array("d", (p[1] for p in places))
+    record_offsets = array("Q", [0])
+    with open(os.path.join(out_dir, "places.jsonl"), "wb") as f:
+        for p in places:
+            line = json.dumps({"display_name": p[3], "population": p[2]}, ensure_ascii=False).encode("utf-8") + b"\n"
+            f.write(line)
+            record_offsets.append(record_offsets[-1] + len(line))
+    with open(os.path.join(out_dir, "vocab.txt"), "wb") as f:
+        f.write(vocab_blob + b"\n")
+    for name, column in (("vocab_offsets.u4", vocab_offsets), ("child_start.u4", child_start),
+                         ("edge_token.u4", edge_token), ("edge_child.u4", edge_child),
+                         ("node_place.i4", node_place), ("node_share.f4", node_share),
+                         ("lat.f8", lats), ("lon.f8", lons), ("place_offsets.u8", record_offsets)):
+        with open(os.path.join(out_dir, name), "wb") as f:
+            column.tofile(f)
+    meta = {"version": 1, "places": len(places), "names": len(by_name), "tokens": len(vocab),
+            "nodes": len(node_place)}
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+
+# --------------- QUERY -------------------
+
+class _Vocab:
+    """Sorted word list read straight from the mapped vocab file (for bisect)."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1] - 1]).decode("utf-8")
+
+
+class Gazetteer:
+    """Read-only view of a built gazetteer; every array is memory-mapped."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self._maps = []
+        self.vocab = _Vocab(self._column(path, "vocab.txt", "B"), self._column(path, "vocab_offsets.u4", "I"))
+        self.child_start = self._column(path, "child_start.u4", "I")
+        self.edge_token = self._column(path, "edge_token.u4", "I")
+        self.edge_child = self._column(path, "edge_child.u4", "I")
+        self.node_place = self._column(path, "node_place.i4", "i")
+        self.node_share = self._column(path, "node_share.f4", "f")
+        self.lat = self._column(path, "lat.f8", "d")
+        self.lon = self._column(path, "lon.f8", "d")
+        self.place_offsets = self._column(path, "place_offsets.u8", "Q")
+        self._records = self._column(path, "places.jsonl", "B")
+
+    def _column(self, path: str, name: str, fmt: str):
+        with open(os.path.join(path, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"").cast(fmt)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mm)
+        return memoryview(mm).cast(fmt)
+
+    def _token_id(self, token: str) -> int:
+        k = bisect_left(self.vocab, token)
+        return k if k < len(self.vocab) and self.vocab[k] == token else -1
+
+    def _child(self, node: int, token_id: int) -> int:
+        lo, hi = self.child_start[node], self.child_start[node + 1]
+        k = bisect_left(self.edge_token, token_id, lo, hi)
+        return self.edge_child[k] if k < hi and self.edge_token[k] == token_id else -1
+
+    def place(self, node: int) -> dict:
+        i = self.node_place[node]
+        record = json.loads(bytes(self._records[self.place_offsets[i]:self.place_offsets[i + 1]]))
+        return {"lat": self.lat[i], "lon": self.lon[i], "confidence": float(self.node_share[node]), **record}
+
+    def find(self, text: str) -> list:
+        """
+        Place names in the text, longest match at each position, as dicts
+        with lat, lon, display_name, confidence and the matched span. Each
+        word is looked up once; matching walks at most MAX_NAME_TOKENS trie
+        levels from each word, so the scan is linear in the input length.
+        """
+        words = tokenize(text)
+        ids = [self._token_id(w) for w, _, _ in words]
+        matches = []
+        i = 0
+        while i < len(words):
+            node, best = 0, None
+            for j in range(i, min(len(words), i + MAX_NAME_TOKENS)):
+                node = self._child(node, ids[j]) if ids[j] >= 0 else -1
+                if node < 0:
+                    break
+                if self.node_place[node] >= 0:
+                    best = (j, node)
+            if best is None:
+                i += 1
+                continue
+            j, node = best
+            start, end = words[i][1], words[j][2]
+            matches.append({**self.place(node), "text": text[start:end], "start": start, "end": end})
+            i = j + 1
+        return matches
+
+    def mention(self, text: str) -> dict:
+        """
+        The place the text most plausibly refers to: a match after a
+        location cue, or a capitalized name of several words that does not
+        open the text (every first word is capitalized), preferring longer
+        names. Stopwords ("I", "Of") never start a place.
+        """
+        best, best_key = None, None
+        for match in self.find(text):
+            if fold(_WORD_RE.match(match["text"]).group()) in NOT_A_PLACE:
+                continue
+            before = _WORD_RE.findall(text[:match["start"]])
+            cued = bool(before) and fold(before[-1]) in LOCATION_CUES
+            if not cued and (not before or not match["text"][:1].isupper()
+                             or len(_WORD_RE.findall(match["text"])) == 1):
+                continue
+            key = (cued, match["end"] - match["start"], match["confidence"])
+            if best_key is None or key > best_key:
+                best, best_key = match, key
+        return best
+
+    def resolve(self, name: str) -> dict:
+        """The place a whole string names (e.g. a router-extracted location), or None."""
+        node = 0
+        words = tokenize(name)
+        if not words or len(words) > MAX_NAME_TOKENS:
+            return None
+        for word, _, _ in words:
+            token = self._token_id(word)
+            node = self._child(node, token) if token >= 0 else -1
+            if node < 0:
+                return None
+        return self.place(node) if self.node_place[node] >= 0 else None
+
+
+_gazetteer = None
+_gazetteer_loaded = False
+
+
+def get_gazetteer() -> Gazetteer:
+    """The gazetteer at GAZETTEER_PATH, or None if none has been built."""
+    global _gazetteer, _gazetteer_loaded
+    if not _gazetteer_loaded:
+        _gazetteer_loaded = True
+        if os.path.exists(os.path.join(GAZETTEER_PATH, "meta.json")):
+            _gazetteer = Gazetteer(GAZETTEER_PATH)
+            logger.info("loaded gazetteer", extra={"places": _gazetteer.meta["places"]})
+    return _gazetteer
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or sys.argv[1] != "build":
+        print("Usage: python -m backend.gazetteer build OUT_DIR INPUT [INPUT ...]")
+        sys.exit(1)
+    result = build(sys.argv[2], sys.argv[3:])
+    print(f"Built gazetteer with {result['places']} places and {result['names']} names into {sys.argv[2]}")
@@ -0,0 +1,197 @@
+# Geocoding cache: in-memory LRU in front of a SQLite (WAL) store
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .deadlines import clear_deadline, within
+
+
+GEOCODE_CACHE_PATH = os.getenv(
+    "GEOCODE_CACHE_PATH",
+    os.path.join(os.path.dirname(__file__), "data", "geocode_cache.sqlite3"),
+)
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "2048"))
+GEOCODE_TTL = int(os.getenv("GEOCODE_TTL", str(30 * 24 * 3600)))
+GEOCODE_NEGATIVE_TTL = int(os.getenv("GEOCODE_NEGATIVE_TTL", str(24 * 3600)))
+
+# Marker for a cached "location not found"
+NOT_FOUND = object()
+
+
+def normalize_location(location: str) -> str:
+    """Cache key for a location string: lowercase, no punctuation, single spaces."""
+    text = re.sub(r"[^\w\s]", " ", location.lower())
+    return " ".join(text.split())
+
+
+def _retrieve(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()  # mark retrieved when nobody is waiting
+
+
+class GeocodeCache:
+    """
+    Two-tier geocode cache with TTL expiry, negative caching and
+    single-flight coalescing of concurrent misses for the same key.
+    """
+
+    def __init__(self, path: str = GEOCODE_CACHE_PATH, max_entries: int = GEOCODE_CACHE_SIZE,
+                 ttl: int = GEOCODE_TTL, negative_ttl: int = GEOCODE_NEGATIVE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory = OrderedDict()  # key -> (expires_at, value or NOT_FOUND)
+        self._inflight = {}  # key -> asyncio.Task (shared fetch)
+        self._db = None
+        self._db_lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "upstream_errors": 0,
+        }
+
+    # --------------- SQLITE TIER -------------------
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                " key TEXT PRIMARY KEY, value TEXT, expires_at REAL NOT NULL)"
+            )
+            self._db = db
+        return self._db
+
+    def _disk_get(self, key: str):
+        with self._db_lock:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at < time.time():
+            return None
+        return expires_at, (NOT_FOUND if value is None else json.loads(value))
+
+    def _disk_put(self, key: str, value, expires_at: float):
+        payload = None if value is NOT_FOUND else json.dumps(value)
+        with self._db_lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO geocode (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, payload, expires_at),
+            )
+            db.commit()
+
+    def purge_expired(self) -> int:
+        """Delete expired rows from the SQLite tier."""
+        with self._db_lock:
+            db = self._conn()
+            cur = db.execute("DELETE FROM geocode WHERE expires_at < ?", (time.time(),))
+            db.commit()
+        return cur.rowcount
+
+    # --------------- MEMORY TIER -------------------
+
+    def _memory_put(self, key: str, value, expires_at: float):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def lookup(self, key: str):
+        """Return a cached value (possibly NOT_FOUND) or None on a miss."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] >= time.time():
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry[1]
+            del self._memory[key]
+
+        entry = self._disk_get(key)
+        if entry is not None:
+            self._memory_put(key, entry[1], entry[0])
+            self.counters["disk_hits"] += 1
+            return entry[1]
+        return None
+
+    def store(self, key: str, value):
+        ttl = self.negative_ttl if value is NOT_FOUND else self.ttl
+        expires_at = time.time() + ttl
+        self._memory_put(key, value, expires_at)
+        self._disk_put(key, value, expires_at)
+
+    # --------------- PUBLIC API -------------------
+
+    def _start_fetch(self, key: str, location: str, fetch) -> asyncio.Task:
+        async def run():
+            # Shared by every request waiting on this key: not cut short by
+            # the deadline of the one that started it (each waiter gives up
+            # at its own, see deadlines.py)
+            clear_deadline()
+            try:
+                result = await fetch(location)
+            except Exception:
+                # Upstream failures are not cached; waiters see the same error
+                self.counters["upstream_errors"] += 1
+                raise
+            finally:
+                self._inflight.pop(key, None)
+            self.store(key, NOT_FOUND if result is None else result)
+            return result
+
+        task = asyncio.create_task(run())
+        self._inflight[key] = task
+        task.add_done_callback(_retrieve)
+        return task
+
+    async def get_or_fetch(self, location: str, fetch):
+        """
+        Return the cached geocode for `location`, calling `await fetch(location)`
+        on a miss. `fetch` returns a dict, or None when the place is unknown.
+        Concurrent misses for the same key share a single upstream call,
+        which outlives any one caller leaving or running out of time.
+        Returns the dict, or None for "not found".
+        """
+        key = normalize_location(location)
+        value = self.lookup(key)
+        if value is not None:
+            if value is NOT_FOUND:
+                self.counters["negative_hits"] += 1
+                return None
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+        else:
+            self.counters["misses"] += 1
+            task = self._start_fetch(key, location, fetch)
+        return await within("geocode", asyncio.shield(task))
+
+    def stats(self) -> dict:
+        # negative_hits is a subset of memory_hits + disk_hits
+        lookups = sum(self.counters[k] for k in ("memory_hits", "disk_hits", "misses", "coalesced"))
+        hits = lookups - self.counters["misses"]
+        return {
+            **self.counters,
+            "memory_entries": len(self._memory),
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+geocode_cache = GeocodeCache()
@@ -0,0 +1,231 @@
+# Local GeoIP: IP range -> location from sorted, memory-mapped integer arrays
+"""
+Locates a client IP without an outbound call.
+
+Build a database from a free IP-to-city CSV with:
+    python -m backend.geoip build backend/data/geoip dbip-city-lite-2025-01.csv
+
+Supported CSVs:
+- DB-IP lite city: start_ip,end_ip,continent,country,region,city,lat,lon
+- IP2Location LITE DB5/DB11: ip_from,ip_to,country_code,country_name,region,city,lat,lon,...
+  (IPv4 as integers; the IPv6 edition as integers too)
+
+Ranges must not overlap (true of both sources). Rebuilding into the same
+directory replaces each file atomically and the server picks the new
+database up on its next reload check (or POST /geoip/reload).
+"""
+import csv
+import ipaddress
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+from .telemetry import get_logger
+
+
+logger = get_logger("geoip")
+
+GEOIP_PATH = os.getenv(
+    "GEOIP_PATH",
+    os.path.join(os.path.dirname(__file__), "data", "geoip"),
+)
+# How often lookups check whether the database on disk has been rebuilt
+GEOIP_RELOAD_INTERVAL = float(os.getenv("GEOIP_RELOAD_INTERVAL", "60"))
+
+
+# --------------- BUILD -------------------
+
+def _parse_ip(value: str):
+    value = value.strip()
+    if value.isdigit():
+        n = int(value)
+        return ipaddress.IPv4Address(n) if n < 1 << 32 else ipaddress.IPv6Address(n)
+    return ipaddress.ip_address(value)
+
+
+def _read_ranges(path: str):
+    """(start, end, location dict) rows from a DB-IP or IP2Location CSV."""
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) < 8 or row[0].startswith(("ip", "start")):
+                continue
+            try:
+                start, end = _parse_ip(row[0]), _parse_ip(row[1])
+                lat, lon = float(row[6]), float(row[7])
+            except ValueError:
+                continue
+            if row[0].strip().isdigit():  # IP2Location: code, country name, region, city
+                country, region, city = row[2], row[4], row[5]
+            else:  # DB-IP: continent, country code, region, city
+                country, region, city = row[3], row[4], row[5]
+            if country in ("-", "ZZ", ""):
+                continue
+            yield start, end, (city, region, country, lat, lon)
+
+
+def _replace(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(out_dir: str, inputs: list) -> dict:
+    """Build a GeoIP database in `out_dir` from one or more range CSVs."""
+    v4, v6 = [], []
+    locations = {}  # location tuple -> index
+    for path in inputs:
+        for start, end, location in _read_ranges(path):
+            idx = locations.setdefault(location, len(locations))
+            (v4 if start.version == 4 else v6).append((int(start), int(end), idx))
+    v4.sort()
+    v6.sort()
+
+    os.makedirs(out_dir, exist_ok=True)
+    records = bytearray()
+    offsets = array("Q", [0])
+    for city, region, country, lat, lon in locations:
+        name = ", ".join(p for p in (city, region, country) if p)
+        records += json.dumps({"name": name, "lat": lat, "lon": lon}, ensure_ascii=False).encode("utf-8") + b"\n"
+        offsets.append(len(records))
+    _replace(os.path.join(out_dir, "locations.jsonl"), bytes(records))
+    _replace(os.path.join(out_dir, "location_offsets.u8"), offsets.tobytes())
+    _replace(os.path.join(out_dir, "v4_start.u4"), array("I", (r[0] for r in v4)).tobytes())
+    _replace(os.path.join(out_dir, "v4_end.u4"), array("I", (r[1] for r in v4)).tobytes())
+    _replace(os.path.join(out_dir, "v4_loc.u4"), array("I", (r[2] for r in v4)).tobytes())
+    # IPv6 bounds as 16-byte big-endian keys, which sort like the integers
+    _replace(os.path.join(out_dir, "v6_start.b16"), b"".join(r[0].to_bytes(16, "big") for r in v6))
+    _replace(os.path.join(out_dir, "v6_end.b16"), b"".join(r[1].to_bytes(16, "big") for r in v6))
+    _replace(os.path.join(out_dir, "v6_loc.u4"), array("I", (r[2] for r in v6)).tobytes())
+    meta = {"version": 1, "v4_ranges": len(v4), "v6_ranges": len(v6), "locations": len(locations),
+            "built_at": time.time()}
+    # Written last: a new meta.json is what triggers a reload
+    _replace(os.path.join(out_dir, "meta.json"), json.dumps(meta).encode("utf-8"))
+    return meta
+
+
+# --------------- QUERY -------------------
+
+class _Keys16:
+    """16-byte keys in a mapped blob, indexable for bisect."""
+
+    def __init__(self, blob):
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.blob) // 16
+
+    def __getitem__(self, i: int) -> bytes:
+        return bytes(self.blob[i * 16:(i + 1) * 16])
+
+
+class GeoIPDatabase:
+    """Read-only view of a built database; every column is memory-mapped."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self._maps = []
+        self.v4_start = self._column(path, "v4_start.u4", "I")
+        self.v4_end = self._column(path, "v4_end.u4", "I")
+        self.v4_loc = self._column(path, "v4_loc.u4", "I")
+        self.v6_start = _Keys16(self._column(path, "v6_start.b16", "B"))
+        self.v6_end = _Keys16(self._column(path, "v6_end.b16", "B"))
+        self.v6_loc = self._column(path, "v6_loc.u4", "I")
+        self.offsets = self._column(path, "location_offsets.u8", "Q")
+        self._records = self._column(path, "locations.jsonl", "B")
+
+    def _column(self, path: str, name: str, fmt: str):
+        with open(os.path.join(path, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"").cast(fmt)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mm)
+        return memoryview(mm).cast(fmt)
+
+    def lookup(self, ip: str) -> dict:
+        """{"lat", "lon", "name"} for an IP address, or None if it is not covered."""
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        if addr.version == 4:
+            key, starts, ends, locs = int(addr), self.v4_start, self.v4_end, self.v4_loc
+        else:
+            key, starts, ends, locs = addr.packed, self.v6_start, self.v6_end, self.v6_loc
+        k = bisect_right(starts, key) - 1
+        if k < 0 or ends[k] < key:
+            return None
+        i = locs[k]
+        return json.loads(bytes(self._records[self.offsets[i]:self.offsets[i + 1]]))
+
+
+_db = None
+_db_mtime = None
+_next_check = 0.0
+_reload_lock = threading.Lock()
+_stats = {"lookups": 0, "hits": 0, "misses": 0, "reloads": 0, "lookup_time_us": 0.0}
+
+
+def reload_geoip() -> bool:
+    """(Re)open the database at GEOIP_PATH if it changed. Returns True if one is loaded."""
+    global _db, _db_mtime, _next_check
+    with _reload_lock:
+        _next_check = time.monotonic() + GEOIP_RELOAD_INTERVAL
+        meta = os.path.join(GEOIP_PATH, "meta.json")
+        try:
+            mtime = os.stat(meta).st_mtime_ns
+        except FileNotFoundError:
+            _db, _db_mtime = None, None
+            return False
+        if mtime != _db_mtime:
+            # Old mappings stay valid until no request holds the old object
+            _db, _db_mtime = GeoIPDatabase(GEOIP_PATH), mtime
+            _stats["reloads"] += 1
+            logger.info("loaded GeoIP database", extra=_db.meta)
+        return True
+
+
+def get_geoip() -> GeoIPDatabase:
+    """The database at GEOIP_PATH (re-checked every GEOIP_RELOAD_INTERVAL), or None."""
+    if time.monotonic() >= _next_check:
+        reload_geoip()
+    return _db
+
+
+def locate_ip(ip: str) -> dict:
+    """Location of a client IP from the local database, or None."""
+    db = get_geoip()
+    if db is None or not ip:
+        return None
+    start = time.perf_counter()
+    result = db.lookup(ip)
+    _stats["lookup_time_us"] += (time.perf_counter() - start) * 1e6
+    _stats["lookups"] += 1
+    _stats["hits" if result else "misses"] += 1
+    return result
+
+
+def geoip_stats() -> dict:
+    lookups = _stats["lookups"]
+    return {
+        **_stats,
+        "loaded": _db is not None,
+        "meta": _db.meta if _db is not None else None,
+        "avg_lookup_us": _stats["lookup_time_us"] / lookups if lookups else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or sys.argv[1] != "build":
+        print("Usage: python -m backend.geoip build OUT_DIR CSV [CSV ...]")
+        sys.exit(1)
+    result = build(sys.argv[2], sys.argv[3:])
+    print(f"Built GeoIP database with {result['v4_ranges']} IPv4 and {result['v6_ranges']} IPv6 ranges into {sys.argv[2]}")
@@ -0,0 +1,221 @@
+# Backend selection and hedged requests across the therapy model providers
+import asyncio
+import os
+import time
+from collections import deque
+
+from .deadlines import DeadlineExceeded
+from .resilience import Rejected
+from .telemetry import HEDGES, BACKEND_WINS, get_logger
+
+
+logger = get_logger("hedging")
+
+
+THERAPY_HEDGE_ENABLED = os.getenv("THERAPY_HEDGE_ENABLED", "true").lower() not in ("0", "false", "no")
+# The hedge fires once the primary has run for its observed p95, clamped to
+# these bounds; until HEDGE_MIN_SAMPLES replies are seen the default is used
+THERAPY_HEDGE_MIN_DELAY = float(os.getenv("THERAPY_HEDGE_MIN_DELAY", "0.25"))
+THERAPY_HEDGE_MAX_DELAY = float(os.getenv("THERAPY_HEDGE_MAX_DELAY", "8"))
+THERAPY_HEDGE_DEFAULT_DELAY = float(os.getenv("THERAPY_HEDGE_DEFAULT_DELAY", "1"))
+HEDGE_MIN_SAMPLES = int(os.getenv("THERAPY_HEDGE_MIN_SAMPLES", "20"))
+# Latency samples kept per provider, and the weight of the newest outcome
+# in the error rate
+HEALTH_WINDOW = int(os.getenv("THERAPY_HEALTH_WINDOW", "200"))
+ERROR_DECAY = 0.2
+
+
+class ProviderHealth:
+    """Recent latencies and a decaying error rate for one provider."""
+
+    __slots__ = ("name", "latencies", "error_rate", "in_flight", "calls", "errors", "wins")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = deque(maxlen=HEALTH_WINDOW)
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0
+
+    def record(self, elapsed: float, ok: bool):
+        """elapsed is None for a call refused without reaching the provider."""
+        self.calls += 1
+        if elapsed is not None:
+            self.latencies.append(elapsed)
+        self.error_rate += ERROR_DECAY * ((0.0 if ok else 1.0) - self.error_rate)
+        if not ok:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def cost(self) -> float:
+        """Expected seconds to a good reply; lower is healthier."""
+        p95 = self.quantile(0.95)
+        if p95 is None:
+            return 0.0  # untried: give it a chance
+        # An error costs a retry on the other provider
+        return p95 * (1 + 4 * self.error_rate)
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return THERAPY_HEDGE_DEFAULT_DELAY
+        return min(max(self.quantile(0.95), THERAPY_HEDGE_MIN_DELAY), THERAPY_HEDGE_MAX_DELAY)
+
+    def stats(self) -> dict:
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "wins": self.wins,
+            "in_flight": self.in_flight,
+            "error_rate": round(self.error_rate, 4),
+            "p50_ms": p50 * 1000 if p50 is not None else None,
+            "p95_ms": p95 * 1000 if p95 is not None else None,
+        }
+
+
+class Hedger:
+    """
+    Routes each request to the healthiest provider and, if it has not
+    answered within its observed p95 (or fails), starts the same request on
+    the next provider. The first good answer wins and the other is
+    cancelled. Cancelled attempts count their time so far as a latency
+    sample, so a provider that keeps losing hedges looks slow.
+    """
+
+    def __init__(self, enabled: bool = THERAPY_HEDGE_ENABLED):
+        self.enabled = enabled
+        self.providers = {}
+        self.counters = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0, "all_failed": 0}
+
+    def health(self, name: str) -> ProviderHealth:
+        if name not in self.providers:
+            self.providers[name] = ProviderHealth(name)
+        return self.providers[name]
+
+    def order(self, names: list) -> list:
+        """Provider names, healthiest first (ties keep the given order)."""
+        return sorted(names, key=lambda name: self.health(name).cost())
+
+    async def _attempt(self, name: str, factory):
+        health = self.health(name)
+        health.in_flight += 1
+        start = time.perf_counter()
+        ok = False
+        refused = False
+        abandoned = False
+        try:
+            result = await factory()
+            ok = True
+            return result
+        except asyncio.CancelledError:
+            ok = True  # lost the race; not the provider's fault
+            raise
+        except DeadlineExceeded:
+            abandoned = True  # the request ran out of time: says nothing about the provider
+            raise
+        except Rejected:
+            refused = True  # open circuit or full queue: no latency sample
+            raise
+        finally:
+            health.in_flight -= 1
+            if not abandoned:
+                health.record(None if refused else time.perf_counter() - start, ok)
+
+    async def race(self, calls: dict):
+        """
+        Run `calls` (provider name -> zero-argument coroutine factory) with
+        hedging. Returns (provider, result); raises the last error if every
+        provider failed.
+        """
+        self.counters["requests"] += 1
+        names = self.order(list(calls))
+        if not self.enabled:
+            names = names[:1]
+        pending = {}  # task -> provider name
+        error = None
+        launched = 0
+
+        def launch(reason: str = None):
+            nonlocal launched
+            name = names[launched]
+            launched += 1
+            if reason:
+                self.counters["hedged" if reason == "slow" else "failovers"] += 1
+                HEDGES.inc(reason=reason)
+            pending[asyncio.ensure_future(self._attempt(name, calls[name]))] = name
+
+        launch()
+        try:
+            while pending:
+                timeout = self.health(names[0]).hedge_delay() if launched < len(names) else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch("slow")
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        hedged = launched > 1
+                        self.health(name).wins += 1
+                        if hedged and name != names[0]:
+                            self.counters["hedge_wins"] += 1
+                        BACKEND_WINS.inc(backend=name, hedged=str(hedged).lower())
+                        return name, task.result()
+                    error = task.exception()
+                    if isinstance(error, DeadlineExceeded):
+                        raise error  # no time left for another provider either
+                    logger.warning("therapy provider failed", extra={"provider": name, "error": str(error)})
+                if not pending and launched < len(names):
+                    launch("failed")
+        finally:
+            for task in pending:
+                task.cancel()
+            # Let the losers unwind before their resources are reused
+            await asyncio.gather(*pending, return_exceptions=True)
+        self.counters["all_failed"] += 1
+        raise error
+
+    async def race_stream(self, streams: dict):
+        """
+        Hedged version of race() for async generators (provider name ->
+        zero-argument generator factory): the race is to the first chunk,
+        and the winner's remaining chunks are then yielded in order.
+        """
+        generators = {}
+
+        def first_chunk(name):
+            async def run():
+                generators[name] = streams[name]()
+                try:
+                    return await generators[name].__anext__()
+                except StopAsyncIteration:
+                    raise RuntimeError(f"{name} returned an empty reply") from None
+            return run
+
+        winner = None
+        try:
+            winner, chunk = await self.race({name: first_chunk(name) for name in streams})
+        finally:
+            for name, generator in generators.items():
+                if name != winner:
+                    await generator.aclose()
+        yield chunk
+        async for chunk in generators[winner]:
+            yield chunk
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "enabled": self.enabled,
+            "providers": {name: health.stats() for name, health in self.providers.items()},
+        }
+
+
+therapy_hedger = Hedger()
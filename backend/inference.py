@@ -0,0 +1,232 @@
+# Ollama inference manager: warm model, bounded request queue, queue vs generation timing
+import asyncio
+import os
+import time
+
+from .clients import get_ollama_client
+from .resilience import Rejected
+from .telemetry import get_logger, span
+
+
+logger = get_logger("inference")
+
+
+MEDGEMMA_MODEL = os.getenv("MEDGEMMA_MODEL", "alibayram/medgemma:4b")
+# How long Ollama keeps the model loaded after a request: seconds, a
+# duration such as "30m", or -1 to keep it loaded until the server stops
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "-1")
+# Re-sent every interval so an evicted model is reloaded before a user waits for it
+OLLAMA_PING_INTERVAL = float(os.getenv("OLLAMA_PING_INTERVAL", "240"))
+# Generations sent to Ollama at once; match the server's OLLAMA_NUM_PARALLEL
+OLLAMA_PARALLEL = int(os.getenv("OLLAMA_PARALLEL", "2"))
+# Requests allowed to wait for a slot, and how long they may wait
+OLLAMA_QUEUE_DEPTH = int(os.getenv("OLLAMA_QUEUE_DEPTH", "16"))
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "10"))
+# Context window and reply length; num_ctx is fixed when the model loads,
+# so preload and pings send the same value to avoid a reload per request
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "2048"))
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "350"))
+
+MEDGEMMA_OPTIONS = {
+    'num_ctx': OLLAMA_NUM_CTX,
+    'num_predict': OLLAMA_NUM_PREDICT,
+    'temperature': 0.7,
+    'top_p': 0.9
+}
+
+
+def _keep_alive(value: str):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+class InferenceBusy(Rejected):
+    """The Ollama queue is full or a request waited too long for a slot."""
+
+
+class OllamaInference:
+    """
+    Front door to the local Ollama server. Keeps the model loaded (preload
+    at startup plus periodic keep-alive pings) and admits at most
+    `parallel` generations at a time, with up to `queue_depth` requests
+    waiting. Requests beyond that fail fast with InferenceBusy so callers
+    can answer with their fallback instead of piling up inside Ollama.
+    """
+
+    def __init__(self, model: str = MEDGEMMA_MODEL, parallel: int = OLLAMA_PARALLEL,
+                 queue_depth: int = OLLAMA_QUEUE_DEPTH, queue_timeout: float = OLLAMA_QUEUE_TIMEOUT,
+                 keep_alive: str = OLLAMA_KEEP_ALIVE, ping_interval: float = OLLAMA_PING_INTERVAL):
+        self.model = model
+        self.parallel = parallel
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.keep_alive = _keep_alive(keep_alive)
+        self.ping_interval = ping_interval
+        self._slots = (None, None)  # (loop, semaphore)
+        self._worker = None
+        self.active = 0
+        self.waiting = 0
+        self.loaded = False
+        self.counters = {
+            "requests": 0,
+            "rejected": 0,
+            "queue_timeouts": 0,
+            "errors": 0,
+            "cancelled": 0,
+            "preloads": 0,
+            "pings": 0,
+            "warm_errors": 0,
+            "cold_loads": 0,
+        }
+        self._max_waiting = 0
+        self._queue_seconds = 0.0
+        self._generation_seconds = 0.0
+        self._load_seconds = 0.0
+        self._completed = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Bound to the running loop, like the pooled clients
+        loop = asyncio.get_running_loop()
+        if self._slots[0] is not loop:
+            self._slots = (loop, asyncio.Semaphore(self.parallel))
+        return self._slots[1]
+
+    # --------------- WARM-UP -------------------
+
+    async def warm(self) -> bool:
+        """Load the model (or refresh its keep-alive). Returns True on success."""
+        try:
+            # An empty prompt loads the model without generating anything
+            response = await get_ollama_client().generate(
+                model=self.model, prompt="", keep_alive=self.keep_alive, options={"num_ctx": OLLAMA_NUM_CTX}
+            )
+        except Exception as e:
+            self.loaded = False
+            self.counters["warm_errors"] += 1
+            logger.warning("Ollama warm-up failed", extra={"model": self.model, "error": str(e)})
+            return False
+        load_ms = (response.get("load_duration") or 0) / 1e6
+        if not self.loaded or load_ms > 100:
+            logger.info("Ollama model loaded", extra={"model": self.model, "load_ms": round(load_ms, 1)})
+        self.loaded = True
+        return True
+
+    def ensure_worker(self):
+        """Preload the model and start keep-alive pings on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._worker = loop.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+
+    async def _run(self):
+        self.counters["preloads"] += 1
+        await self.warm()
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            self.counters["pings"] += 1
+            await self.warm()
+
+    # --------------- REQUESTS -------------------
+
+    async def _acquire(self):
+        if self.waiting >= self.queue_depth:
+            self.counters["rejected"] += 1
+            raise InferenceBusy(f"Ollama queue is full ({self.waiting} waiting)")
+        semaphore = self._semaphore()
+        self.waiting += 1
+        self._max_waiting = max(self._max_waiting, self.waiting)
+        start = time.perf_counter()
+        try:
+            with span("ollama_queue"):
+                await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counters["queue_timeouts"] += 1
+            raise InferenceBusy(f"waited {self.queue_timeout:.0f}s for an Ollama slot") from None
+        finally:
+            self.waiting -= 1
+            self._queue_seconds += time.perf_counter() - start
+        self.counters["requests"] += 1
+        self.active += 1
+
+    def _release(self, start: float, response=None, outcome: str = "ok"):
+        self.active -= 1
+        self._semaphore().release()
+        if outcome != "ok":
+            self.counters[outcome] += 1  # "errors" or "cancelled"
+            return
+        self._completed += 1
+        self._generation_seconds += time.perf_counter() - start
+        load_seconds = ((response or {}).get("load_duration") or 0) / 1e9
+        self._load_seconds += load_seconds
+        if load_seconds > 0.5:
+            # The model had been evicted: this request paid for a reload
+            self.counters["cold_loads"] += 1
+
+    async def chat(self, messages: list) -> str:
+        """Reply text for a chat request. Raises InferenceBusy when no slot is free."""
+        await self._acquire()
+        start = time.perf_counter()
+        try:
+            with span("medgemma_ollama"):
+                response = await get_ollama_client().chat(
+                    model=self.model, messages=messages, options=MEDGEMMA_OPTIONS, keep_alive=self.keep_alive
+                )
+        except asyncio.CancelledError:
+            # e.g. a hedged request that lost to the other provider
+            self._release(start, outcome="cancelled")
+            raise
+        except BaseException:
+            self._release(start, outcome="errors")
+            raise
+        self._release(start, response)
+        return response['message']['content']
+
+    async def stream_chat(self, messages: list):
+        """Yield reply chunks; the slot is held until the stream ends."""
+        await self._acquire()
+        start = time.perf_counter()
+        last, outcome = None, "errors"
+        try:
+            stream = await get_ollama_client().chat(
+                model=self.model, messages=messages, options=MEDGEMMA_OPTIONS, keep_alive=self.keep_alive,
+                stream=True
+            )
+            async for chunk in stream:
+                last = chunk
+                if chunk['message']['content']:
+                    yield chunk['message']['content']
+            outcome = "ok"
+        except (GeneratorExit, asyncio.CancelledError):
+            outcome = "cancelled"  # the reader stopped; not an Ollama failure
+            raise
+        finally:
+            self._release(start, last, outcome)
+
+    def stats(self) -> dict:
+        done = self._completed
+        admitted = self.counters["requests"] + self.counters["queue_timeouts"]
+        return {
+            **self.counters,
+            "model": self.model,
+            "loaded": self.loaded,
+            "parallel": self.parallel,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_waiting": self._max_waiting,
+            "avg_queue_wait_ms": self._queue_seconds / admitted * 1000 if admitted else 0.0,
+            "avg_generation_ms": self._generation_seconds / done * 1000 if done else 0.0,
+            "avg_load_ms": self._load_seconds / done * 1000 if done else 0.0,
+        }
+
+
+ollama_inference = OllamaInference()
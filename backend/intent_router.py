@@ -0,0 +1,346 @@
+# Local intent router: resolves obvious messages without a Groq round trip
+import math
+import os
+import re
+import struct
+import time
+import zlib
+from array import array
+
+
+# Intents the router can emit. The first three map onto the USE_TOOL markers
+# the Groq router produces; "greeting" means "reply normally".
+INTENTS = (
+    "ask_mental_health_specialist",
+    "emergency_call_tool",
+    "find_nearby_therapists_by_location",
+    "greeting",
+)
+
+GREETING_REPLY = "Hello! I'm here to support you. How are you feeling today?"
+
+LOCAL_ROUTER_ENABLED = os.getenv("LOCAL_ROUTER_ENABLED", "true").lower() not in ("0", "false", "no")
+LOCAL_ROUTER_THRESHOLD = float(os.getenv("LOCAL_ROUTER_THRESHOLD", "0.85"))
+LOCAL_ROUTER_MODEL = os.getenv(
+    "LOCAL_ROUTER_MODEL",
+    os.path.join(os.path.dirname(__file__), "data", "intent_model.bin"),
+)
+
+N_BUCKETS = 1 << 12
+PHRASE_BOOST = 4.0
+_MAGIC = b"SSIR"
+
+
+# --------------- PHRASE AUTOMATON -------------------
+
+# Self-harm / suicide cues, as regex fragments matched from a word start
+# with any ending, so stems catch inflections ("overdos" -> overdosing).
+SELF_HARM_PATTERNS = [
+    r"suicid", r"kill(?:s|ed|ing)? my ?self", r"end(?:s|ed|ing)? my life", r"end(?:s|ed|ing)? it all",
+    r"take my own life", r"taking my own life", r"(?:want|wanted|wanting|wanna) (?:to )?die(?! laughing)",
+    r"(?:hurt|harm|cut|hang|starv)\w* my ?self", r"self[- ]?harm", r"overdos", r"no reason to live",
+    r"better off (?:if i (?:was|were) )?dead", r"better off without me",
+    r"(?:don'?t|do not) want to (?:live|be alive|exist)",
+    r"can'?t go on(?: anymore| like this| living| any ?longer|\s*[.!]|\s*$)",
+    r"(?:took|take|taking|swallow\w*) (?:a bunch of |all (?:of )?(?:my |the )?)?pills",
+    r"jump(?:ing)? (?:off|from) (?:a |the |my )?(?:bridge|building|roof|cliff|balcony|ledge)",
+]
+
+# Strong cue phrases per intent. Each list is compiled into a single
+# alternation, so a message is scanned once per intent.
+PHRASES = {
+    "find_nearby_therapists_by_location": [
+        "therapist", "therapists", "counselor", "counselors", "counsellor",
+        "counsellors", "psychiatrist", "psychiatrists", "psychologist",
+        "psychologists", "mental health clinic", "clinic near", "near me",
+    ],
+    "ask_mental_health_specialist": [
+        "sad", "depressed", "depression", "anxious", "anxiety", "hopeless",
+        "crying", "cry", "overwhelmed", "stressed", "stress", "worried",
+        "scared", "lonely", "alone", "panic", "exhausted", "heartbroken",
+        "miserable", "afraid", "upset", "empty", "worthless",
+    ],
+    "greeting": [
+        "hi", "hello", "hey", "hiya", "howdy", "good morning",
+        "good afternoon", "good evening", "how are you", "what's up",
+        "whats up", "sup", "yo",
+    ],
+}
+
+_PHRASE_RE = {
+    intent: re.compile(
+        r"\b(?:" + "|".join(re.escape(p) for p in sorted(phrases, key=len, reverse=True)) + r")\b",
+        re.IGNORECASE,
+    )
+    for intent, phrases in PHRASES.items()
+}
+_PHRASE_RE["emergency_call_tool"] = re.compile(r"\b(?:" + "|".join(SELF_HARM_PATTERNS) + r")", re.IGNORECASE)
+
+# A therapist search also needs a search verb or a place ("find", "near",
+# "in Pune"): "my therapist is annoying me" is not a search
+_SEARCH_CUE_RE = re.compile(
+    r"\b(?:find|finding|search|searching|look(?:ing)? for|recommend|show me|locate|where|"
+    r"near|nearby|around|close to)\b|\bin (?-i:[A-Z])",
+    re.IGNORECASE,
+)
+
+# Words a message may consist of and still be answered with the canned
+# greeting; anything else ("hey, I took pills") goes to the full router
+GREETING_WORDS = frozenset("""
+    hi hello hey hiya howdy yo sup heya hii helo good morning afternoon evening day
+    how are you u r doing going it is what's whats up there everyone all again
+    friend buddy bot dear nice to meet thanks thank ok okay
+""".split())
+
+
+# --------------- SEED CORPUS -------------------
+
+# Small labelled corpus used to fit the linear model when no model file has
+# been built. Mirrors the examples in ai_agent.SYSTEM_PROMPT.
+SEED_EXAMPLES = [
+    ("I am sad", "ask_mental_health_specialist"),
+    ("I feel depressed", "ask_mental_health_specialist"),
+    ("i feel so sad today", "ask_mental_health_specialist"),
+    ("I'm really anxious about my exams", "ask_mental_health_specialist"),
+    ("I can't stop crying", "ask_mental_health_specialist"),
+    ("everything feels hopeless", "ask_mental_health_specialist"),
+    ("I'm so stressed with work", "ask_mental_health_specialist"),
+    ("I feel overwhelmed and tired all the time", "ask_mental_health_specialist"),
+    ("I'm worried about everything", "ask_mental_health_specialist"),
+    ("I feel lonely", "ask_mental_health_specialist"),
+    ("my girlfriend left me and I feel empty", "ask_mental_health_specialist"),
+    ("I have panic attacks", "ask_mental_health_specialist"),
+    ("I feel worthless", "ask_mental_health_specialist"),
+    ("nobody understands me", "ask_mental_health_specialist"),
+    ("I am scared and upset", "ask_mental_health_specialist"),
+    ("I want to kill myself", "emergency_call_tool"),
+    ("I am thinking about suicide", "emergency_call_tool"),
+    ("I want to end my life", "emergency_call_tool"),
+    ("I've been cutting myself", "emergency_call_tool"),
+    ("I want to hurt myself", "emergency_call_tool"),
+    ("I don't want to live anymore", "emergency_call_tool"),
+    ("everyone would be better off if I was dead", "emergency_call_tool"),
+    ("I'm going to take an overdose", "emergency_call_tool"),
+    ("I feel suicidal", "emergency_call_tool"),
+    ("Find therapists near me", "find_nearby_therapists_by_location"),
+    ("I need a therapist", "find_nearby_therapists_by_location"),
+    ("Find therapists in New York", "find_nearby_therapists_by_location"),
+    ("find therapists near Pune", "find_nearby_therapists_by_location"),
+    ("I need a counselor", "find_nearby_therapists_by_location"),
+    ("show me psychiatrists in London", "find_nearby_therapists_by_location"),
+    ("any psychologists around Mumbai", "find_nearby_therapists_by_location"),
+    ("where can I find a counsellor near Bangalore", "find_nearby_therapists_by_location"),
+    ("search mental health clinics in Chicago", "find_nearby_therapists_by_location"),
+    ("recommend a therapist nearby", "find_nearby_therapists_by_location"),
+    ("Hello", "greeting"),
+    ("hi", "greeting"),
+    ("hey there", "greeting"),
+    ("how are you", "greeting"),
+    ("good morning", "greeting"),
+    ("what's up", "greeting"),
+    ("hiya", "greeting"),
+    ("hello, how are you doing", "greeting"),
+    ("good evening", "greeting"),
+    ("yo", "greeting"),
+]
+
+
+# --------------- FEATURES -------------------
+
+_TOKEN_RE = re.compile(r"[a-z']+")
+
+
+def _features(text: str) -> list:
+    """Hashed word unigrams and bigrams of the lowercased text."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    grams = tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]
+    return [zlib.crc32(g.encode()) % N_BUCKETS for g in grams]
+
+
+# --------------- MODEL -------------------
+
+class IntentModel:
+    """Linear model over hashed n-grams, stored as one flat float32 array."""
+
+    __slots__ = ("weights", "bias")
+
+    def __init__(self, weights: array = None, bias: array = None):
+        n = len(INTENTS)
+        self.weights = weights if weights is not None else array("f", bytes(4 * N_BUCKETS * n))
+        self.bias = bias if bias is not None else array("f", bytes(4 * n))
+
+    def logits(self, features: list) -> list:
+        n = len(INTENTS)
+        w = self.weights
+        scores = list(self.bias)
+        for f in features:
+            base = f * n
+            for k in range(n):
+                scores[k] += w[base + k]
+        return scores
+
+    def fit(self, examples, epochs: int = 40, lr: float = 0.5) -> "IntentModel":
+        """Multinomial logistic regression with plain SGD."""
+        n = len(INTENTS)
+        data = [(_features(text), INTENTS.index(label)) for text, label in examples]
+        for _ in range(epochs):
+            for feats, y in data:
+                probs = _softmax(self.logits(feats))
+                for k in range(n):
+                    grad = probs[k] - (1.0 if k == y else 0.0)
+                    self.bias[k] -= lr * grad
+                    for f in feats:
+                        self.weights[f * n + k] -= lr * grad
+        return self
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(_MAGIC + struct.pack("<II", N_BUCKETS, len(INTENTS)))
+            self.bias.tofile(f)
+            self.weights.tofile(f)
+
+    @classmethod
+    def load(cls, path: str) -> "IntentModel":
+        with open(path, "rb") as f:
+            header = f.read(12)
+            buckets, n = struct.unpack("<II", header[4:])
+            if header[:4] != _MAGIC or buckets != N_BUCKETS or n != len(INTENTS):
+                raise ValueError(f"Incompatible intent model file: {path}")
+            bias = array("f")
+            bias.fromfile(f, n)
+            weights = array("f")
+            weights.fromfile(f, buckets * n)
+        return cls(weights, bias)
+
+
+def _softmax(scores: list) -> list:
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+_model = None
+
+
+def get_model() -> IntentModel:
+    """Load the model file, or fit one from the seed corpus if it is missing."""
+    global _model
+    if _model is None:
+        if os.path.exists(LOCAL_ROUTER_MODEL):
+            _model = IntentModel.load(LOCAL_ROUTER_MODEL)
+        else:
+            _model = IntentModel().fit(SEED_EXAMPLES)
+    return _model
+
+
+# --------------- ROUTING -------------------
+
+_stats = {"local": 0, "fallback": 0, "local_time_us": 0.0}
+
+
+def classify(text: str) -> tuple:
+    """
+    Return (intent, confidence) from the phrase automaton plus linear model.
+    The model alone is never trusted: an intent with no cue phrase in the
+    text gets confidence 0 so unfamiliar input always goes to the LLM.
+    Emergencies always get confidence 0: a self-harm cue can be loose ("I
+    want to die laughing"), so only the LLM places a call.
+    """
+    scores = get_model().logits(_features(text))
+    matched = [bool(_PHRASE_RE[intent].search(text)) for intent in INTENTS]
+    for k, hit in enumerate(matched):
+        if hit:
+            scores[k] += PHRASE_BOOST
+    probs = _softmax(scores)
+    best = max(range(len(INTENTS)), key=probs.__getitem__)
+    intent = INTENTS[best]
+    if not matched[best]:
+        return intent, 0.0
+    if matched[INTENTS.index("emergency_call_tool")]:
+        # Neither confirm nor dismiss a self-harm cue locally
+        return intent, 0.0
+    if intent == "greeting" and not is_greeting_only(text):
+        return intent, 0.0
+    if intent == "find_nearby_therapists_by_location" and not _SEARCH_CUE_RE.search(text):
+        return intent, 0.0
+    return intent, probs[best]
+
+
+def intent_probabilities(text: str) -> dict:
+    """
+    The model's probability per intent (cue phrases included) without
+    classify's gating: a cheap hint for messages that still go to the LLM.
+    """
+    scores = get_model().logits(_features(text))
+    for k, intent in enumerate(INTENTS):
+        if _PHRASE_RE[intent].search(text):
+            scores[k] += PHRASE_BOOST
+    return dict(zip(INTENTS, _softmax(scores)))
+
+
+def is_greeting_only(text: str) -> bool:
+    """True if every word of the text is a greeting or filler word."""
+    tokens = set(_TOKEN_RE.findall(text.lower()))
+    return bool(tokens) and tokens <= GREETING_WORDS
+
+
+def mentions_self_harm(text: str) -> bool:
+    """True if the text contains any self-harm / suicide cue phrase."""
+    return bool(_PHRASE_RE["emergency_call_tool"].search(text))
+
+
+def route_locally(text: str) -> str:
+    """
+    Try to route a message without calling the LLM.
+    Returns text in the same shape as the Groq router output (a USE_TOOL
+    marker or a greeting), or None when the LLM should decide.
+    """
+    if not LOCAL_ROUTER_ENABLED:
+        return None
+    start = time.perf_counter()
+    intent, confidence = classify(text)
+    _stats["local_time_us"] += (time.perf_counter() - start) * 1e6
+
+    if confidence < LOCAL_ROUTER_THRESHOLD:
+        _stats["fallback"] += 1
+        return None
+    _stats["local"] += 1
+    if intent == "greeting":
+        return GREETING_REPLY
+    return f"USE_TOOL: {intent}"
+
+
+def route_degraded(text: str) -> str:
+    """
+    Routing when the LLM router is unavailable (error, timeout or open
+    circuit): an emergency only for a self-harm cue, never on the model's
+    guess, and the therapy model for everything else. Same output shape as
+    route_locally.
+    """
+    if mentions_self_harm(text):
+        return "USE_TOOL: emergency_call_tool"
+    return "USE_TOOL: ask_mental_health_specialist"
+
+
+def router_stats() -> dict:
+    """Counters for how much traffic the local router resolves."""
+    total = _stats["local"] + _stats["fallback"]
+    return {
+        "enabled": LOCAL_ROUTER_ENABLED,
+        "threshold": LOCAL_ROUTER_THRESHOLD,
+        "local": _stats["local"],
+        "fallback": _stats["fallback"],
+        "local_fraction": _stats["local"] / total if total else 0.0,
+        "avg_classify_us": _stats["local_time_us"] / total if total else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    # python -m backend.intent_router [output_path]
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else LOCAL_ROUTER_MODEL
+    IntentModel().fit(SEED_EXAMPLES).save(path)
+    print(f"Saved intent model to {path}")
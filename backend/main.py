@@ -1,10 +1,78 @@
 # Step1: Setup FastAPI backend
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
-from .ai_agent import get_agent_response
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from .ai_agent import ERROR_RESPONSE, aget_agent_response, astream_agent_response, abatch_agent_responses
+from .admission import BATCH, Shed, admission
+from .deadlines import (
+    DEADLINE_ASK, DEADLINE_ASK_STREAM, DEADLINE_HEADER, deadline_stats, expires_at, request_deadline
+)
+from .intent_router import router_stats
+from .route_cache import route_cache
+from .geocache import geocode_cache
+from .facility_cache import facility_cache
+from . import tools
+from .tools import gazetteer_stats
+from .clients import aclose_clients, client_stats, get_twilio_client
+from .emergency import emergency_dispatcher
+from .sessions import session_store
+from .geoip import geoip_stats, reload_geoip
+from .overpass import overpass_stats
+from .resilience import breaker_stats
+from .router_llm import router_llm_stats
+from .speculation import therapy_speculator
+from .inference import ollama_inference
+from .hedging import therapy_hedger
+from .telemetry import (
+    IN_FLIGHT, REQUEST_LATENCY, TOOL_CALLS, get_logger, new_trace_id, render_metrics, trace_id_var
+)
 
-app = FastAPI(title="SafeSpace AI Agent API", version="1.0.0")
+
+logger = get_logger("api")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create the Twilio client up front so the first emergency call does not
+    # pay for it, then pick up calls still queued from before a restart
+    await asyncio.to_thread(get_twilio_client)
+    await asyncio.to_thread(reload_geoip)
+    emergency_dispatcher.ensure_worker()
+    if tools.OLLAMA_AVAILABLE:
+        # Loads MedGemma in the background and keeps it loaded
+        ollama_inference.ensure_worker()
+    yield
+    await ollama_inference.stop()
+    await emergency_dispatcher.stop()
+    await aclose_clients()
+
+
+app = FastAPI(title="SafeSpace AI Agent API", version="1.0.0", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Give every request a trace ID (X-Request-ID if supplied) and time it."""
+    trace_id = request.headers.get("x-request-id") or new_trace_id()
+    token = trace_id_var.set(trace_id)
+    IN_FLIGHT.inc()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        IN_FLIGHT.dec()
+        # Label by route template so /emergency/{call_id} is one series
+        route = request.scope.get("route")
+        REQUEST_LATENCY.observe(time.perf_counter() - start, path=getattr(route, "path", "unmatched"))
+        trace_id_var.reset(token)
+    response.headers["X-Request-ID"] = trace_id
+    return response
 
 
 @app.get("/")
@@ -15,7 +83,12 @@ async def root():
         "endpoints": {
             "docs": "/docs",
             "ask": "/ask (POST)",
-            "health": "/health (GET)"
+            "ask_stream": "/ask/stream (POST, Server-Sent Events)",
+            "ask_batch": "/ask/batch (POST, NDJSON)",
+            "health": "/health (GET)",
+            "stats": "/stats (GET)",
+            "geoip_reload": "/geoip/reload (POST)",
+            "metrics": "/metrics (GET, Prometheus)"
         }
     }
 
@@ -26,42 +99,242 @@ async def health():
     return {"status": "healthy", "service": "safespace-ai-agent"}
 
 
+@app.get("/stats")
+async def stats():
+    """Runtime counters for the agent's internal stages."""
+    return {
+        "admission": admission.stats(),
+        "local_router": router_stats(),
+        "router_llm": router_llm_stats(),
+        "route_cache": route_cache.stats(),
+        "geocode_cache": geocode_cache.stats(),
+        "gazetteer": gazetteer_stats(),
+        "facility_cache": facility_cache.stats(),
+        "overpass": overpass_stats(),
+        "ollama": ollama_inference.stats(),
+        "therapy_hedging": therapy_hedger.stats(),
+        "speculation": therapy_speculator.stats(),
+        "breakers": breaker_stats(),
+        "deadlines": deadline_stats(),
+        "clients": client_stats(),
+        "emergency": emergency_dispatcher.stats(),
+        "sessions": session_store.stats(),
+        "geoip": geoip_stats()
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Stage latency histograms and counters in Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/geoip/reload")
+async def geoip_reload():
+    """Re-open the GeoIP database now if it has been rebuilt on disk."""
+    loaded = await asyncio.to_thread(reload_geoip)
+    return {"loaded": loaded, **geoip_stats()}
+
+
+@app.get("/emergency/{call_id}")
+async def emergency_status(call_id: str):
+    """Delivery status of a queued emergency call."""
+    status = emergency_dispatcher.status(call_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown emergency call")
+    return status
+
+
 # Step2: Receive and validate request from Frontend
 
 class Query(BaseModel):
     message: str
+    # Conversation history is kept per session_id; without one each message stands alone
+    session_id: str | None = None
+
+
+# Proxies in front of the app that append to X-Forwarded-For. 0 (the
+# default) keys on the peer address, since without a proxy the header is
+# whatever the client sent; set 1 behind Render and similar hosts.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+
+def client_ip(request: Request) -> str:
+    """
+    The user's address as they claim it: the first hop in X-Forwarded-For,
+    else the peer address. Only used to locate the user (see geoip.py): the
+    client can put anything there.
+    """
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    real_ip = request.headers.get("x-real-ip")
+    if real_ip:
+        return real_ip.strip()
+    return request.client.host if request.client else None
+
+
+def admission_key(request: Request) -> str:
+    """
+    The address rate limits are keyed on: the hop added by the outermost
+    trusted proxy (TRUSTED_PROXY_HOPS from the right of X-Forwarded-For),
+    which a client cannot forge, or the peer address when no proxy is
+    trusted.
+    """
+    forwarded = request.headers.get("x-forwarded-for")
+    if TRUSTED_PROXY_HOPS > 0 and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(",")]
+        return hops[max(len(hops) - TRUSTED_PROXY_HOPS, 0)]
+    return request.client.host if request.client else None
+
+
+# Answer to a request shed by admission control (see admission.py)
+SHED_RESPONSE = {"response": ERROR_RESPONSE, "tool_called": "Shed"}
+
 
 @app.post("/ask")
-async def ask(query: Query):
+async def ask(query: Query, request: Request):
+    # Every stage gets what is left of this (see deadlines.py)
+    expires = expires_at(request.headers.get(DEADLINE_HEADER), DEADLINE_ASK)
     try:
-        print(f"\n{'='*50}")
-        print(f"📥 Received message: {query.message}")
-        print(f"{'='*50}\n")
+        logger.info("ask received", extra={"chars": len(query.message)})
         
         # Get response from agent
-        result = get_agent_response(query.message)
+        # History and emergency-call dedupe are keyed on the client's own
+        # session_id; clients behind one address never share either
+        with request_deadline(expires):
+            async with admission.admit(admission_key(request), query.message):
+                result = await aget_agent_response(
+                    query.message, query.session_id, use_history=query.session_id is not None,
+                    client_ip=client_ip(request)
+                )
         
-        print(f"✅ Response: {result['response'][:100]}...")
-        print(f"🔧 Tool called: {result['tool_called']}\n")
+        TOOL_CALLS.inc(tool=result["tool_called"])
+        logger.info("ask answered", extra={"tool_called": result["tool_called"]})
         
         # Step3: Send response to the frontend
         return {
             "response": result["response"],
             "tool_called": result["tool_called"]
         }
+    except Shed as e:
+        TOOL_CALLS.inc(tool="Shed")
+        logger.info("ask shed", extra={"reason": e.reason})
+        return SHED_RESPONSE
     except Exception as e:
-        print(f"\n{'='*50}")
-        print(f"❌ ERROR in /ask endpoint: {str(e)}")
-        print(f"{'='*50}")
-        import traceback
-        traceback.print_exc()
-        print(f"{'='*50}\n")
+        logger.exception("ask failed")
+        TOOL_CALLS.inc(tool="Error")
         return {
             "response": f"Sorry, I encountered an error: {str(e)}",
             "tool_called": "Error"
         }
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/ask/stream")
+async def ask_stream(query: Query, request: Request):
+    """
+    Stream the agent's answer as Server-Sent Events:
+    - tool_called: {"tool_called": ...} as soon as routing is done
+    - token: {"text": ...} for each chunk of the response
+    - done: {"tool_called", "ttft_ms", "total_ms"} at the end
+    The whole stream is bounded by DEADLINE_ASK_STREAM seconds, or the
+    X-Request-Timeout header (see deadlines.py).
+    """
+    logger.info("ask/stream received", extra={"chars": len(query.message)})
+    expires = expires_at(request.headers.get(DEADLINE_HEADER), DEADLINE_ASK_STREAM)
+    
+    async def events():
+        start = time.perf_counter()
+        ttft_ms = None
+        tool_called = "None"
+        try:
+            # The slot is held until the stream ends
+            with request_deadline(expires):
+                async with admission.admit(admission_key(request), query.message):
+                    async for event, data in astream_agent_response(
+                        query.message, query.session_id, use_history=query.session_id is not None,
+                        client_ip=client_ip(request)
+                    ):
+                        if event == "tool_called":
+                            tool_called = data
+                            yield _sse("tool_called", {"tool_called": data})
+                        else:
+                            if ttft_ms is None:
+                                ttft_ms = (time.perf_counter() - start) * 1000
+                            yield _sse("token", {"text": data})
+        except Shed as e:
+            tool_called = SHED_RESPONSE["tool_called"]
+            ttft_ms = (time.perf_counter() - start) * 1000
+            logger.info("ask/stream shed", extra={"reason": e.reason})
+            yield _sse("tool_called", {"tool_called": tool_called})
+            yield _sse("token", {"text": SHED_RESPONSE["response"]})
+        total_ms = (time.perf_counter() - start) * 1000
+        TOOL_CALLS.inc(tool=tool_called)
+        logger.info("ask/stream answered", extra={
+            "tool_called": tool_called, "ttft_ms": round(ttft_ms or 0, 1), "total_ms": round(total_ms, 1)
+        })
+        yield _sse("done", {"tool_called": tool_called, "ttft_ms": ttft_ms, "total_ms": total_ms})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+class BatchQuery(BaseModel):
+    messages: list[str]
+    concurrency: int | None = None
+
+
+MAX_BATCH_CONCURRENCY = 128
+MAX_BATCH_MESSAGES = 1000
+
+
+@app.post("/ask/batch")
+async def ask_batch(batch: BatchQuery, request: Request):
+    """
+    Run the agent over many messages. Results are streamed back as NDJSON,
+    one {"index", "message", "response", "tool_called"} line per message,
+    in completion order. Emergency calls are not placed for batch input.
+    The batch costs its client one rate-limit token; each message then
+    waits for an admission slot in the batch lane, behind /ask traffic,
+    and gets its own DEADLINE_ASK (or X-Request-Timeout) budget.
+    """
+    if len(batch.messages) > MAX_BATCH_MESSAGES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_MESSAGES} messages per batch")
+    try:
+        admission.limit_rate(admission_key(request))
+    except Shed:
+        raise HTTPException(status_code=429, detail="Too many requests") from None
+    concurrency = min(batch.concurrency, MAX_BATCH_CONCURRENCY) if batch.concurrency else None
+    timeout_header = request.headers.get(DEADLINE_HEADER)
+    logger.info("ask/batch received", extra={"messages": len(batch.messages)})
+    
+    async def admitted(text: str, respond):
+        with request_deadline(expires_at(timeout_header, DEADLINE_ASK)):
+            try:
+                async with admission.admit(None, text, lane=BATCH):
+                    return await respond()
+            except Shed:
+                return SHED_RESPONSE
+    
+    async def lines():
+        async for index, result in abatch_agent_responses(batch.messages, concurrency, guard=admitted):
+            TOOL_CALLS.inc(tool=result["tool_called"])
+            yield json.dumps({
+                "index": index,
+                "message": batch.messages[index],
+                "response": result["response"],
+                "tool_called": result["tool_called"]
+            }) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
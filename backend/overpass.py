@@ -0,0 +1,176 @@
+# Overpass API client: one compact query per radius step, with mirror failover
+"""
+Builds the facility query sent to Overpass and runs it.
+
+- The eight node/way clauses are folded into two `nwr` clauses with
+  combined tag regexes, so the `around` filter is evaluated twice instead
+  of eight times.
+- A global `[bbox:]` around the search circle lets Overpass use its
+  spatial index before the exact `around` distance test.
+- `[timeout:]`/`[maxsize:]` are set to what a facility search needs, and
+  `out tags center` leaves out way node lists we never read.
+- The search starts at a small radius and only widens (up to the
+  requested radius) while fewer than OVERPASS_MIN_RESULTS come back.
+- Mirrors are tried in turn; the last one that answered is tried first.
+  Each mirror has its own circuit breaker and latency-derived timeout
+  (see resilience.py), so one failing mirror does not open the circuit
+  on the others.
+"""
+import math
+import os
+import time
+
+from .clients import get_http_client
+from .deadlines import DeadlineExceeded
+from .facility_store import facility_from_tags
+from .resilience import breaker
+from .telemetry import get_logger, span
+
+
+logger = get_logger("overpass")
+
+OVERPASS_URL = os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+# Comma-separated fallbacks, tried after OVERPASS_URL fails
+OVERPASS_MIRRORS = [
+    url.strip()
+    for url in os.getenv(
+        "OVERPASS_MIRRORS",
+        "https://overpass.kumi.systems/api/interpreter,https://overpass.private.coffee/api/interpreter",
+    ).split(",")
+    if url.strip()
+]
+# Elements fetched per query; ranking picks the best few out of these
+OVERPASS_CANDIDATES = int(os.getenv("OVERPASS_CANDIDATES", "200"))
+# Server-side limits: seconds and bytes of memory
+OVERPASS_TIMEOUT = int(os.getenv("OVERPASS_TIMEOUT", "25"))
+OVERPASS_MAXSIZE = int(os.getenv("OVERPASS_MAXSIZE", str(64 * 1024 * 1024)))
+# Radii (miles) tried below the requested one, smallest first
+OVERPASS_RADIUS_STEPS = [float(r) for r in os.getenv("OVERPASS_RADIUS_STEPS", "5,10").split(",") if r.strip()]
+OVERPASS_MIN_RESULTS = int(os.getenv("OVERPASS_MIN_RESULTS", "5"))
+
+METERS_PER_MILE = 1609.34
+
+# No point waiting longer than the server-side limit plus transfer time
+_TIMEOUTS = (OVERPASS_TIMEOUT + 5, 5.0, OVERPASS_TIMEOUT + 5)
+
+# Tag filters of a mental-health facility, one nwr clause each
+_SELECTORS = (
+    '["healthcare"~"^(psychotherapist|counselling)$"]',
+    '["amenity"~"^(doctors|clinic)$"]["healthcare:speciality"~"psychiatry|psychology|mental_health"]',
+)
+
+_preferred = 0  # index of the mirror that answered last
+_stats = {
+    "searches": 0,
+    "queries": 0,
+    "widenings": 0,
+    "failovers": 0,
+    "errors": 0,
+    "bytes": 0,
+    "server_seconds": 0.0,
+}
+
+
+def overpass_urls() -> list:
+    return [OVERPASS_URL] + [url for url in OVERPASS_MIRRORS if url != OVERPASS_URL]
+
+
+def mirror_breaker(k: int):
+    """Breaker of the k-th URL in overpass_urls()."""
+    return breaker(f"overpass:{k}", _TIMEOUTS)
+
+
+def bbox_around(lat: float, lon: float, radius_m: float) -> tuple:
+    """(south, west, north, east) of a box containing the circle."""
+    dlat = radius_m / 111_320
+    dlon = radius_m / (111_320 * max(math.cos(math.radians(lat)), 0.01))
+    return max(lat - dlat, -90.0), max(lon - dlon, -180.0), min(lat + dlat, 90.0), min(lon + dlon, 180.0)
+
+
+def build_query(lat: float, lon: float, radius_m: int, limit: int = OVERPASS_CANDIDATES) -> str:
+    """Overpass QL for mental-health facilities within radius_m of (lat, lon)."""
+    south, west, north, east = bbox_around(lat, lon, radius_m)
+    around = f"(around:{radius_m},{lat:.6f},{lon:.6f})"
+    clauses = "".join(f"nwr{selector}{around};" for selector in _SELECTORS)
+    return (
+        f"[out:json][timeout:{OVERPASS_TIMEOUT}][maxsize:{OVERPASS_MAXSIZE}]"
+        f"[bbox:{south:.6f},{west:.6f},{north:.6f},{east:.6f}];"
+        f"({clauses});out tags center {limit};"
+    )
+
+
+def radius_steps(radius_miles: float) -> list:
+    return [r for r in OVERPASS_RADIUS_STEPS if r < radius_miles] + [radius_miles]
+
+
+async def run_query(query: str) -> dict:
+    """
+    POST a query, failing over across mirrors (skipping any whose circuit
+    is open). Raises the last error if all fail.
+    """
+    global _preferred
+    urls = overpass_urls()
+    client = get_http_client()
+    error = None
+    for attempt in range(len(urls)):
+        k = (_preferred + attempt) % len(urls)
+        start = time.perf_counter()
+
+        async def fetch():
+            response = await client.post(urls[k], data={"data": query})
+            response.raise_for_status()
+            data = response.json()
+            # Timeouts and memory limits hit mid-query come back as a 200
+            # with a remark and partial (or no) elements
+            remark = data.get("remark", "")
+            if "error" in remark:
+                raise RuntimeError(remark)
+            return response, data
+
+        try:
+            with span("overpass", mirror=k):
+                response, data = await mirror_breaker(k).call(fetch)
+        except DeadlineExceeded:
+            raise  # no time left to try another mirror
+        except Exception as e:
+            error = e
+            _stats["failovers" if attempt + 1 < len(urls) else "errors"] += 1
+            logger.warning("Overpass query failed", extra={"mirror": urls[k], "error": str(e)})
+            continue
+        _preferred = k
+        _stats["queries"] += 1
+        _stats["bytes"] += len(response.content)
+        _stats["server_seconds"] += time.perf_counter() - start
+        return data
+    raise error
+
+
+def _facility(element: dict) -> dict:
+    point = element if "lat" in element else element.get("center", {})
+    return facility_from_tags(element.get("tags", {}), point.get("lat"), point.get("lon"))
+
+
+async def search(lat: float, lon: float, radius_miles: float) -> list:
+    """
+    Facility dicts within radius_miles of (lat, lon), from the smallest
+    radius step that yields OVERPASS_MIN_RESULTS (raises on failure).
+    """
+    _stats["searches"] += 1
+    steps = radius_steps(radius_miles)
+    for i, radius in enumerate(steps):
+        data = await run_query(build_query(lat, lon, int(radius * METERS_PER_MILE)))
+        facilities = [_facility(element) for element in data.get("elements", [])]
+        if len(facilities) >= OVERPASS_MIN_RESULTS or i + 1 == len(steps):
+            return facilities
+        _stats["widenings"] += 1
+
+
+def overpass_stats() -> dict:
+    searches = _stats["searches"]
+    return {
+        **_stats,
+        "mirrors": overpass_urls(),
+        "preferred_mirror": _preferred,
+        "avg_bytes_per_search": _stats["bytes"] / searches if searches else 0.0,
+        "avg_server_ms_per_search": _stats["server_seconds"] / searches * 1000 if searches else 0.0,
+    }
@@ -0,0 +1,104 @@
+# Facility ranking: vectorized distance, de-duplication and scoring of candidates
+import os
+import re
+
+import numpy as np
+
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_MILE = 1609.34
+
+# Same-name facilities closer than this are one place (e.g. an OSM node and
+# the way drawn around the same building)
+DEDUPE_DISTANCE_M = float(os.getenv("RANKING_DEDUPE_DISTANCE_M", "150"))
+# Score = DISTANCE_WEIGHT * closeness + (1 - DISTANCE_WEIGHT) * tag completeness
+DISTANCE_WEIGHT = float(os.getenv("RANKING_DISTANCE_WEIGHT", "0.7"))
+
+# facility_from_tags fills missing tags with these placeholders
+_MISSING = {"phone": "N/A", "website": "N/A", "address": "Address not available"}
+_NAME_RE = re.compile(r"[^\w]+")
+
+
+def haversine_many(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Distances in meters from one point to arrays of points."""
+    p1 = np.radians(lat)
+    p2 = np.radians(lats)
+    dp = p2 - p1
+    dl = np.radians(lons - lon)
+    a = np.sin(dp / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _duplicates(name_ids: np.ndarray, lats: np.ndarray, lons: np.ndarray, valid: np.ndarray,
+                score: np.ndarray) -> np.ndarray:
+    """Mask of facilities within DEDUPE_DISTANCE_M of a better-scored facility of the same name."""
+    drop = np.zeros(len(name_ids), dtype=bool)
+    members = np.flatnonzero(valid)
+    if len(members) < 2:
+        return drop
+
+    # Grid cells one dedupe distance wide, keyed by (name, row, col): a
+    # duplicate shares the name and sits in the same or a neighbouring cell.
+    # Searching the sorted keys for themselves shifted by half of the
+    # neighbourhood finds every candidate pair once.
+    cell_deg = DEDUPE_DISTANCE_M / 111_320
+    rows = np.floor(lats[members] / cell_deg).astype(np.int64) + (1 << 19)
+    cols = np.floor(lons[members] * np.cos(np.radians(lats[members])) / cell_deg).astype(np.int64) + (1 << 19)
+    keys = (name_ids[members] << 40) | (rows << 20) | cols
+    order = np.argsort(keys, kind="stable")
+    members, keys = members[order], keys[order]
+    for dr, dc in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        target = keys + (dr << 20) + dc
+        lo = np.searchsorted(keys, target, "left")
+        counts = np.searchsorted(keys, target, "right") - lo
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        a = np.repeat(np.arange(len(keys)), counts)
+        b = np.repeat(lo - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        if dr == dc == 0:
+            keep = a < b
+            a, b = a[keep], b[keep]
+        a, b = members[a], members[b]
+        close = haversine_many(lats[a], lons[a], lats[b], lons[b]) < DEDUPE_DISTANCE_M
+        a, b = a[close], b[close]
+        b_better = (score[b] > score[a]) | ((score[b] == score[a]) & (b < a))
+        drop[np.where(b_better, a, b)] = True
+    return drop
+
+
+def rank_facilities(facilities: list, lat: float, lon: float, radius_miles: float, k: int = 5) -> list:
+    """
+    The k best facilities around (lat, lon), each a copy of the facility
+    dict with "distance_m" added. Facilities outside the radius and
+    near-duplicates are dropped; the rest are ordered by a score of
+    closeness and how complete their contact details are.
+    """
+    n = len(facilities)
+    if n == 0:
+        return []
+    radius_m = radius_miles * METERS_PER_MILE
+    lats = np.array([f.get("lat") for f in facilities], dtype=float)  # None -> NaN
+    lons = np.array([f.get("lon") for f in facilities], dtype=float)
+    complete = np.zeros(n)
+    for field, missing in _MISSING.items():
+        complete += np.array([f.get(field, missing) != missing for f in facilities])
+    complete /= len(_MISSING)
+
+    distance = haversine_many(lat, lon, lats, lons)
+    score = DISTANCE_WEIGHT * (1 - np.clip(distance / radius_m, 0, 1)) + (1 - DISTANCE_WEIGHT) * complete
+    valid = distance <= radius_m  # NaN coordinates compare False
+
+    # Raw names -> ids first; only distinct names go through normalization
+    raw = {}
+    raw_ids = np.array([raw.setdefault(f.get("name", ""), len(raw)) for f in facilities], dtype=np.int64)
+    names = {}
+    name_ids = np.array([names.setdefault(_NAME_RE.sub(" ", name.casefold()).strip(), len(names)) for name in raw],
+                        dtype=np.int64)[raw_ids]
+    valid &= ~_duplicates(name_ids, lats, lons, valid, score)
+
+    candidates = np.flatnonzero(valid)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-score[candidates], k - 1)[:k]]
+    best = candidates[np.lexsort((distance[candidates], -score[candidates]))]
+    return [{**facilities[i], "distance_m": float(distance[i])} for i in best]
@@ -0,0 +1,260 @@
+# Circuit breakers and latency-derived timeouts for outbound dependencies
+import asyncio
+import os
+import time
+from collections import deque
+
+from .deadlines import DeadlineExceeded, remaining
+from .telemetry import BREAKER_REJECTED, BREAKER_STATE, BREAKER_TRANSITIONS, DEPENDENCY_TIMEOUT, get_logger
+
+
+logger = get_logger("resilience")
+
+
+# A breaker opens when, over its last BREAKER_WINDOW calls (and at least
+# BREAKER_MIN_CALLS), the failure ratio reaches BREAKER_FAILURE_RATIO, or
+# after BREAKER_CONSECUTIVE failures in a row. It stays open for
+# BREAKER_COOLDOWN seconds, then lets one probe call through (half-open).
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_FAILURE_RATIO = float(os.getenv("BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_CONSECUTIVE = int(os.getenv("BREAKER_CONSECUTIVE", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+# Timeout = TIMEOUT_MULTIPLIER x the TIMEOUT_PERCENTILE of recent successful
+# calls, clamped to the dependency's bounds (its default until
+# TIMEOUT_MIN_SAMPLES calls have succeeded)
+TIMEOUT_PERCENTILE = float(os.getenv("TIMEOUT_PERCENTILE", "0.99"))
+TIMEOUT_MULTIPLIER = float(os.getenv("TIMEOUT_MULTIPLIER", "2"))
+TIMEOUT_MIN_SAMPLES = int(os.getenv("TIMEOUT_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = 500
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# (default, min, max) timeout in seconds per dependency
+TIMEOUTS = {
+    "ipapi": (3.0, 0.5, 5.0),
+    "nominatim": (5.0, 1.0, 10.0),
+    "groq_router": (5.0, 1.0, 10.0),
+    "groq_therapy": (15.0, 2.0, 30.0),
+    # Includes the wait for an inference slot
+    "ollama": (60.0, 10.0, 120.0),
+}
+
+
+class Rejected(RuntimeError):
+    """A call refused before it reached the dependency; not a failure of the dependency."""
+
+
+class CircuitOpen(Rejected):
+    """The dependency's breaker is open."""
+
+
+class Breaker:
+    """Circuit breaker plus adaptive timeout for one dependency."""
+
+    def __init__(self, name: str, timeouts: tuple = (10.0, 1.0, 30.0)):
+        self.name = name
+        self.default_timeout, self.min_timeout, self.max_timeout = timeouts
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)  # True = failure
+        self.consecutive = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {"calls": 0, "failures": 0, "timeouts": 0, "rejected": 0, "opened": 0}
+        BREAKER_STATE.set(0, dependency=name)
+        DEPENDENCY_TIMEOUT.set(self.default_timeout, dependency=name)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        self.state = state
+        BREAKER_STATE.set(_STATE_VALUE[state], dependency=self.name)
+        BREAKER_TRANSITIONS.inc(dependency=self.name, state=state)
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self.counters["opened"] += 1
+            logger.warning("circuit opened", extra={"dependency": self.name, "consecutive": self.consecutive})
+        else:
+            logger.info("circuit state changed", extra={"dependency": self.name, "state": state})
+
+    def timeout(self) -> float:
+        if len(self.latencies) < TIMEOUT_MIN_SAMPLES:
+            return self.default_timeout
+        ordered = sorted(self.latencies)
+        observed = ordered[min(len(ordered) - 1, int(TIMEOUT_PERCENTILE * len(ordered)))]
+        return min(max(observed * TIMEOUT_MULTIPLIER, self.min_timeout), self.max_timeout)
+
+    def allow(self) -> bool:
+        """Whether a call may go out now (claims the probe when half-open)."""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < BREAKER_COOLDOWN:
+                return False
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def check(self):
+        """Raise CircuitOpen if no call may go out now."""
+        if not self.allow():
+            self.counters["rejected"] += 1
+            BREAKER_REJECTED.inc(dependency=self.name)
+            raise CircuitOpen(f"{self.name} is unavailable (circuit {self.state})")
+
+    def record(self, elapsed: float, ok: bool):
+        self.counters["calls"] += 1
+        self.probing = False
+        self.outcomes.append(not ok)
+        if ok:
+            self.consecutive = 0
+            self.latencies.append(elapsed)
+            DEPENDENCY_TIMEOUT.set(self.timeout(), dependency=self.name)
+            if self.state == HALF_OPEN:
+                self.outcomes.clear()
+                self._transition(CLOSED)
+            return
+        self.counters["failures"] += 1
+        self.consecutive += 1
+        failures = sum(self.outcomes)
+        if (self.state == HALF_OPEN or self.consecutive >= BREAKER_CONSECUTIVE
+                or (len(self.outcomes) >= BREAKER_MIN_CALLS
+                    and failures / len(self.outcomes) >= BREAKER_FAILURE_RATIO)):
+            self._transition(OPEN)
+
+    def release(self):
+        """Give back a half-open probe that was cancelled before it finished."""
+        self.probing = False
+
+    def _budget(self) -> tuple:
+        """
+        (timeout, cut) for a call starting now: the dependency's timeout, or
+        the time left before the request's deadline when that is shorter
+        (cut=True). Raises DeadlineExceeded if no time is left; like every
+        DeadlineExceeded from a breaker, it is counted by the stage that
+        answers instead (see deadlines.py), not here.
+        """
+        timeout = self.timeout()
+        left = remaining()
+        if left is None or left >= timeout:
+            return timeout, False
+        if left <= 0:
+            raise DeadlineExceeded(self.name)
+        return left, True
+
+    async def call(self, factory):
+        """
+        Await factory() under the breaker and the current timeout, cut to
+        the request's deadline. Raises CircuitOpen without calling it while
+        the circuit is open, and DeadlineExceeded if the deadline passes
+        first (which is not held against the dependency).
+        """
+        timeout, cut = self._budget()
+        self.check()
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(factory(), timeout)
+        except DeadlineExceeded:
+            self.release()
+            raise
+        except asyncio.TimeoutError:
+            if cut:
+                self.release()
+                raise DeadlineExceeded(self.name) from None
+            self.counters["timeouts"] += 1
+            self.record(time.perf_counter() - start, ok=False)
+            raise TimeoutError(f"{self.name} did not answer within {timeout:.1f}s") from None
+        except Rejected:
+            self.release()
+            raise
+        except asyncio.CancelledError:
+            self.release()
+            raise
+        except Exception:
+            self.record(time.perf_counter() - start, ok=False)
+            raise
+        self.record(time.perf_counter() - start, ok=True)
+        return result
+
+    async def stream(self, factory):
+        """
+        Yield from the async generator factory() under the breaker. The
+        timeout applies to the first chunk, which is also what counts as
+        the call's latency, and is cut to the request's deadline. The
+        outcome is recorded once, when the stream ends: an error after
+        the first chunk makes it a failure.
+        """
+        timeout, cut = self._budget()
+        self.check()
+        start = time.perf_counter()
+        generator = factory()
+        try:
+            first = await asyncio.wait_for(generator.__anext__(), timeout)
+        except StopAsyncIteration:
+            self.record(time.perf_counter() - start, ok=True)
+            return
+        except DeadlineExceeded:
+            self.release()
+            await generator.aclose()
+            raise
+        except asyncio.TimeoutError:
+            await generator.aclose()
+            if cut:
+                self.release()
+                raise DeadlineExceeded(self.name) from None
+            self.counters["timeouts"] += 1
+            self.record(time.perf_counter() - start, ok=False)
+            raise TimeoutError(f"{self.name} sent nothing within {timeout:.1f}s") from None
+        except (Rejected, asyncio.CancelledError):
+            self.release()
+            raise
+        except Exception:
+            self.record(time.perf_counter() - start, ok=False)
+            raise
+        latency = time.perf_counter() - start
+        ok = True  # also when the consumer stops early
+        try:
+            yield first
+            async for chunk in generator:
+                yield chunk
+        except (DeadlineExceeded, Rejected):
+            ok = None  # not held against the dependency
+            raise
+        except Exception:
+            ok = False
+            raise
+        finally:
+            await generator.aclose()
+            if ok is None:
+                self.release()
+            else:
+                self.record(latency, ok)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "state": self.state,
+            "timeout_s": round(self.timeout(), 3),
+            "recent_failure_ratio": sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0,
+        }
+
+
+_breakers = {}
+
+
+def breaker(name: str, timeouts: tuple = None) -> Breaker:
+    """
+    The breaker for a dependency, created on first use with `timeouts`
+    (default, min, max) or its entry in TIMEOUTS.
+    """
+    b = _breakers.get(name)
+    if b is None:
+        b = _breakers[name] = Breaker(name, timeouts or TIMEOUTS.get(name, (10.0, 1.0, 30.0)))
+    return b
+
+
+def breaker_stats() -> dict:
+    return {name: b.stats() for name, b in _breakers.items()}
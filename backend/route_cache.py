@@ -0,0 +1,224 @@
+# Routing decision cache: exact and near-duplicate (MinHash/LSH) reuse of router output
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from .intent_router import mentions_self_harm
+
+
+ROUTE_CACHE_ENABLED = os.getenv("ROUTE_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "10000"))
+ROUTE_CACHE_TTL = int(os.getenv("ROUTE_CACHE_TTL", str(24 * 3600)))
+# A cached decision is served when confidence x similarity reaches this
+ROUTE_CACHE_MIN_SCORE = float(os.getenv("ROUTE_CACHE_MIN_SCORE", "0.65"))
+
+EMERGENCY_MARKER = "USE_TOOL: emergency_call_tool"
+# The only decision a near-duplicate may reuse: a wrong therapy reply costs
+# little, a wrong call or search location costs a lot
+THERAPY_MARKER = "USE_TOOL: ask_mental_health_specialist"
+
+# Starting confidence of an entry; adjusted as later LLM calls agree or not
+MARKER_CONFIDENCE = 0.9  # bare USE_TOOL marker
+REPLY_CONFIDENCE = 0.6  # conversational reply: only reused once confirmed
+
+NUM_PERM = 32
+BANDS, ROWS = 8, 4  # NUM_PERM = BANDS * ROWS
+SHINGLE = 3
+_MASK64 = (1 << 64) - 1
+# Multiply-shift hash family with fixed odd multipliers, so signatures are
+# stable across restarts
+_PERMS = [((i * 0x9E3779B97F4A7C15) & _MASK64 | 1, (i * 0xBF58476D1CE4E5B9) & _MASK64)
+          for i in range(1, NUM_PERM + 1)]
+
+
+def normalize_text(text: str) -> str:
+    """Cache key for a message: lowercase, letters/digits only, single spaces."""
+    text = re.sub(r"[^\w\s']", " ", text.lower())
+    return " ".join(text.split())
+
+
+def minhash(key: str) -> tuple:
+    """MinHash signature over character shingles of the normalized text."""
+    padded = f" {key} "
+    shingles = {zlib.crc32(padded[i:i + SHINGLE].encode())
+                for i in range(max(1, len(padded) - SHINGLE + 1))}
+    return tuple(min(((a * x + b) & _MASK64) >> 32 for x in shingles) for a, b in _PERMS)
+
+
+def _bands(signature: tuple) -> list:
+    return [(i, signature[i * ROWS:(i + 1) * ROWS]) for i in range(BANDS)]
+
+
+def similarity(a: tuple, b: tuple) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+class RouteEntry:
+    __slots__ = ("decision", "confidence", "signature", "created_at", "hits")
+
+    def __init__(self, decision: str, confidence: float, signature: tuple):
+        self.decision = decision
+        self.confidence = confidence
+        self.signature = signature
+        self.created_at = time.time()
+        self.hits = 0
+
+
+class RouteCache:
+    """
+    LRU cache of router decisions keyed by normalized message text. A miss
+    on the exact key falls back to an LSH lookup over MinHash signatures,
+    so close paraphrases of distress ("i feel so sad today" / "I feel so
+    sad today, really.") share the therapy decision. Only that decision is
+    reused approximately, and never for a message with a self-harm cue:
+    one changed letter can be the whole difference ("I don't want to live
+    anymore" / "... leave anymore"). Callers only cache messages without
+    session context (see ai_agent.aroute).
+    """
+
+    def __init__(self, max_entries: int = ROUTE_CACHE_SIZE, ttl: int = ROUTE_CACHE_TTL,
+                 min_score: float = ROUTE_CACHE_MIN_SCORE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_score = min_score
+        self._entries = OrderedDict()  # key -> RouteEntry
+        self._buckets = {}  # (band, rows) -> set of keys
+        self._lock = threading.Lock()
+        self.counters = {
+            "exact_hits": 0,
+            "near_hits": 0,
+            "misses": 0,
+            "low_confidence": 0,
+            "expired": 0,
+            "self_harm_bypass": 0,
+            "evictions": 0,
+        }
+        self._llm_seconds = 0.0  # total time of routed (missed) calls
+        self._llm_calls = 0
+        self._saved_seconds = 0.0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        for band in _bands(entry.signature):
+            keys = self._buckets.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[band]
+
+    def _live(self, key: str, now: float) -> RouteEntry:
+        entry = self._entries.get(key)
+        if entry is not None and now - entry.created_at >= self.ttl:
+            self._remove(key)
+            self.counters["expired"] += 1
+            return None
+        return entry
+
+    def _nearest(self, signature: tuple, now: float) -> tuple:
+        candidates = set()
+        for band in _bands(signature):
+            candidates.update(self._buckets.get(band, ()))
+        best, best_sim = None, 0.0
+        for key in candidates:
+            entry = self._live(key, now)
+            if entry is None or entry.decision != THERAPY_MARKER:
+                continue
+            sim = similarity(signature, entry.signature)
+            if sim > best_sim:
+                best, best_sim = key, sim
+        return best, best_sim
+
+    def lookup(self, text: str):
+        """
+        Return (decision, probe). decision is the cached router output or
+        None; pass probe back to store() after routing a miss.
+        """
+        key = normalize_text(text)
+        self_harm = mentions_self_harm(text)
+        # Signatures are only needed when the exact key misses, and a
+        # self-harm cue never takes a near match
+        signature = None if self_harm or key in self._entries else minhash(key)
+        now = time.time()
+        with self._lock:
+            match, sim = key, 1.0
+            entry = self._live(key, now)
+            if entry is None and not self_harm:
+                if signature is None:
+                    signature = minhash(key)
+                match, sim = self._nearest(signature, now)
+                entry = self._entries.get(match) if match else None
+            elif entry is None:
+                match = None
+            probe = (key, signature, match)
+
+            if entry is None:
+                self.counters["misses"] += 1
+                return None, probe
+            if self_harm and entry.decision != EMERGENCY_MARKER:
+                # A cached "not an emergency" is never trusted for a message
+                # with a self-harm cue; the router decides afresh
+                self.counters["self_harm_bypass"] += 1
+                return None, probe
+            if entry.confidence * sim < self.min_score:
+                self.counters["low_confidence"] += 1
+                return None, probe
+
+            entry.hits += 1
+            self._entries.move_to_end(match)
+            self.counters["exact_hits" if sim == 1.0 else "near_hits"] += 1
+            if self._llm_calls:
+                self._saved_seconds += self._llm_seconds / self._llm_calls
+            return entry.decision, probe
+
+    def store(self, probe: tuple, decision: str, elapsed: float):
+        """Record the router's decision for a missed lookup."""
+        key, signature, match = probe
+        with self._lock:
+            self._llm_seconds += elapsed
+            self._llm_calls += 1
+            # The router re-decided a message close to an existing entry:
+            # agreement raises that entry's confidence, disagreement lowers it
+            near = self._entries.get(match) if match and match != key else None
+            if near is not None:
+                if near.decision == decision:
+                    near.confidence += (1.0 - near.confidence) / 2
+                else:
+                    near.confidence /= 2
+
+            old = self._entries.get(key)
+            if old is not None:
+                if old.decision == decision:
+                    old.confidence += (1.0 - old.confidence) / 2
+                    old.created_at = time.time()
+                    self._entries.move_to_end(key)
+                    return
+                self._remove(key)
+
+            if signature is None:
+                signature = minhash(key)
+            confidence = MARKER_CONFIDENCE if decision.startswith("USE_TOOL:") else REPLY_CONFIDENCE
+            self._entries[key] = RouteEntry(decision, confidence, signature)
+            for band in _bands(signature):
+                self._buckets.setdefault(band, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        hits = self.counters["exact_hits"] + self.counters["near_hits"]
+        lookups = hits + sum(self.counters[k] for k in ("misses", "low_confidence", "self_harm_bypass"))
+        return {
+            **self.counters,
+            "enabled": ROUTE_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "avg_router_llm_ms": self._llm_seconds / self._llm_calls * 1000 if self._llm_calls else 0.0,
+            "latency_saved_ms": self._saved_seconds * 1000,
+        }
+
+
+route_cache = RouteCache()
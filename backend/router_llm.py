@@ -0,0 +1,163 @@
+# Router LLM call: compact prompt, forced tool call with a typed decision, token accounting
+import json
+import os
+import re
+
+from .clients import get_groq_llm
+from .intent_router import GREETING_REPLY, INTENTS
+from .telemetry import ROUTER_TOKENS, get_logger
+
+
+logger = get_logger("router_llm")
+
+
+# "structured": compact prompt and a forced `route` tool call with capped
+# output; "text": the original multi-example prompt answered in free text
+ROUTER_MODE = os.getenv("ROUTER_MODE", "structured").lower()
+# Output cap for structured mode; a route call is about 30 tokens
+ROUTER_MAX_TOKENS = int(os.getenv("ROUTER_MAX_TOKENS", "64"))
+
+TOOL_INTENTS = INTENTS[:3]
+
+ROUTER_PROMPT = """Route the user's latest message for a mental health assistant by calling `route`.
+Intents:
+- emergency_call_tool: any mention of self-harm or suicide
+- find_nearby_therapists_by_location: wants a therapist or counselor; put a place they name in `location`
+- ask_mental_health_specialist: emotional distress (sad, anxious, stressed, hopeless, lonely, ...)
+- greeting: greetings and casual conversation
+`confidence` is your probability (0-1) that the intent is right."""
+
+ROUTE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "route",
+        "description": "Choose how to handle the user's latest message.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "intent": {"type": "string", "enum": list(INTENTS)},
+                "location": {"type": "string", "description": "Place named for a therapist search, or empty"},
+                "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+            },
+            "required": ["intent", "confidence"],
+        },
+    },
+}
+
+_MARKER_RE = re.compile(r"USE_TOOL:\s*(\w+)(?:\s*\[(.+?)\])?")
+
+_stats = {
+    "calls": 0,
+    "structured": 0,
+    "text": 0,
+    "malformed": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "seconds": 0.0,
+}
+
+
+class RouteDecision:
+    """
+    What the router decided: one of INTENTS, the place named for a
+    therapist search (or None), the model's confidence when it gave one,
+    and for a free-text router the reply it wrote.
+    """
+
+    __slots__ = ("intent", "location", "confidence", "reply")
+
+    def __init__(self, intent: str, location: str = None, confidence: float = None, reply: str = None):
+        self.intent = intent
+        self.location = location
+        self.confidence = confidence
+        self.reply = reply
+
+    @property
+    def text(self) -> str:
+        """Router output in the "USE_TOOL: ..." shape the agent dispatches on."""
+        if self.intent in TOOL_INTENTS:
+            marker = f"USE_TOOL: {self.intent}"
+            return f"{marker} [{self.location}]" if self.location else marker
+        return self.reply or GREETING_REPLY
+
+    @classmethod
+    def from_text(cls, text: str) -> "RouteDecision":
+        match = _MARKER_RE.search(text)
+        if match and match.group(1) in TOOL_INTENTS:
+            return cls(match.group(1), match.group(2))
+        return cls("greeting", reply=text)
+
+    @classmethod
+    def from_args(cls, args: dict) -> "RouteDecision":
+        intent = args.get("intent")
+        if intent not in INTENTS:
+            raise ValueError(f"router chose an unknown intent: {intent!r}")
+        location = (args.get("location") or "").strip() or None
+        if intent != "find_nearby_therapists_by_location":
+            location = None
+        try:
+            confidence = min(max(float(args.get("confidence")), 0.0), 1.0)
+        except (TypeError, ValueError):
+            confidence = None
+        return cls(intent, location, confidence)
+
+    def __repr__(self):
+        return f"RouteDecision({self.intent!r}, {self.location!r}, {self.confidence!r})"
+
+
+_bound = None
+
+
+def get_router_llm():
+    """The router model for ROUTER_MODE (created on first use)."""
+    global _bound
+    if ROUTER_MODE != "structured":
+        return get_groq_llm(0.2)
+    if _bound is None:
+        llm = get_groq_llm(0.0, ROUTER_MAX_TOKENS)
+        _bound = llm.bind_tools([ROUTE_TOOL], tool_choice="route")
+    return _bound
+
+
+def parse_decision(response) -> RouteDecision:
+    """
+    RouteDecision from the router model's reply: the `route` tool call's
+    arguments, or the "USE_TOOL:" marker in free text.
+    """
+    for call in getattr(response, "tool_calls", None) or ():
+        if call.get("name") == "route":
+            _stats["structured"] += 1
+            args = call.get("args")
+            return RouteDecision.from_args(json.loads(args) if isinstance(args, str) else args or {})
+    if ROUTER_MODE == "structured":
+        # Capped output or a model that answered in text anyway
+        _stats["malformed"] += 1
+    _stats["text"] += 1
+    return RouteDecision.from_text(response.content or "")
+
+
+def record_usage(response, elapsed: float):
+    """Add one router call's tokens and latency to the counters and metrics."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt, completion = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    _stats["calls"] += 1
+    _stats["prompt_tokens"] += prompt
+    _stats["completion_tokens"] += completion
+    _stats["seconds"] += elapsed
+    ROUTER_TOKENS.observe(prompt, kind="prompt", mode=ROUTER_MODE)
+    ROUTER_TOKENS.observe(completion, kind="completion", mode=ROUTER_MODE)
+    logger.debug("router tokens", extra={
+        "prompt_tokens": prompt, "completion_tokens": completion, "router_ms": round(elapsed * 1000, 1),
+    })
+
+
+def router_llm_stats() -> dict:
+    calls = _stats["calls"]
+    return {
+        **_stats,
+        "mode": ROUTER_MODE,
+        "max_tokens": ROUTER_MAX_TOKENS if ROUTER_MODE == "structured" else None,
+        "avg_prompt_tokens": _stats["prompt_tokens"] / calls if calls else 0.0,
+        "avg_completion_tokens": _stats["completion_tokens"] / calls if calls else 0.0,
+        "avg_ms": _stats["seconds"] / calls * 1000 if calls else 0.0,
+    }
@@ -0,0 +1,207 @@
+# Conversation sessions: bounded, token-budgeted history per session ID
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "1024"))
+SESSION_SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", "256"))
+SESSION_ROUTER_TOKENS = int(os.getenv("SESSION_ROUTER_TOKENS", "192"))
+# Long replies (e.g. facility lists) are clipped before they are stored
+SESSION_TURN_MAX_TOKENS = int(os.getenv("SESSION_TURN_MAX_TOKENS", "200"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+SESSION_MEMORY_CAP = int(os.getenv("SESSION_MEMORY_CAP", str(64 * 1024 * 1024)))
+
+# Roles are interned so every turn shares the same two string objects
+USER, ASSISTANT = sys.intern("user"), sys.intern("assistant")
+_ROLES = {"user": USER, "assistant": ASSISTANT}
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def clip_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + " …"
+
+
+class Turn:
+    __slots__ = ("role", "text", "tokens")
+
+    def __init__(self, role: str, text: str):
+        self.role = role
+        self.text = text
+        self.tokens = estimate_tokens(text)
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.text)
+
+
+class Session:
+    """
+    History of one conversation: recent turns verbatim plus a rolling
+    summary of the turns that no longer fit in the token budget.
+    """
+
+    __slots__ = ("turns", "tokens", "summary", "last_seen", "nbytes")
+
+    def __init__(self):
+        self.turns = deque()
+        self.tokens = 0
+        self.summary = deque()  # short extracts of trimmed user turns, oldest first
+        self.last_seen = time.time()
+        self.nbytes = sys.getsizeof(self) + sys.getsizeof(self.turns) + sys.getsizeof(self.summary)
+
+    def summary_text(self) -> str:
+        return " ".join(self.summary)
+
+    def add(self, turn: Turn, budget: int, summary_budget: int) -> int:
+        """Append a turn and trim to the budget. Returns the turns folded into the summary."""
+        self.turns.append(turn)
+        self.tokens += turn.tokens
+        self.nbytes += turn.nbytes()
+        folded = 0
+        while self.tokens > budget and len(self.turns) > 1:
+            old = self.turns.popleft()
+            self.tokens -= old.tokens
+            self.nbytes -= old.nbytes()
+            folded += 1
+            if old.role is USER:
+                self._summarize(old.text, summary_budget)
+        return folded
+
+    def _summarize(self, text: str, summary_budget: int):
+        # Extractive: the first sentence of what the user said, so the
+        # summary costs no model call and still carries the thread of the
+        # conversation. The oldest extracts drop off past the budget.
+        extract = clip_to_tokens(_SENTENCE_RE.split(text.strip(), 1)[0], 40)
+        self.summary.append(extract)
+        self.nbytes += sys.getsizeof(extract)
+        while sum(estimate_tokens(s) for s in self.summary) > summary_budget and len(self.summary) > 1:
+            self.nbytes -= sys.getsizeof(self.summary.popleft())
+
+
+class SessionStore:
+    """
+    In-memory session store. Idle sessions expire after `ttl` seconds and
+    the least recently used sessions are evicted while the estimated memory
+    of all sessions exceeds `memory_cap` bytes.
+    """
+
+    def __init__(self, budget: int = SESSION_HISTORY_TOKENS, summary_budget: int = SESSION_SUMMARY_TOKENS,
+                 ttl: int = SESSION_TTL, memory_cap: int = SESSION_MEMORY_CAP):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.ttl = ttl
+        self.memory_cap = memory_cap
+        self._sessions = OrderedDict()  # session_id -> Session, least recently used first
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.counters = {
+            "sessions_created": 0,
+            "turns_added": 0,
+            "turns_summarized": 0,
+            "evicted_ttl": 0,
+            "evicted_memory": 0,
+            "prompts_built": 0,
+        }
+        self._build_seconds = 0.0
+
+    def _expire(self, now: float):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen < self.ttl:
+                break
+            self._drop(session_id)
+            self.counters["evicted_ttl"] += 1
+
+    def _drop(self, session_id: str):
+        self.nbytes -= self._sessions.pop(session_id).nbytes
+
+    def _get(self, session_id: str, create: bool) -> Session:
+        now = time.time()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = self._sessions[session_id] = Session()
+            self.nbytes += session.nbytes
+            self.counters["sessions_created"] += 1
+        self._sessions.move_to_end(session_id)
+        session.last_seen = now
+        return session
+
+    def add_turn(self, session_id: str, role: str, text: str):
+        if not session_id or not text:
+            return
+        with self._lock:
+            session = self._get(session_id, create=True)
+            before = session.nbytes
+            turn = Turn(_ROLES[role], clip_to_tokens(text.strip(), SESSION_TURN_MAX_TOKENS))
+            self.counters["turns_summarized"] += session.add(turn, self.budget, self.summary_budget)
+            self.counters["turns_added"] += 1
+            self.nbytes += session.nbytes - before
+            while self.nbytes > self.memory_cap and len(self._sessions) > 1:
+                self._drop(next(iter(self._sessions)))
+                self.counters["evicted_memory"] += 1
+
+    def add_exchange(self, session_id: str, user_text: str, reply: str):
+        self.add_turn(session_id, "user", user_text)
+        self.add_turn(session_id, "assistant", reply)
+
+    def history(self, session_id: str, max_tokens: int = None, roles: tuple = (USER, ASSISTANT)) -> tuple:
+        """
+        (summary, turns) for a session, where turns are the most recent
+        (role, text) pairs that fit in max_tokens (default: the full budget).
+        """
+        if not session_id:
+            return "", []
+        start = time.perf_counter()
+        with self._lock:
+            session = self._get(session_id, create=False)
+            if session is None:
+                summary, turns = "", []
+            else:
+                summary, turns = session.summary_text(), []
+                remaining = max_tokens or self.budget
+                for turn in reversed(session.turns):
+                    if turn.role not in roles:
+                        continue
+                    remaining -= turn.tokens
+                    if remaining < 0:
+                        break
+                    turns.append((turn.role, turn.text))
+                turns.reverse()
+            self.counters["prompts_built"] += 1
+            self._build_seconds += time.perf_counter() - start
+        return summary, turns
+
+    def clear(self, session_id: str):
+        with self._lock:
+            if session_id in self._sessions:
+                self._drop(session_id)
+
+    def stats(self) -> dict:
+        count = len(self._sessions)
+        built = self.counters["prompts_built"]
+        return {
+            **self.counters,
+            "sessions": count,
+            "memory_bytes": self.nbytes,
+            "avg_bytes_per_session": self.nbytes / count if count else 0.0,
+            "max_bytes_per_session": max((s.nbytes for s in self._sessions.values()), default=0),
+            "avg_prompt_build_us": self._build_seconds / built * 1e6 if built else 0.0,
+        }
+
+
+session_store = SessionStore()
@@ -0,0 +1,113 @@
+# Speculative therapy replies: start the therapy model while the router is still deciding
+import asyncio
+import os
+import time
+
+from .intent_router import (LOCAL_ROUTER_ENABLED, LOCAL_ROUTER_THRESHOLD, classify, intent_probabilities,
+                            mentions_self_harm)
+from .sessions import estimate_tokens
+from .telemetry import SPECULATIONS, get_logger
+from .tools import THERAPIST_PROMPT, aquery_medgemma
+
+
+logger = get_logger("speculation")
+
+
+SPECULATIVE_THERAPY = os.getenv("SPECULATIVE_THERAPY", "true").lower() not in ("0", "false", "no")
+# Intent-model probability of distress at which the therapy reply is
+# started before the router LLM answers. Lower: more hits and more wasted
+# generations.
+SPECULATIVE_THRESHOLD = float(os.getenv("SPECULATIVE_THRESHOLD", "0.5"))
+
+
+class Speculation:
+    """A therapy reply started before the router decided it was needed."""
+
+    __slots__ = ("task", "started", "finished", "prompt_tokens")
+
+    def __init__(self, task: asyncio.Task, prompt_tokens: int):
+        self.task = task
+        self.started = time.perf_counter()
+        self.finished = None
+        self.prompt_tokens = prompt_tokens
+        task.add_done_callback(self._done)
+
+    def _done(self, _task):
+        self.finished = time.perf_counter()
+
+
+class Speculator:
+    """
+    Starts aquery_medgemma alongside the router LLM when the local intent
+    model rates a message as likely distress. If the router agrees, the
+    reply is used (a hit, saving the overlap with the router call);
+    otherwise it is cancelled (a miss, whose tokens are wasted). Messages
+    the local router resolves on its own are not speculated on, since no
+    router call is there to overlap with.
+    """
+
+    def __init__(self, enabled: bool = SPECULATIVE_THERAPY, threshold: float = SPECULATIVE_THRESHOLD):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.counters = {"checked": 0, "started": 0, "hits": 0, "misses": 0}
+        self._saved_seconds = 0.0
+        self._wasted_seconds = 0.0
+        self._wasted_tokens = 0
+
+    def start(self, user_input: str, history: tuple = None) -> Speculation:
+        """Start the therapy reply if the message looks like distress, else None."""
+        if not self.enabled:
+            return None
+        self.counters["checked"] += 1
+        # A self-harm cue always goes to the emergency tool
+        if mentions_self_harm(user_input):
+            return None
+        if LOCAL_ROUTER_ENABLED and classify(user_input)[1] >= LOCAL_ROUTER_THRESHOLD:
+            return None
+        if intent_probabilities(user_input)["ask_mental_health_specialist"] < self.threshold:
+            return None
+        self.counters["started"] += 1
+        summary, turns = history or ("", ())
+        prompt_tokens = estimate_tokens(" ".join([THERAPIST_PROMPT, summary or "", user_input]
+                                                 + [text for _, text in turns]))
+        return Speculation(asyncio.ensure_future(aquery_medgemma(user_input, history)), prompt_tokens)
+
+    async def take(self, speculation: Speculation) -> str:
+        """The speculative reply, now that the router chose the therapy tool."""
+        decided = time.perf_counter()
+        self.counters["hits"] += 1
+        SPECULATIONS.inc(outcome="hit")
+        # Time the reply was being generated while the router was deciding
+        self._saved_seconds += (speculation.finished or decided) - speculation.started
+        return await speculation.task
+
+    async def discard(self, speculation: Speculation):
+        """Cancel a speculative reply the router did not want."""
+        self.counters["misses"] += 1
+        SPECULATIONS.inc(outcome="miss")
+        speculation.task.cancel()
+        try:
+            reply = await speculation.task
+        except asyncio.CancelledError:
+            reply = None
+        now = time.perf_counter()
+        self._wasted_seconds += (speculation.finished or now) - speculation.started
+        # Estimated: the prompt, plus the reply if it had finished
+        self._wasted_tokens += speculation.prompt_tokens + (estimate_tokens(reply) if reply else 0)
+
+    def stats(self) -> dict:
+        hits = self.counters["hits"]
+        decided = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "hit_rate": hits / decided if decided else 0.0,
+            "saved_ms": self._saved_seconds * 1000,
+            "avg_saved_ms_per_hit": self._saved_seconds / hits * 1000 if hits else 0.0,
+            "wasted_generation_ms": self._wasted_seconds * 1000,
+            "wasted_tokens_estimate": self._wasted_tokens,
+        }
+
+
+therapy_speculator = Speculator()
@@ -0,0 +1,244 @@
+# Instrumentation: trace IDs, timing spans, structured logging and Prometheus metrics
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+trace_id_var = contextvars.ContextVar("trace_id", default=None)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+# --------------- METRICS -------------------
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_str(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labels)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, _label_str(self.labels, key), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                yield f"{self.name}_bucket", _label_str(self.labels + ("le",), key + (bound,)), cumulative
+            yield f"{self.name}_bucket", _label_str(self.labels + ("le",), key + ("+Inf",)), count
+            yield f"{self.name}_sum", _label_str(self.labels, key), total
+            yield f"{self.name}_count", _label_str(self.labels, key), count
+
+
+_registry = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+STAGE_LATENCY = _register(Histogram(
+    "safespace_stage_latency_seconds", "Latency of agent stages and upstream calls", ("stage",)))
+STAGE_CALLS = _register(Counter(
+    "safespace_stage_calls_total", "Calls made per stage", ("stage",)))
+STAGE_ERRORS = _register(Counter(
+    "safespace_stage_errors_total", "Failed calls per stage (error rate = errors / calls)", ("stage",)))
+TOOL_CALLS = _register(Counter(
+    "safespace_tool_called_total", "Responses per tool_called value", ("tool",)))
+REQUEST_LATENCY = _register(Histogram(
+    "safespace_request_latency_seconds", "End-to-end HTTP request latency", ("path",)))
+IN_FLIGHT = _register(Gauge(
+    "safespace_requests_in_flight", "HTTP requests currently being served"))
+HEDGES = _register(Counter(
+    "safespace_hedges_total", "Second-provider requests started, by reason (slow or failed)", ("reason",)))
+BACKEND_WINS = _register(Counter(
+    "safespace_backend_wins_total", "Therapy replies per provider that produced them", ("backend", "hedged")))
+BREAKER_STATE = _register(Gauge(
+    "safespace_breaker_state", "Circuit state per dependency (0 closed, 1 half-open, 2 open)", ("dependency",)))
+BREAKER_TRANSITIONS = _register(Counter(
+    "safespace_breaker_transitions_total", "Circuit state changes, by the state entered", ("dependency", "state")))
+BREAKER_REJECTED = _register(Counter(
+    "safespace_breaker_rejected_total", "Calls refused because the circuit was open", ("dependency",)))
+DEPENDENCY_TIMEOUT = _register(Gauge(
+    "safespace_dependency_timeout_seconds", "Current timeout applied to calls to each dependency", ("dependency",)))
+ADMISSION_QUEUE = _register(Gauge(
+    "safespace_admission_queue_depth", "Requests waiting for an admission slot, by lane", ("lane",)))
+SHED = _register(Counter(
+    "safespace_shed_total", "Requests answered with the fallback instead of being served, by reason", ("reason",)))
+DEADLINE_EXCEEDED = _register(Counter(
+    "safespace_deadline_exceeded_total", "Work abandoned because the request deadline passed, by stage", ("stage",)))
+SPECULATIONS = _register(Counter(
+    "safespace_speculations_total", "Speculative therapy replies, by outcome (hit or miss)", ("outcome",)))
+ROUTER_TOKENS = _register(Histogram(
+    "safespace_router_tokens", "Tokens per router LLM call, by kind (prompt or completion) and mode",
+    ("kind", "mode"), buckets=(8, 16, 32, 64, 128, 256, 512, 1024, 2048)))
+
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --------------- SPANS -------------------
+
+class span:
+    """
+    Time a stage: `with span("overpass"):`. Records the stage latency
+    histogram, counts calls and errors, and logs the duration at DEBUG.
+    """
+
+    __slots__ = ("stage", "fields", "start")
+
+    def __init__(self, stage: str, **fields):
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        STAGE_LATENCY.observe(elapsed, stage=self.stage)
+        STAGE_CALLS.inc(stage=self.stage)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            STAGE_ERRORS.inc(stage=self.stage)
+        logger.debug("span", extra={"stage": self.stage, "duration_ms": round(elapsed * 1000, 2),
+                                    "error": exc_type.__name__ if exc_type else None, **self.fields})
+        return False
+
+
+# --------------- LOGGING -------------------
+
+_RESERVED = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the trace ID and any `extra` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and value is not None:
+                entry[key] = value
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _TraceFilter(logging.Filter):
+    # Runs in the caller's thread/task, so the context variable is still set
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+logger = logging.getLogger("safespace")
+_listener = None
+
+
+def setup_logging():
+    """Route the safespace logger through a queue drained by a background thread."""
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(_TraceFilter())
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    logger.handlers[:] = [queue_handler]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logger.getChild(name)
@@ -1,17 +1,21 @@
 # Step1: Setup Medgemma tool (with Groq fallback for deployment)
-try:
-    import ollama
-    OLLAMA_AVAILABLE = True
-except ImportError:
-    OLLAMA_AVAILABLE = False
-    print("⚠️ Ollama not available, will use Groq API for therapy responses")
-
-def query_medgemma(prompt: str) -> str:
-    """
-    Calls MedGemma model (or Groq fallback) with a therapist personality profile.
-    Returns responses as an empathic mental health professional.
-    """
-    system_prompt = """You are Dr. Emily Hartman, a warm and experienced clinical psychologist. 
+import asyncio
+import importlib.util
+from .clients import get_http_client, get_groq_llm, get_twilio_client, run_sync
+from .deadlines import DeadlineExceeded, iterate_within, record_exceeded, within
+from .inference import ollama_inference
+from .hedging import therapy_hedger
+from .resilience import breaker
+from .telemetry import get_logger, span
+
+logger = get_logger("tools")
+
+# Only probed here: inference.py imports the client when it first runs
+OLLAMA_AVAILABLE = importlib.util.find_spec("ollama") is not None
+if not OLLAMA_AVAILABLE:
+    logger.warning("Ollama not available, will use Groq API for therapy responses")
+
+THERAPIST_PROMPT = """You are Dr. Emily Hartman, a warm and experienced clinical psychologist. 
     Respond to patients with: 
 
     1. Emotional attunement ("I can sense how difficult this must be...")
@@ -27,86 +31,201 @@ def query_medgemma(prompt: str) -> str:
     - Mirror the user's language level
     - Always keep the conversation going by asking open ended questions to dive into the root cause of patients problem
     """
-    
+
+THERAPY_FALLBACK = "I'm here to support you. I can sense you're going through a difficult time. Your feelings are completely valid. Can you tell me more about what's been weighing on your mind? I'm listening."
+
+
+def _therapy_messages(prompt: str, history: tuple = None) -> list:
+    """Chat messages for the therapy model, with (summary, turns) session history."""
+    messages = [{"role": "system", "content": THERAPIST_PROMPT}]
+    if history:
+        summary, turns = history
+        if summary:
+            messages.append({"role": "system", "content": f"Earlier in this conversation the patient said: {summary}"})
+        messages.extend({"role": role, "content": text} for role, text in turns)
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def query_medgemma(prompt: str, history: tuple = None) -> str:
+    """
+    Calls MedGemma model (or Groq fallback) with a therapist personality profile.
+    Returns responses as an empathic mental health professional.
+    `history` is the (summary, turns) pair from the session store.
+    """
+    return run_sync(aquery_medgemma(prompt, history))
+
+
+async def aquery_medgemma(prompt: str, history: tuple = None) -> str:
+    """
+    Async version of query_medgemma. Sent to the healthiest of Ollama (when
+    installed) and Groq, hedged to the other one if it is slow or fails
+    (see hedging.py). Gives up at the request's deadline (see deadlines.py).
+    """
+    messages = _therapy_messages(prompt, history)
     try:
-        # Try Ollama first if available (local development)
-        if OLLAMA_AVAILABLE:
-            print(f"🔍 Calling MedGemma with prompt: {prompt}")
-            response = ollama.chat(
-                model='alibayram/medgemma:4b',
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                options={
-                    'num_predict': 350,
-                    'temperature': 0.7,
-                    'top_p': 0.9
-                }
-            )
-            result = response['message']['content'].strip()
-            print(f"✅ MedGemma response: {result[:100]}...")
-            return result
-        else:
-            # Fallback to Groq API for production deployment
-            print(f"🔍 Using Groq API fallback for therapy response")
-            from .config import GROQ_API_KEY
-            from langchain_groq import ChatGroq
-            from langchain_core.messages import HumanMessage, SystemMessage
-            
-            if not GROQ_API_KEY:
-                raise ValueError("GROQ_API_KEY not set")
-            
-            llm = ChatGroq(
-                model="llama-3.1-8b-instant",
-                groq_api_key=GROQ_API_KEY,
-                temperature=0.7,
-            )
-            
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=prompt)
-            ]
-            
-            response = llm.invoke(messages)
-            result = response.content.strip()
-            print(f"✅ Groq therapy response: {result[:100]}...")
-            return result
-            
+        with span("medgemma"):
+            _, reply = await within("medgemma", therapy_hedger.race(_therapy_calls(messages)))
+        return reply
+    except DeadlineExceeded:
+        record_exceeded("medgemma")
+        return THERAPY_FALLBACK
+    except Exception as e:
+        logger.warning("therapy response failed, using fallback", extra={"error": str(e)})
+        return THERAPY_FALLBACK
+
+
+def _therapy_calls(messages: list) -> dict:
+    """Provider name -> coroutine factory for one therapy reply."""
+    async def groq_reply():
+        with span("medgemma_groq"):
+            response = await breaker("groq_therapy").call(lambda: get_groq_llm(0.7).ainvoke(messages))
+        return response.content.strip()
+
+    async def ollama_reply():
+        # Queued behind other generations (see inference.py); a full queue
+        # or an open circuit raises and the other provider answers instead
+        return (await breaker("ollama").call(lambda: ollama_inference.chat(messages))).strip()
+
+    if not OLLAMA_AVAILABLE:
+        return {"groq": groq_reply}
+    return {"ollama": ollama_reply, "groq": groq_reply}
+
+
+async def astream_medgemma(prompt: str, history: tuple = None):
+    """
+    Streaming version of aquery_medgemma: yields response text chunks as the
+    model produces them, from whichever provider sends its first chunk
+    first. Falls back to the canned reply if nothing was generated before
+    an error; at the request's deadline the reply ends where it got to.
+    """
+    produced = False
+    try:
+        with span("medgemma_stream"):
+            streams = _therapy_streams(_therapy_messages(prompt, history))
+            async for token in iterate_within("medgemma_stream", therapy_hedger.race_stream(streams)):
+                produced = True
+                yield token
+    except DeadlineExceeded:
+        record_exceeded("medgemma_stream")
+        if not produced:
+            yield THERAPY_FALLBACK
     except Exception as e:
-        error_msg = f"Therapy response error: {str(e)}"
-        print(f"❌ {error_msg}")
-        import traceback
-        traceback.print_exc()
-        return f"I'm here to support you. I can sense you're going through a difficult time. Your feelings are completely valid. Can you tell me more about what's been weighing on your mind? I'm listening."
+        logger.warning("therapy stream failed", extra={"error": str(e), "produced": produced})
+        if not produced:
+            yield THERAPY_FALLBACK
+
+
+def _therapy_streams(messages: list) -> dict:
+    """Provider name -> async generator factory for one streamed therapy reply."""
+    async def chunks():
+        async for chunk in get_groq_llm(0.7).astream(messages):
+            if chunk.content:
+                yield chunk.content
+
+    # The breakers time the first chunk (see resilience.py)
+    def groq_stream():
+        return breaker("groq_therapy").stream(chunks)
+
+    def ollama_stream():
+        return breaker("ollama").stream(lambda: ollama_inference.stream_chat(messages))
+
+    if not OLLAMA_AVAILABLE:
+        return {"groq": groq_stream}
+    return {"ollama": ollama_stream, "groq": groq_stream}
+
 
 # Step2: Setup Twilio calling API tool
-from twilio.rest import Client
-from .config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_FROM_NUMBER, EMERGENCY_CONTACT
+from .config import TWILIO_FROM_NUMBER, EMERGENCY_CONTACT
+
+
+def call_emergency() -> str:
+    """Place the emergency call and return its Twilio call SID."""
+    client = get_twilio_client()
+    with span("twilio"):
+        call = client.calls.create(
+            to=EMERGENCY_CONTACT,
+            from_=TWILIO_FROM_NUMBER,
+            url="http://demo.twilio.com/docs/voice.xml"  # Can customize message
+        )
+    return call.sid
 
 
-def call_emergency():
-    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-    call = client.calls.create(
-        to=EMERGENCY_CONTACT,
-        from_=TWILIO_FROM_NUMBER,
-        url="http://demo.twilio.com/docs/voice.xml"  # Can customize message
-    )
+async def acall_emergency() -> str:
+    """Run the blocking Twilio REST call in a worker thread."""
+    return await asyncio.to_thread(call_emergency)
 
 # Step3: Setup free APIs for finding therapists (no payment info required)
-import requests
-import json
+import ipaddress
+import os
+from .geocache import geocode_cache
+from .geoip import locate_ip
+from .gazetteer import GAZETTEER_CONFIDENCE, get_gazetteer
+from .facility_store import get_facility_store
+from .facility_cache import facility_cache
+from .ranking import rank_facilities
+from .overpass import search as overpass_search
 
-def get_user_location() -> dict:
+IPAPI_URL = os.getenv("IPAPI_URL", "https://ipapi.co/json/")
+# Same service asked about a specific address (used when there is no local GeoIP database)
+IPAPI_IP_URL = os.getenv("IPAPI_IP_URL", IPAPI_URL.replace("/json/", "/{ip}/json/"))
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+RESULT_COUNT = 5
+
+_CRISIS_RESOURCES = """**Immediate Help:**
+- 988 Suicide & Crisis Lifeline
+- Crisis Text Line: Text HOME to 741741
+- National Helpline: 1-800-662-4357
+
+**Find Therapists Online:**
+- Psychology Today: https://www.psychologytoday.com/us/therapists
+- BetterHelp: https://www.betterhelp.com"""
+
+# Answer to a therapist search that failed outright
+SEARCH_FALLBACK = "I encountered an error while searching. Here are crisis resources:\n\n" + _CRISIS_RESOURCES
+# Answer to a therapist search still running at the request's deadline
+SEARCH_TIMEOUT_FALLBACK = (
+    "The therapist search is taking longer than expected. In the meantime, here are resources you can "
+    "reach right now:\n\n" + _CRISIS_RESOURCES
+)
+
+def _is_public(ip: str) -> bool:
+    try:
+        return ipaddress.ip_address(ip).is_global
+    except ValueError:
+        return False
+
+
+def get_user_location(client_ip: str = None) -> dict:
     """
     Automatically detect user's location using IP geolocation (free, no API key).
     Returns dict with lat, lon, and location name.
     """
+    return run_sync(aget_user_location(client_ip))
+
+
+async def aget_user_location(client_ip: str = None) -> dict:
+    """
+    Async version of get_user_location. The client's IP is looked up in the
+    local GeoIP database (see geoip.py) without a network call; ipapi.co is
+    only asked when no database covers it.
+    """
+    located = locate_ip(client_ip)
+    if located is not None:
+        return located
     try:
-        print("🌐 Detecting your location...")
-        # Use ipapi.co - free, no API key required
-        response = requests.get("https://ipapi.co/json/", timeout=5)
-        data = response.json()
+        # Use ipapi.co - free, no API key required. A private or missing
+        # client IP (local development) falls back to the server's location.
+        url = IPAPI_IP_URL.format(ip=client_ip) if client_ip and _is_public(client_ip) else IPAPI_URL
+        client = get_http_client()
+
+        async def fetch():
+            response = await client.get(url)
+            return response.json()
+
+        # Timeout and circuit breaker per dependency (see resilience.py)
+        with span("ipapi"):
+            data = await breaker("ipapi").call(fetch)
         
         lat = data.get("latitude")
         lon = data.get("longitude")
@@ -116,18 +235,87 @@ def get_user_location() -> dict:
         
         location_name = f"{city}, {region}, {country}" if city else f"{region}, {country}"
         
-        print(f"📍 Detected location: {location_name} ({lat}, {lon})")
-        
         return {
             "lat": lat,
             "lon": lon,
             "name": location_name
         }
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"❌ Could not detect location: {e}")
+        logger.warning("could not detect location", extra={"error": str(e)})
         return None
 
-def find_nearby_therapists(location: str = None, radius: int = 5) -> str:
+async def _nominatim_search(location: str) -> dict:
+    """Geocode a location with Nominatim (free, no API key). None if unknown."""
+    geocode_url = NOMINATIM_URL
+    geocode_params = {
+        "q": location,
+        "format": "json",
+        "limit": 1
+    }
+    headers = {
+        "User-Agent": "SafeSpace-Mental-Health-App/1.0"  # Required by Nominatim
+    }
+    
+    client = get_http_client()
+
+    async def fetch():
+        geocode_response = await client.get(geocode_url, params=geocode_params, headers=headers)
+        geocode_response.raise_for_status()
+        return geocode_response.json()
+
+    with span("nominatim"):
+        geocode_data = await breaker("nominatim").call(fetch)
+    
+    if not geocode_data:
+        return None
+    return {
+        "lat": float(geocode_data[0]["lat"]),
+        "lon": float(geocode_data[0]["lon"]),
+        "display_name": geocode_data[0]["display_name"]
+    }
+
+
+_gazetteer_stats = {"resolved": 0, "ambiguous": 0, "unknown": 0}
+
+
+def gazetteer_stats() -> dict:
+    lookups = sum(_gazetteer_stats.values())
+    return {**_gazetteer_stats, "skip_rate": _gazetteer_stats["resolved"] / lookups if lookups else 0.0}
+
+
+async def ageocode_location(location: str) -> dict:
+    """
+    Geocode a location name. Unambiguous names in the offline gazetteer are
+    resolved locally; anything else goes to Nominatim through the geocode
+    cache. Returns dict with lat, lon and display_name, or None if not found.
+    If Nominatim is unavailable, an ambiguous gazetteer match is used.
+    """
+    place = None
+    gazetteer = get_gazetteer()
+    if gazetteer is not None:
+        with span("gazetteer"):
+            place = gazetteer.resolve(location)
+        if place is None:
+            _gazetteer_stats["unknown"] += 1
+        elif place["confidence"] < GAZETTEER_CONFIDENCE:
+            # e.g. "Springfield": let Nominatim pick among the candidates
+            _gazetteer_stats["ambiguous"] += 1
+        else:
+            _gazetteer_stats["resolved"] += 1
+            return {"lat": place["lat"], "lon": place["lon"], "display_name": place["display_name"]}
+    try:
+        return await geocode_cache.get_or_fetch(location, _nominatim_search)
+    except Exception as e:
+        if place is None:
+            raise
+        logger.warning("Nominatim unavailable, using best gazetteer match",
+                       extra={"location": location, "error": str(e)})
+        return {"lat": place["lat"], "lon": place["lon"], "display_name": place["display_name"]}
+
+
+def find_nearby_therapists(location: str = None, radius: int = 5, client_ip: str = None) -> str:
     """
     Find nearby therapists using OpenStreetMap (completely free, no API key required).
     If no location is provided, automatically detects user's location.
@@ -135,57 +323,53 @@ def find_nearby_therapists(location: str = None, radius: int = 5) -> str:
     Args:
         location: Location name (e.g., "New York", "Mumbai", "90210") or None for auto-detect
         radius: Search radius in miles (default 5 miles for auto-detect, 25 for manual)
+        client_ip: Address of the user, used to auto-detect their location
     
     Returns:
         Formatted string with therapist information
     """
+    return run_sync(afind_nearby_therapists(location, radius, client_ip))
+
+
+async def afind_nearby_therapists(location: str = None, radius: int = 5, client_ip: str = None) -> str:
+    """Async version of find_nearby_therapists."""
     try:
         # If no location provided, auto-detect
         if not location or location == "your area":
-            user_location = get_user_location()
+            user_location = await aget_user_location(client_ip)
             if user_location:
                 lat = user_location["lat"]
                 lon = user_location["lon"]
                 display_name = user_location["name"]
                 radius = 5  # Smaller radius for auto-detected location
-                print(f"✅ Using auto-detected location: {display_name}")
             else:
                 return "I couldn't detect your location automatically. Please specify a location like 'Find therapists near Bangalore'"
         else:
-            # Geocode the provided location using Nominatim (free, no API key)
-            print(f"🌍 Geocoding location: {location}")
-            geocode_url = "https://nominatim.openstreetmap.org/search"
-            geocode_params = {
-                "q": location,
-                "format": "json",
-                "limit": 1
-            }
-            headers = {
-                "User-Agent": "SafeSpace-Mental-Health-App/1.0"  # Required by Nominatim
-            }
+            # Geocode the provided location (cached, see geocache.py)
+            geocoded = await ageocode_location(location)
             
-            geocode_response = requests.get(geocode_url, params=geocode_params, headers=headers)
-            geocode_data = geocode_response.json()
-            
-            if not geocode_data:
+            if not geocoded:
                 return f"Sorry, I couldn't find the location '{location}'. Please try:\n- A city name (e.g., 'New York')\n- A zip code (e.g., '10001')\n- A state name (e.g., 'California')"
             
-            lat = float(geocode_data[0]["lat"])
-            lon = float(geocode_data[0]["lon"])
-            display_name = geocode_data[0]["display_name"]
+            lat = geocoded["lat"]
+            lon = geocoded["lon"]
+            display_name = geocoded["display_name"]
             radius = 25  # Larger radius for manual location
-            
-            print(f"📍 Found coordinates: {lat}, {lon} ({display_name})")
         
-        # Search OpenStreetMap for mental health facilities
-        print("🗺️ Searching OpenStreetMap for facilities...")
-        osm_results = search_openstreetmap(lat, lon, radius, display_name)
+        # Prefer the offline facility store; Overpass where it has no
+        # coverage or nothing near this point
+        store = get_facility_store()
+        osm_results = None
+        if store is not None and store.covers(lat, lon):
+            osm_results = search_facility_store(store, lat, lon, radius, display_name)
+        if not osm_results:
+            osm_results = await asearch_openstreetmap(lat, lon, radius, display_name)
         
         if osm_results:
             return osm_results
         
         # If OpenStreetMap didn't return results, provide helpful resources
-        print("⚠️ OpenStreetMap returned no results, providing alternative resources...")
+        logger.info("no facilities found, returning directory resources", extra={"location": display_name})
         
         result = f"""I couldn't find specific mental health facilities near {display_name} in the database, but here are some resources to help:
 
@@ -211,24 +395,54 @@ def find_nearby_therapists(location: str = None, radius: int = 5) -> str:
         return result
 
         
-    except Exception as e:
-        error_msg = f"Error finding therapists: {str(e)}"
-        print(f"❌ {error_msg}")
-        import traceback
-        traceback.print_exc()
-        return f"""I encountered an error while searching. Here are crisis resources:
+    except DeadlineExceeded:
+        # Out of time: crisis resources now beat facilities later
+        record_exceeded("find_nearby_therapists")
+        return SEARCH_TIMEOUT_FALLBACK
+    except Exception:
+        logger.exception("therapist search failed")
+        return SEARCH_FALLBACK
 
-**Immediate Help:**
-- 988 Suicide & Crisis Lifeline
-- Crisis Text Line: Text HOME to 741741
-- National Helpline: 1-800-662-4357
 
-**Find Therapists Online:**
-- Psychology Today: https://www.psychologytoday.com/us/therapists
-- BetterHelp: https://www.betterhelp.com"""
 
 
 
+def format_facilities(facilities: list, location_name: str) -> str:
+    """Format facility dicts into the markdown list shown to the user."""
+    result = f"Here are mental health facilities near {location_name}:\n\n"
+    for i, facility in enumerate(facilities, 1):
+        result += f"{i}. **{facility['name']}**\n"
+        if facility['address'] != "Address not available":
+            result += f"   📍 {facility['address']}"
+            if facility['city']:
+                result += f", {facility['city']}"
+            result += "\n"
+        result += f"   📞 {facility['phone']}\n"
+        if facility['website'] != "N/A":
+            result += f"   🌐 {facility['website']}\n"
+        result += f"   🏥 Specialty: {facility['specialty']}\n"
+        if "distance_m" in facility:
+            result += f"   📏 {facility['distance_m'] / 1609.34:.1f} mi away\n"
+        result += "\n"
+    
+    result += "\n💡 **Additional Resources:**\n"
+    result += "- Psychology Today Therapist Finder: https://www.psychologytoday.com/us/therapists\n"
+    result += "- National Helpline: 1-800-662-4357 (free, confidential, 24/7)\n"
+    result += "- Crisis Text Line: Text HOME to 741741\n"
+    
+    return result
+
+
+def search_facility_store(store, lat: float, lon: float, radius_miles: int, location_name: str) -> str:
+    """Answer a facility search from the offline facility store."""
+    radius_meters = radius_miles * 1609.34
+    with span("facility_store"):
+        hits = store.nearby(lat, lon, radius_meters)
+    if not hits:
+        return None
+    with span("ranking"):
+        ranked = rank_facilities([facility for _, facility in hits], lat, lon, radius_miles, k=RESULT_COUNT)
+    return format_facilities(ranked, location_name)
 
 
 def search_openstreetmap(lat: float, lon: float, radius_miles: int, location_name: str) -> str:
@@ -237,92 +451,32 @@ def search_openstreetmap(lat: float, lon: float, radius_miles: int, location_nam
     Search OpenStreetMap for mental health facilities using Overpass API.
     Completely free, no API key required.
     """
+    return run_sync(asearch_openstreetmap(lat, lon, radius_miles, location_name))
+
+
+async def asearch_openstreetmap(lat: float, lon: float, radius_miles: int, location_name: str) -> str:
+    """
+    Async version of search_openstreetmap. Results are cached per geohash
+    cell and radius bucket (see facility_cache.py); the query itself is
+    planned in overpass.py. Raises DeadlineExceeded if the request's
+    deadline passes first; the cache fill carries on for later requests.
+    """
     try:
-        print(f"🗺️ Searching OpenStreetMap...")
-        
-        # Convert miles to meters for Overpass API
-        radius_meters = int(radius_miles * 1609.34)
-        
-        # Overpass API query for mental health facilities
-        overpass_url = "https://overpass-api.de/api/interpreter"
-        
-        # Query for healthcare facilities that might offer mental health services
-        overpass_query = f"""
-        [out:json];
-        (
-          node["amenity"="doctors"]["healthcare:speciality"~"psychiatry|psychology|mental_health"](around:{radius_meters},{lat},{lon});
-          node["amenity"="clinic"]["healthcare:speciality"~"psychiatry|psychology|mental_health"](around:{radius_meters},{lat},{lon});
-          node["healthcare"="psychotherapist"](around:{radius_meters},{lat},{lon});
-          node["healthcare"="counselling"](around:{radius_meters},{lat},{lon});
-          way["amenity"="doctors"]["healthcare:speciality"~"psychiatry|psychology|mental_health"](around:{radius_meters},{lat},{lon});
-          way["amenity"="clinic"]["healthcare:speciality"~"psychiatry|psychology|mental_health"](around:{radius_meters},{lat},{lon});
-          way["healthcare"="psychotherapist"](around:{radius_meters},{lat},{lon});
-          way["healthcare"="counselling"](around:{radius_meters},{lat},{lon});
-        );
-        out center 10;
-        """
-        
-        response = requests.post(overpass_url, data={"data": overpass_query}, timeout=30)
-        data = response.json()
-        
-        if not data.get("elements"):
-            print("⚠️ No results from OpenStreetMap")
-            return None
-        
-        # Format results
-        facilities = []
-        for element in data["elements"][:5]:  # Limit to 5 results
-            tags = element.get("tags", {})
-            
-            # Get coordinates
-            if element["type"] == "node":
-                elem_lat = element.get("lat")
-                elem_lon = element.get("lon")
-            else:  # way
-                elem_lat = element.get("center", {}).get("lat")
-                elem_lon = element.get("center", {}).get("lon")
-            
-            facility = {
-                "name": tags.get("name", "Mental Health Facility"),
-                "address": tags.get("addr:street", "Address not available"),
-                "city": tags.get("addr:city", ""),
-                "phone": tags.get("phone", "N/A"),
-                "website": tags.get("website", "N/A"),
-                "specialty": tags.get("healthcare:speciality", "Mental Health"),
-                "lat": elem_lat,
-                "lon": elem_lon
-            }
-            facilities.append(facility)
+        facilities = await within("search_openstreetmap",
+                                  facility_cache.get_or_fetch(lat, lon, radius_miles, overpass_search))
         
         if not facilities:
             return None
         
-        # Format output
-        result = f"Here are mental health facilities near {location_name}:\n\n"
-        for i, facility in enumerate(facilities, 1):
-            result += f"{i}. **{facility['name']}**\n"
-            if facility['address'] != "Address not available":
-                result += f"   📍 {facility['address']}"
-                if facility['city']:
-                    result += f", {facility['city']}"
-                result += "\n"
-            result += f"   📞 {facility['phone']}\n"
-            if facility['website'] != "N/A":
-                result += f"   🌐 {facility['website']}\n"
-            result += f"   🏥 Specialty: {facility['specialty']}\n"
-            result += "\n"
-        
-        result += "\n💡 **Additional Resources:**\n"
-        result += "- Psychology Today Therapist Finder: https://www.psychologytoday.com/us/therapists\n"
-        result += "- National Helpline: 1-800-662-4357 (free, confidential, 24/7)\n"
-        result += "- Crisis Text Line: Text HOME to 741741\n"
-        
-        return result
+        # The cached candidates cover the whole cell; rank them from the user's point
+        with span("ranking"):
+            ranked = rank_facilities(facilities, lat, lon, radius_miles, k=RESULT_COUNT)
+        if not ranked:
+            return None
+        return format_facilities(ranked, location_name)
         
+    except DeadlineExceeded:
+        raise  # counted by the caller that answers instead
     except Exception as e:
-        print(f"⚠️ OpenStreetMap search failed: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.warning("OpenStreetMap search failed", extra={"error": str(e)})
         return None
-
-
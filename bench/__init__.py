@@ -0,0 +1 @@
+# SafeSpace offline benchmarks and fake upstream services
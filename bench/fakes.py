@@ -0,0 +1,353 @@
+# Local stand-ins for the agent's upstream services
+"""
+Fake upstream servers that run in a background thread on 127.0.0.1.
+Each one has a configurable response latency and error rate so the agent
+can be exercised entirely offline.
+"""
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+OVERPASS_FIXTURE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "openstreetmap_response.json")
+
+
+class FakeServer:
+    """
+    Base class: subclasses implement handle(method, path, body) returning
+    (status, payload) or (status, payload, content_type). A dict/list
+    payload is sent as JSON, bytes are sent as is.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle(self, method: str, path: str, body: bytes) -> tuple:
+        raise NotImplementedError
+
+    def start(self) -> "FakeServer":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if random.random() < fake.error_rate:
+                    result = (503, {"error": "injected failure"})
+                else:
+                    result = fake.handle(method, self.path, body)
+                status, payload = result[0], result[1]
+                content_type = result[2] if len(result) > 2 else "application/json"
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (a timeout, or a hedge/speculation that lost)
+                    self.close_connection = True
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeTwilio(FakeServer):
+    """Accepts Calls.json requests and records the calls placed."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        super().__init__(latency, error_rate)
+        self.calls = []
+
+    def handle(self, method, path, body):
+        if method == "POST" and path.endswith("/Calls.json"):
+            sid = "CA" + uuid.uuid4().hex
+            self.calls.append({"sid": sid, "body": body.decode()})
+            return 201, {"sid": sid, "status": "queued"}
+        return 404, {"message": "not found"}
+
+
+# --------------- LLMs -------------------
+
+ROUTER_RULES = [
+    (re.compile(r"suicid|kill myself|end my life|hurt myself", re.I), "USE_TOOL: emergency_call_tool"),
+    (re.compile(r"therapist|counsel|psychiatrist|psychologist", re.I), "USE_TOOL: find_nearby_therapists_by_location"),
+    (re.compile(r"sad|depress|anxious|stress|lonely|cry|worr|overwhelm|cope", re.I), "USE_TOOL: ask_mental_health_specialist"),
+]
+
+THERAPY_REPLY = (
+    "I can sense how difficult this must be for you. Many people feel this way "
+    "when things pile up. What do you think has been weighing on you the most?"
+)
+
+
+def fake_completion(messages: list) -> str:
+    """Reply like the router when given the routing prompt, otherwise like the therapist."""
+    system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    if "USE_TOOL" in system:
+        for pattern, marker in ROUTER_RULES:
+            if pattern.search(user):
+                return marker
+        return "Hello! I'm here to support you. How are you feeling today?"
+    return THERAPY_REPLY
+
+
+_PLACE_RE = re.compile(r"\b(?:near|in|around)\s+([A-Z][\w'-]*(?:\s+[A-Z][\w'-]*)*)")
+
+
+def fake_route(messages: list) -> dict:
+    """Arguments of the router's `route` tool call for the latest user message."""
+    user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    for pattern, marker in ROUTER_RULES:
+        if pattern.search(user):
+            intent = marker.split(": ", 1)[1]
+            place = _PLACE_RE.search(user) if intent == "find_nearby_therapists_by_location" else None
+            return {"intent": intent, "location": place.group(1) if place else "", "confidence": 0.9}
+    return {"intent": "greeting", "location": "", "confidence": 0.8}
+
+
+def _words(text: str) -> list:
+    return re.findall(r"\S+\s*", text)
+
+
+class FakeGroq(FakeServer):
+    """OpenAI-compatible chat completions endpoint (set GROQ_API_BASE to .url)."""
+
+    def handle(self, method, path, body):
+        if method != "POST" or not path.endswith("/chat/completions"):
+            return 404, {"error": {"message": "not found"}}
+        request = json.loads(body or b"{}")
+        model = request.get("model", "fake")
+        created = int(time.time())
+        completion_id = "chatcmpl-" + uuid.uuid4().hex
+        # Tool definitions are part of the prompt
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+        prompt_tokens += len(json.dumps(request.get("tools", [])).split()) if request.get("tools") else 0
+
+        if request.get("tools") and not request.get("stream"):
+            arguments = json.dumps(fake_route(request.get("messages", [])))
+            completion_tokens = len(arguments.split())
+            call = {"id": "call_" + uuid.uuid4().hex[:8], "type": "function",
+                    "function": {"name": request["tools"][0]["function"]["name"], "arguments": arguments}}
+            return 200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": None, "tool_calls": [call]},
+                             "finish_reason": "tool_calls"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            }
+
+        content = fake_completion(request.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content.split()),
+            "total_tokens": prompt_tokens + len(content.split()),
+        }
+
+        if request.get("stream"):
+            events = []
+            for word in _words(content):
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": word}, "finish_reason": None}],
+                }
+                events.append(f"data: {json.dumps(chunk)}\n\n")
+            final = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "x_groq": {"usage": usage},
+            }
+            events.append(f"data: {json.dumps(final)}\n\n")
+            events.append("data: [DONE]\n\n")
+            return 200, "".join(events).encode(), "text/event-stream"
+
+        return 200, {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+
+def _seconds(duration) -> float:
+    """Seconds in an Ollama keep_alive value: a number or e.g. "30s", "5m", "1h"."""
+    if isinstance(duration, str) and duration[-1:] in ("s", "m", "h"):
+        return float(duration[:-1]) * {"s": 1, "m": 60, "h": 3600}[duration[-1]]
+    return float(duration)
+
+
+class FakeOllama(FakeServer):
+    """
+    Ollama /api/chat and /api/generate (set OLLAMA_HOST to .url). The first
+    request, and any after the requested keep_alive (default 5m) has
+    lapsed, waits `load_seconds` for the model to load.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, load_seconds: float = 1.0):
+        super().__init__(latency, error_rate)
+        self.load_seconds = load_seconds
+        self.loads = 0
+        self._loaded_until = 0.0
+        self._load_lock = threading.Lock()
+
+    def _load(self, keep_alive) -> int:
+        """Load the model if needed; returns load_duration in nanoseconds."""
+        keep_alive = 300 if keep_alive is None else _seconds(keep_alive)
+        with self._load_lock:
+            load = 0.0
+            if time.time() >= self._loaded_until:
+                time.sleep(self.load_seconds)
+                load = self.load_seconds
+                self.loads += 1
+            self._loaded_until = float("inf") if keep_alive < 0 else time.time() + keep_alive
+        return int(load * 1e9)
+
+    def handle(self, method, path, body):
+        request = json.loads(body or b"{}")
+        model = request.get("model", "fake")
+        load_duration = self._load(request.get("keep_alive"))
+        if path.startswith("/api/chat"):
+            content = fake_completion(request.get("messages", []))
+            if request.get("stream"):
+                lines = [
+                    json.dumps({"model": model, "created_at": "2025-01-01T00:00:00Z",
+                                "message": {"role": "assistant", "content": word}, "done": False})
+                    for word in _words(content)
+                ]
+                lines.append(json.dumps({"model": model, "created_at": "2025-01-01T00:00:00Z",
+                                         "message": {"role": "assistant", "content": ""}, "done": True,
+                                         "eval_count": len(content.split()), "load_duration": load_duration}))
+                return 200, ("\n".join(lines) + "\n").encode(), "application/x-ndjson"
+            return 200, {"model": model, "created_at": "2025-01-01T00:00:00Z",
+                         "message": {"role": "assistant", "content": content}, "done": True,
+                         "eval_count": len(content.split()), "load_duration": load_duration}
+        if path.startswith("/api/generate"):
+            return 200, {"model": model, "created_at": "2025-01-01T00:00:00Z", "response": "", "done": True,
+                         "load_duration": load_duration}
+        return 404, {"error": "not found"}
+
+
+# --------------- LOCATION SERVICES -------------------
+
+class FakeNominatim(FakeServer):
+    """Nominatim /search: deterministic coordinates per query; "nowhere" is not found."""
+
+    def handle(self, method, path, body):
+        url = urlparse(path)
+        query = parse_qs(url.query).get("q", [""])[0]
+        if not query or "nowhere" in query.lower():
+            return 200, []
+        h = zlib.crc32(query.lower().encode())
+        lat = -60 + (h % 12000) / 100
+        lon = -180 + ((h // 12000) % 36000) / 100
+        return 200, [{"lat": f"{lat:.6f}", "lon": f"{lon:.6f}", "display_name": query.title()}]
+
+
+class FakeOverpass(FakeServer):
+    """
+    Overpass /api/interpreter. Answers with the saved response's facilities
+    (openstreetmap_response.json by default) repeated at `density` per km2
+    around the queried point, honouring the radius, the `out` count and
+    `tags` verbosity (every third facility is a way with a node list).
+    Server time grows with the area each `around` clause scans:
+    `scan_seconds` per clause per 1000 km2.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, fixture: str = OVERPASS_FIXTURE,
+                 density: float = 0.05, scan_seconds: float = 0.02):
+        super().__init__(latency, error_rate)
+        with open(fixture, "rb") as f:
+            self.templates = [e.get("tags", {}) for e in json.load(f)["elements"]]
+        self.density = density
+        self.scan_seconds = scan_seconds
+        self.bytes_sent = 0
+        self.server_seconds = 0.0
+
+    def handle(self, method, path, body):
+        query = parse_qs(body.decode()).get("data", [""])[0]
+        match = re.search(r"around:([\d.]+),(-?[\d.]+),(-?[\d.]+)", query)
+        if not match:
+            return 400, {"remark": "runtime error: no around filter"}
+        radius_m, lat, lon = float(match[1]), float(match[2]), float(match[3])
+        out = re.search(r"out\b([^;]*);", query)
+        limit = re.search(r"\d+", out[1]) if out else None
+        with_nodes = not (out and "tags" in out[1].split())
+
+        area_km2 = math.pi * (radius_m / 1000) ** 2
+        server_time = query.count("around:") * area_km2 / 1000 * self.scan_seconds
+        time.sleep(server_time)
+        self.server_seconds += server_time
+
+        rng = random.Random(zlib.crc32(f"{lat:.4f},{lon:.4f},{radius_m:.0f}".encode()))
+        count = int(area_km2 * self.density)
+        if limit:
+            count = min(count, int(limit[0]))
+        elements = []
+        for i in range(count):
+            r, theta = radius_m * math.sqrt(rng.random()), rng.uniform(0, 2 * math.pi)
+            point = {"lat": lat + r * math.cos(theta) / 111_320,
+                     "lon": lon + r * math.sin(theta) / (111_320 * math.cos(math.radians(lat)))}
+            tags = self.templates[i % len(self.templates)]
+            if i % 3 == 2:
+                element = {"type": "way", "id": 1_000_000 + i, "center": point, "tags": tags}
+                if with_nodes:
+                    element["nodes"] = [10_000_000 + i * 8 + k for k in range(8)]
+            else:
+                element = {"type": "node", "id": i, **point, "tags": tags}
+            elements.append(element)
+        payload = json.dumps({"version": 0.6, "generator": "bench", "elements": elements}).encode()
+        self.bytes_sent += len(payload)
+        return 200, payload
+
+
+class FakeIpapi(FakeServer):
+    """ipapi.co /json/ returning a fixed location."""
+
+    def handle(self, method, path, body):
+        return 200, {"latitude": 40.7128, "longitude": -74.006, "city": "New York",
+                     "region": "New York", "country_name": "United States"}
@@ -0,0 +1,434 @@
+# Open-loop load generator: replays a request corpus against the FastAPI app at a target rate
+"""
+Sends /ask requests at a fixed or ramping rate with Poisson arrivals and
+reports throughput, latency percentiles and errors per rate step, plus the
+saturation knee (the highest rate the service kept up with). The load is
+open loop: each request is sent when it is due, whether or not earlier
+ones have finished, so a saturated service shows up as growing latency
+instead of a slower sender.
+
+    python -m bench.load --qps 20 --duration 30
+    python -m bench.load --ramp 5:100:5 --step-seconds 10 --out load.json
+    python -m bench.load --corpus traffic.jsonl --qps 10 --latency groq=0.3
+
+The corpus is JSONL with one request per line, {"message": ...,
+"session_id": ..., "intent": ..., "client": ...}. Only message is
+required; intent labels the per-intent report and client is the address
+sent as X-Forwarded-For (the server rate-limits per client). Lines are
+replayed in order, cycling. Without --corpus, messages are generated in
+the proportions given by --mix, from --clients simulated clients.
+
+By default the app runs in-process (lifespan included) against the fakes
+in bench/fakes.py, sharing the event loop with the sender. With --url the
+requests go over HTTP to a running server instead. To run one against the
+fakes, e.g. with several workers:
+
+    python -m bench.load --serve-fakes    # prints the env to export, then waits
+    uvicorn backend.main:app --workers 4  # in a shell with that env
+    python -m bench.load --url http://127.0.0.1:8000 --ramp 10:200:10
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import shlex
+import sys
+import tempfile
+import time
+
+from .run import FAKES, _parse_overrides, fake_env, git_commit, percentile, start_fakes
+
+
+DEFAULT_MIX = "therapy=0.6,search=0.2,greeting=0.15,emergency=0.05"
+
+# Message templates per intent; {i} makes each message new so caches miss
+TEMPLATES = {
+    "therapy": [
+        "I am sad {i}",
+        "I feel so anxious about work {i}",
+        "my boss keeps yelling at me and I cannot cope {i}",
+        "I keep worrying about exams and my parents {i}",
+        "I've been feeling off lately {i}",
+    ],
+    "search": [
+        "find therapists in Bench City {i}",
+        "find a counselor in Bench Town {i}",
+        "I need a therapist near me",
+    ],
+    "greeting": [
+        "hi",
+        "hello there, how is your day going?",
+        "hey {i}",
+    ],
+    "emergency": [
+        "I want to end my life {i}",
+    ],
+}
+
+# A step is saturated when throughput falls below this share of the
+# offered rate, p95 grows past this multiple of the lowest p95 of the
+# steps before it, or more than this share of requests fail
+KNEE_THROUGHPUT = 0.9
+KNEE_LATENCY_FACTOR = 3.0
+KNEE_ERROR_RATE = 0.01
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in TEMPLATES:
+            raise SystemExit(f"Unknown intent '{name}' in --mix (choose from {', '.join(TEMPLATES)})")
+        mix[name] = float(weight)
+    return mix
+
+
+def load_corpus(path: str) -> list:
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if not isinstance(entry, dict) or not entry.get("message"):
+                raise SystemExit(f"{path}:{n}: expected an object with a \"message\"")
+            entries.append(entry)
+    if not entries:
+        raise SystemExit(f"{path} has no requests")
+    return entries
+
+
+def client_address(k: int) -> str:
+    """A private address for simulated client k."""
+    return f"10.{(k >> 16) & 255}.{(k >> 8) & 255}.{k & 255}"
+
+
+def replay(entries: list, clients: int):
+    """Corpus entries in order, forever."""
+    for i, entry in enumerate(itertools.cycle(entries)):
+        yield entry if entry.get("client") else {**entry, "client": client_address(i % clients)}
+
+
+def generate(mix: dict, rng: random.Random, clients: int):
+    """Endless synthetic requests drawn from the intent mix."""
+    names, weights = list(mix), list(mix.values())
+    for i in itertools.count():
+        intent = rng.choices(names, weights)[0]
+        message = rng.choice(TEMPLATES[intent]).format(i=i)
+        client = client_address(rng.randrange(clients))
+        yield {"message": message, "session_id": f"load-{i}", "intent": intent, "client": client}
+
+
+def parse_steps(args) -> list:
+    """[(target qps, seconds)] for --qps or --ramp START:END:STEP."""
+    if args.ramp:
+        try:
+            start, end, step = (float(x) for x in args.ramp.split(":"))
+        except ValueError:
+            raise SystemExit("--ramp expects START:END:STEP, e.g. 5:100:5") from None
+        rates = []
+        qps = start
+        while qps <= end + 1e-9:
+            rates.append(qps)
+            qps += step
+        return [(qps, args.step_seconds) for qps in rates]
+    return [(args.qps, args.duration)]
+
+
+class Recorder:
+    """Latencies and outcomes of the requests of one step."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.dropped = 0
+        self.by_intent = {}
+        self.tools = {}
+
+    def add(self, intent: str, elapsed: float, ok: bool, tool: str = None):
+        if tool:
+            self.tools[tool] = self.tools.get(tool, 0) + 1
+        if tool == "Shed":
+            # Answered at once with the fallback; kept out of the latencies
+            self.shed += 1
+            self.by_intent.setdefault(intent, []).append((elapsed, "shed"))
+            return
+        self.latencies.append(elapsed)
+        self.by_intent.setdefault(intent, []).append((elapsed, "ok" if ok else "error"))
+        if not ok:
+            self.errors += 1
+
+    def summary(self, qps: float, sent: int, duration: float, elapsed: float) -> dict:
+        values = sorted(self.latencies)
+        completed = len(values)
+        return {
+            "target_qps": qps,
+            "sent": sent,
+            "offered_qps": sent / duration,
+            "completed": completed,
+            # Until the last response of the step, so a backlog lowers it
+            "throughput": (completed - self.errors) / elapsed if elapsed else 0.0,
+            "errors": self.errors,
+            "shed": self.shed,
+            "timeouts": self.timeouts,
+            "dropped": self.dropped,
+            "error_rate": (self.errors + self.dropped) / (sent + self.dropped) if sent + self.dropped else 0.0,
+            "shed_rate": self.shed / sent if sent else 0.0,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": values[-1] * 1000 if values else 0.0,
+        }
+
+
+async def run_step(send, requests, qps: float, duration: float, rng: random.Random, timeout: float,
+                   max_in_flight: int, recorder: Recorder) -> dict:
+    """Send Poisson arrivals at `qps` for `duration` seconds and wait for them all."""
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def one(entry: dict):
+        start = time.perf_counter()
+        intent = entry.get("intent", "unlabeled")
+        try:
+            tool = await asyncio.wait_for(send(entry), timeout)
+        except asyncio.TimeoutError:
+            recorder.timeouts += 1
+            recorder.add(intent, time.perf_counter() - start, False)
+            return
+        except Exception:
+            recorder.add(intent, time.perf_counter() - start, False)
+            return
+        recorder.add(intent, time.perf_counter() - start, tool != "Error", tool)
+
+    start = loop.time()
+    due = start
+    sent = 0
+    while True:
+        due += rng.expovariate(qps)
+        if due - start >= duration:
+            break
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= max_in_flight:
+            recorder.dropped += 1  # the sender's own limit, not the service's
+            continue
+        task = asyncio.create_task(one(next(requests)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        sent += 1
+    if tasks:
+        await asyncio.gather(*tasks)
+    return recorder.summary(qps, sent, duration, max(loop.time() - start, duration))
+
+
+def saturation_knee(steps: list) -> tuple:
+    """(highest rate that kept up or None, first saturated step or None)."""
+    base = None
+    knee = None
+    for step in steps:
+        if (step["throughput"] < KNEE_THROUGHPUT * step["offered_qps"]
+                or (base and step["p95_ms"] > KNEE_LATENCY_FACTOR * base)
+                or step["error_rate"] + step["shed_rate"] > KNEE_ERROR_RATE):
+            return knee, step
+        knee = step["target_qps"]
+        base = step["p95_ms"] if base is None else min(base, step["p95_ms"])
+    return knee, None
+
+
+def intent_summary(recorders: list) -> dict:
+    merged = {}
+    for recorder in recorders:
+        for intent, samples in recorder.by_intent.items():
+            merged.setdefault(intent, []).extend(samples)
+    result = {}
+    for intent, samples in sorted(merged.items()):
+        values = sorted(elapsed for elapsed, outcome in samples if outcome != "shed")
+        outcomes = [outcome for _, outcome in samples]
+        result[intent] = {
+            "requests": len(samples),
+            "error_rate": outcomes.count("error") / len(samples),
+            "shed_rate": outcomes.count("shed") / len(samples),
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+        }
+    return result
+
+
+def print_report(results: dict):
+    header = (f"{'qps':>7}{'sent':>7}{'thru/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'err %':>7}{'shed %':>8}{'t/o':>6}{'drop':>6}")
+    print(header)
+    print("-" * len(header))
+    for s in results["steps"]:
+        print(f"{s['target_qps']:>7.1f}{s['sent']:>7}{s['throughput']:>9.1f}{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}"
+              f"{s['p99_ms']:>9.1f}{s['error_rate'] * 100:>7.1f}{s['shed_rate'] * 100:>8.1f}{s['timeouts']:>6}"
+              f"{s['dropped']:>6}")
+
+    print(f"\n{'intent':<12}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'err %':>7}{'shed %':>8}")
+    for intent, r in results["intents"].items():
+        print(f"{intent:<12}{r['requests']:>9}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['error_rate'] * 100:>7.1f}"
+              f"{r['shed_rate'] * 100:>8.1f}")
+    tools = ", ".join(f"{tool} {count}" for tool, count in sorted(results["tools"].items()))
+    print(f"tool_called: {tools}")
+
+    knee, saturated = results["knee_qps"], results["saturated_at"]
+    if saturated is None:
+        print(f"\nno saturation up to {results['steps'][-1]['target_qps']:.1f} qps")
+    elif knee is None:
+        print(f"\nsaturated at the first step ({saturated['target_qps']:.1f} qps)")
+    else:
+        print(f"\nsaturation knee: {knee:.1f} qps (saturated at {saturated['target_qps']:.1f} qps: "
+              f"{saturated['throughput']:.1f}/s done, p95 {saturated['p95_ms']:.0f} ms, "
+              f"{saturated['error_rate'] * 100:.1f}% errors, {saturated['shed_rate'] * 100:.1f}% shed)")
+
+
+async def main_async(args) -> dict:
+    rng = random.Random(args.seed)
+    if args.corpus:
+        requests = replay(load_corpus(args.corpus), args.clients)
+    else:
+        requests = generate(parse_mix(args.mix), rng, args.clients)
+    steps = parse_steps(args)
+
+    import httpx
+
+    with tempfile.TemporaryDirectory() as workdir:
+        fakes = {}
+        if args.url:
+            client = httpx.AsyncClient(base_url=args.url, timeout=None,
+                                       limits=httpx.Limits(max_connections=args.max_in_flight))
+            lifespan = None
+        else:
+            fakes = start_fakes(_parse_overrides(args.latency, args.upstream_latency),
+                                _parse_overrides(args.error_rate, 0.0), workdir)
+            # Imported after start_fakes() so module-level settings see the fake URLs
+            from backend import tools
+            from backend.main import app
+            tools.OLLAMA_AVAILABLE = args.therapy_backend == "ollama"
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load", timeout=None)
+            lifespan = app.router.lifespan_context(app)
+
+        async def send(entry: dict) -> str:
+            body = {"message": entry["message"], "session_id": entry.get("session_id")}
+            response = await client.post("/ask", json=body, headers={"X-Forwarded-For": entry["client"]})
+            if response.status_code != 200:
+                return "Error"
+            return response.json().get("tool_called")
+
+        recorders, summaries = [], []
+        try:
+            if lifespan is not None:
+                await lifespan.__aenter__()
+            if args.warmup:
+                # Connection pools, model load and imports; not reported
+                await run_step(send, requests, steps[0][0], args.warmup, rng, args.timeout, args.max_in_flight,
+                               Recorder())
+            for qps, duration in steps:
+                recorder = Recorder()
+                summary = await run_step(send, requests, qps, duration, rng, args.timeout, args.max_in_flight,
+                                         recorder)
+                recorders.append(recorder)
+                summaries.append(summary)
+                print(f"  {qps:.1f} qps: {summary['throughput']:.1f}/s, p95 {summary['p95_ms']:.0f} ms",
+                      file=sys.stderr)
+                if args.stop_at_knee and saturation_knee(summaries)[1] is not None:
+                    break
+        finally:
+            if lifespan is not None:
+                await lifespan.__aexit__(None, None, None)
+            await client.aclose()
+            for fake in fakes.values():
+                fake.stop()
+
+    tools_called = {}
+    for recorder in recorders:
+        for tool, count in recorder.tools.items():
+            tools_called[tool] = tools_called.get(tool, 0) + count
+    knee, saturated = saturation_knee(summaries)
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "target": args.url or "in-process",
+            "corpus": args.corpus,
+            "mix": None if args.corpus else args.mix,
+            "timeout": args.timeout,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "steps": summaries,
+        "intents": intent_summary(recorders),
+        "tools": tools_called,
+        "knee_qps": knee,
+        "saturated_at": saturated,
+    }
+
+
+def serve_fakes(args):
+    """Run the fakes until interrupted, for a separately started server."""
+    workdir = tempfile.mkdtemp(prefix="safespace-load-")
+    fakes = start_fakes(_parse_overrides(args.latency, args.upstream_latency),
+                        _parse_overrides(args.error_rate, 0.0), workdir)
+    for name, value in fake_env(fakes, workdir).items():
+        print(f"export {name}={shlex.quote(value)}")
+    print("# fakes running; Ctrl-C to stop", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for fake in fakes.values():
+            fake.stop()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the SafeSpace API")
+    parser.add_argument("--qps", type=float, default=10, help="fixed arrival rate (requests/second)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run at --qps")
+    parser.add_argument("--ramp", metavar="START:END:STEP", help="step the rate from START to END qps")
+    parser.add_argument("--step-seconds", type=float, default=10, help="seconds per --ramp step")
+    parser.add_argument("--stop-at-knee", action="store_true", help="end the ramp at the first saturated step")
+    parser.add_argument("--warmup", type=float, default=3,
+                        help="seconds at the first rate before measuring (0 to skip)")
+    parser.add_argument("--corpus", help="JSONL requests to replay")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"intent mix without --corpus (default {DEFAULT_MIX})")
+    parser.add_argument("--url", help="send to a running server instead of the in-process app")
+    parser.add_argument("--timeout", type=float, default=30, help="client-side timeout per request (seconds)")
+    parser.add_argument("--max-in-flight", type=int, default=2000,
+                        help="requests the sender keeps open before dropping new arrivals")
+    parser.add_argument("--clients", type=int, default=1000,
+                        help="simulated client addresses (for the per-client rate limit)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--upstream-latency", type=float, default=0.05,
+                        help="default latency (seconds) of every fake upstream")
+    parser.add_argument("--latency", action="append", metavar="NAME=SECONDS",
+                        help=f"per-upstream latency override ({', '.join(FAKES)})")
+    parser.add_argument("--error-rate", action="append", metavar="NAME=RATE",
+                        help="per-upstream injected error rate, e.g. groq=0.05")
+    parser.add_argument("--therapy-backend", choices=("groq", "ollama"), default="groq")
+    parser.add_argument("--serve-fakes", action="store_true",
+                        help="only run the fakes and print the env that points a server at them")
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if args.serve_fakes:
+        serve_fakes(args)
+        return None
+    results = asyncio.run(main_async(args))
+    print_report(results)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.out}")
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
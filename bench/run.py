@@ -0,0 +1,346 @@
+# Per-stage latency benchmark for the agent, run entirely against local fakes
+"""
+Runs the real agent code (search_openstreetmap, find_nearby_therapists,
+query_medgemma, get_agent_response and the FastAPI /ask handler) against the fake upstreams
+in bench/fakes.py and reports p50/p95/p99 latency and requests/sec per stage.
+
+    python -m bench.run --requests 200 --concurrency 20
+    python -m bench.run --latency overpass=0.3 --error-rate groq=0.05 --out results.json
+    python -m bench.run --compare results.json
+
+By default every request uses a new location/message so caches miss and the
+upstream path is measured; --warm repeats the same inputs instead.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from .fakes import FakeGroq, FakeIpapi, FakeNominatim, FakeOllama, FakeOverpass, FakeTwilio
+
+
+FAKES = {
+    "groq": FakeGroq,
+    "ollama": FakeOllama,
+    "nominatim": FakeNominatim,
+    "overpass": FakeOverpass,
+    "ipapi": FakeIpapi,
+    "twilio": FakeTwilio,
+}
+
+STAGES = ("search_openstreetmap", "find_nearby_therapists", "query_medgemma", "get_agent_response", "ask")
+
+MESSAGES = [
+    "I am sad",
+    "find therapists in Bench City {i}",
+    "hello there, can we talk about my week {i}",
+    "I've been feeling off lately {i}",
+    "I feel so anxious about work",
+    "hi",
+    # No cue phrase: these reach the router LLM
+    "my boss keeps yelling at me and I cannot cope {i}",
+    "I keep worrying about exams and my parents {i}",
+]
+
+
+def _parse_overrides(values: list, default: float) -> dict:
+    result = {name: default for name in FAKES}
+    for value in values or []:
+        name, _, number = value.partition("=")
+        if name not in FAKES:
+            raise SystemExit(f"Unknown upstream '{name}' (choose from {', '.join(FAKES)})")
+        result[name] = float(number)
+    return result
+
+
+def start_fakes(latency: dict, error_rate: dict, workdir: str) -> dict:
+    """Start every fake and point the backend at them through its env vars."""
+    fakes = {name: cls(latency[name], error_rate[name]).start() for name, cls in FAKES.items()}
+    os.environ.update(fake_env(fakes, workdir))
+    # Injected upstream errors are logged as warnings; keep the report readable
+    os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+    return fakes
+
+
+def fake_env(fakes: dict, workdir: str) -> dict:
+    """Environment variables that point the backend at the running fakes."""
+    return {
+        "GROQ_API_KEY": os.environ.get("GROQ_API_KEY") or "bench",
+        "GROQ_API_BASE": fakes["groq"].url,
+        "OLLAMA_HOST": fakes["ollama"].url,
+        "NOMINATIM_URL": fakes["nominatim"].url + "/search",
+        "OVERPASS_URL": fakes["overpass"].url + "/api/interpreter",
+        "OVERPASS_MIRRORS": fakes["overpass"].url + "/mirror/api/interpreter",
+        "IPAPI_URL": fakes["ipapi"].url + "/json/",
+        "TWILIO_API_BASE_URL": fakes["twilio"].url,
+        "GEOCODE_CACHE_PATH": os.path.join(workdir, "geocode.sqlite3"),
+        "EMERGENCY_QUEUE_PATH": os.path.join(workdir, "emergency.sqlite3"),
+        "FACILITY_STORE_PATH": os.path.join(workdir, "no-facility-store"),
+        "FACILITY_CACHE_PATH": "",
+    }
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "error_rate": errors / len(values) if values else 0.0,
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "rps": len(values) / elapsed if elapsed else 0.0,
+    }
+
+
+async def run_stage(call, requests: int, concurrency: int) -> dict:
+    """Run `await call(i)` for i in range(requests) with bounded concurrency."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ok = await call(i)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def build_stages(warm: bool, deadline: float = None) -> dict:
+    # Imported after start_fakes() so module-level settings see the fake URLs
+    import httpx
+    from backend import ai_agent, tools
+    from backend.deadlines import request_deadline
+    from backend.main import app
+
+    def n(i: int) -> int:
+        return 0 if warm else i
+
+    async def search(i):
+        lat = 40.0 + (n(i) * 0.37) % 20
+        lon = -74.0 + (n(i) * 0.53) % 20
+        return await tools.asearch_openstreetmap(lat, lon, 5, "Bench") is not None
+
+    async def find(i):
+        result = await tools.afind_nearby_therapists(f"Bench City {n(i)}")
+        return not result.startswith("I encountered an error")
+
+    async def therapy(i):
+        return await tools.aquery_medgemma(f"I have been feeling low this week {n(i)}") != tools.THERAPY_FALLBACK
+
+    async def agent(i):
+        message = MESSAGES[i % len(MESSAGES)].format(i=n(i))
+        result = await ai_agent.aget_agent_response(message, session_id=f"bench-{i}")
+        return result["tool_called"] != "Error"
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+    async def ask(i):
+        message = MESSAGES[i % len(MESSAGES)].format(i=n(i))
+        # One simulated client per request, so the per-client rate limit does not apply
+        headers = {"X-Forwarded-For": f"10.0.{i // 256 % 256}.{i % 256}"}
+        if deadline is not None:
+            headers["X-Request-Timeout"] = str(deadline)
+        response = await client.post("/ask", json={"message": message, "session_id": f"bench-{i}"},
+                                     headers=headers)
+        return response.status_code == 200 and response.json()["tool_called"] != "Error"
+
+    def bounded(call):
+        # The deadline /ask would give the call
+        async def run(i):
+            if deadline is None:
+                return await call(i)
+            with request_deadline(time.monotonic() + deadline):
+                return await call(i)
+        return run
+
+    return {
+        "search_openstreetmap": bounded(search),
+        "find_nearby_therapists": bounded(find),
+        "query_medgemma": bounded(therapy),
+        "get_agent_response": bounded(agent),
+        "ask": ask,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def print_report(results: dict, baseline: dict = None):
+    header = f"{'stage':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for stage, r in results["stages"].items():
+        print(f"{stage:<24}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['rps']:>10.1f}{r['errors']:>8}")
+        base = (baseline or {}).get("stages", {}).get(stage)
+        if base:
+            deltas = []
+            for key in ("p50_ms", "p95_ms", "p99_ms", "rps"):
+                if base[key]:
+                    deltas.append(f"{key} {(r[key] - base[key]) / base[key] * 100:+.1f}%")
+            print(f"{'':<24}vs {baseline.get('commit', 'baseline')}: {', '.join(deltas)}")
+
+    ollama = results.get("ollama")
+    if ollama:
+        print(f"\nollama: {ollama['model_loads']} model loads, {ollama['rejected'] + ollama['queue_timeouts']} shed, "
+              f"queue wait {ollama['avg_queue_wait_ms']:.1f} ms, generation {ollama['avg_generation_ms']:.1f} ms avg, "
+              f"max {ollama['max_waiting']} waiting")
+
+    hedging = results.get("hedging")
+    if hedging:
+        wins = ", ".join(f"{name} {p['wins']}" for name, p in hedging["providers"].items())
+        print(f"therapy: wins {wins}; {hedging['hedged']} hedged ({hedging['hedge_wins']} won by the hedge), "
+              f"{hedging['failovers']} failovers")
+
+    speculation = results.get("speculation")
+    if speculation and speculation["started"]:
+        print(f"\nspeculation: {speculation['started']} started, hit rate {speculation['hit_rate']:.0%}, "
+              f"{speculation['avg_saved_ms_per_hit']:.1f} ms saved per hit, "
+              f"{speculation['wasted_tokens_estimate']} tokens wasted")
+
+    deadlines = results.get("deadlines")
+    if deadlines and deadlines["exceeded_total"]:
+        stages = ", ".join(f"{stage} {n}" for stage, n in sorted(deadlines["exceeded"].items()))
+        print(f"\ndeadlines: {deadlines['exceeded_total']} exceeded ({stages})")
+
+    router = results.get("router_llm")
+    if router and router["calls"]:
+        print(f"\nrouter ({router['mode']}): {router['calls']} LLM calls, {router['avg_prompt_tokens']:.0f} prompt + "
+              f"{router['avg_completion_tokens']:.1f} completion tokens, {router['avg_ms']:.1f} ms avg")
+        base = (baseline or {}).get("router_llm")
+        if base and base.get("calls"):
+            deltas = [f"{key} {(router[key] - base[key]) / base[key] * 100:+.1f}%"
+                      for key in ("avg_prompt_tokens", "avg_completion_tokens", "avg_ms") if base[key]]
+            print(f"{'':<10}vs {baseline.get('commit', 'baseline')}: {', '.join(deltas)}")
+
+    overpass = results.get("overpass")
+    if overpass:
+        print(f"\noverpass: {overpass['requests']} requests, {overpass['bytes'] / 1024:.1f} KiB, "
+              f"{overpass['server_seconds']:.2f} s server time")
+        base = (baseline or {}).get("overpass")
+        if base:
+            deltas = [f"{key} {(overpass[key] - base[key]) / base[key] * 100:+.1f}%"
+                      for key in ("requests", "bytes", "server_seconds") if base[key]]
+            print(f"{'':<10}vs {baseline.get('commit', 'baseline')}: {', '.join(deltas)}")
+
+
+async def main_async(args) -> dict:
+    latency = _parse_overrides(args.latency, args.upstream_latency)
+    error_rate = _parse_overrides(args.error_rate, 0.0)
+    with tempfile.TemporaryDirectory() as workdir:
+        fakes = start_fakes(latency, error_rate, workdir)
+        os.environ["ROUTER_MODE"] = args.router_mode
+        try:
+            from backend import tools
+            from backend.deadlines import deadline_stats
+            from backend.router_llm import router_llm_stats
+            from backend.speculation import therapy_speculator
+            tools.OLLAMA_AVAILABLE = args.therapy_backend == "ollama"
+            if tools.OLLAMA_AVAILABLE and not args.cold_model:
+                # What the server's startup preload does
+                await tools.ollama_inference.warm()
+            stages = build_stages(args.warm, args.deadline)
+            results = {
+                "commit": git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "config": {
+                    "requests": args.requests,
+                    "concurrency": args.concurrency,
+                    "warm": args.warm,
+                    "therapy_backend": args.therapy_backend,
+                    "cold_model": args.cold_model,
+                    "router_mode": args.router_mode,
+                    "deadline": args.deadline,
+                    "latency": latency,
+                    "error_rate": error_rate,
+                },
+                "stages": {},
+            }
+            for stage in args.stages:
+                results["stages"][stage] = await run_stage(stages[stage], args.requests, args.concurrency)
+            results["upstream_requests"] = {name: fake.requests for name, fake in fakes.items()}
+            results["overpass"] = {
+                "requests": fakes["overpass"].requests,
+                "bytes": fakes["overpass"].bytes_sent,
+                "server_seconds": fakes["overpass"].server_seconds,
+            }
+            results["router_llm"] = router_llm_stats()
+            results["speculation"] = therapy_speculator.stats()
+            results["deadlines"] = deadline_stats()
+            if tools.OLLAMA_AVAILABLE:
+                results["ollama"] = {**tools.ollama_inference.stats(), "model_loads": fakes["ollama"].loads}
+                results["hedging"] = tools.therapy_hedger.stats()
+            return results
+        finally:
+            for fake in fakes.values():
+                fake.stop()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Offline per-stage benchmark for the SafeSpace agent")
+    parser.add_argument("--requests", type=int, default=200, help="requests per stage")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--upstream-latency", type=float, default=0.05,
+                        help="default latency (seconds) of every fake upstream")
+    parser.add_argument("--latency", action="append", metavar="NAME=SECONDS",
+                        help="per-upstream latency override, e.g. overpass=0.3")
+    parser.add_argument("--error-rate", action="append", metavar="NAME=RATE",
+                        help="per-upstream injected error rate, e.g. groq=0.05")
+    parser.add_argument("--therapy-backend", choices=("groq", "ollama"), default="groq",
+                        help="ollama: MedGemma through Ollama, hedged with Groq")
+    parser.add_argument("--cold-model", action="store_true",
+                        help="skip the Ollama preload, so the first requests wait for the model to load")
+    parser.add_argument("--router-mode", choices=("structured", "text"), default="structured",
+                        help="text: the original free-text routing prompt")
+    parser.add_argument("--deadline", type=float, metavar="SECONDS",
+                        help="per-request deadline (X-Request-Timeout for the ask stage)")
+    parser.add_argument("--warm", action="store_true", help="repeat the same inputs so caches hit")
+    parser.add_argument("--out", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(main_async(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.out}")
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,9 +1,13 @@
 # Step1: Setup Streamlit
 import streamlit as st
 import requests
+import json
+import time
+import uuid
 
 
 BACKEND_URL = "http://localhost:8000/ask"
+STREAM_URL = f"{BACKEND_URL}/stream"
 
 st.set_page_config(page_title="AI Mental Health Therapist", layout="wide")
 st.title("🧠 SafeSpace – AI Mental Health Therapist")
@@ -11,6 +15,41 @@ st.title("🧠 SafeSpace – AI Mental Health Therapist")
 # Initialize chat history in session state
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+# The backend keeps the conversation history under this ID
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+
+def stream_reply(message: str, meta: dict):
+    """
+    Yield response text from the /ask/stream SSE endpoint as it arrives.
+    Fills `meta` with tool_called and client-side timings.
+    """
+    start = time.perf_counter()
+    payload = {"message": message, "session_id": st.session_state.session_id}
+    with requests.post(STREAM_URL, json=payload, stream=True, timeout=120) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "tool_called":
+                    meta["tool_called"] = data["tool_called"]
+                elif event == "token":
+                    if "ttft_ms" not in meta:
+                        meta["ttft_ms"] = (time.perf_counter() - start) * 1000
+                    yield data["text"]
+                elif event == "done":
+                    meta["server"] = data
+    meta["total_ms"] = (time.perf_counter() - start) * 1000
+
+
+# Step3: Show response from backend
+for msg in st.session_state.chat_history:
+    with st.chat_message(msg["role"]):
+        st.write(msg["content"])
 
 # Step2: User is able to ask question
 # Chat input
@@ -18,39 +57,24 @@ user_input = st.chat_input("What's on your mind today?")
 if user_input:
     # Append user message
     st.session_state.chat_history.append({"role": "user", "content": user_input})
+    with st.chat_message("user"):
+        st.write(user_input)
     # AI Agent exists here
-    try:
-        response = requests.post(BACKEND_URL, json={"message": user_input})
-        
-        # Check if request was successful
-        if response.status_code == 200:
-            response_data = response.json()
-            st.session_state.chat_history.append({
-                "role": "assistant", 
-                "content": f'{response_data["response"]} WITH TOOL: [{response_data["tool_called"]}]'
-            })
-        else:
-            st.session_state.chat_history.append({
-                "role": "assistant", 
-                "content": f"⚠️ Error: Backend returned status code {response.status_code}. Response: {response.text}"
-            })
-    except requests.exceptions.JSONDecodeError:
-        st.session_state.chat_history.append({
-            "role": "assistant", 
-            "content": f"⚠️ Error: Backend returned invalid JSON. Response: {response.text}"
-        })
-    except requests.exceptions.ConnectionError:
-        st.session_state.chat_history.append({
-            "role": "assistant", 
-            "content": "⚠️ Error: Cannot connect to backend. Make sure the backend is running on http://localhost:8000"
-        })
-    except Exception as e:
-        st.session_state.chat_history.append({
-            "role": "assistant", 
-            "content": f"⚠️ Error: {str(e)}"
-        })
-        
-# Step3: Show response from backend
-for msg in st.session_state.chat_history:
-    with st.chat_message(msg["role"]):
-        st.write(msg["content"])
\ No newline at end of file
+    with st.chat_message("assistant"):
+        meta = {"tool_called": "None"}
+        try:
+            text = st.write_stream(stream_reply(user_input, meta))
+            content = f'{text} WITH TOOL: [{meta["tool_called"]}]'
+            st.caption(
+                f'WITH TOOL: [{meta["tool_called"]}] · first token {meta.get("ttft_ms", 0):.0f} ms · total {meta["total_ms"]:.0f} ms'
+            )
+        except requests.exceptions.ConnectionError:
+            content = "⚠️ Error: Cannot connect to backend. Make sure the backend is running on http://localhost:8000"
+            st.write(content)
+        except requests.exceptions.HTTPError as e:
+            content = f"⚠️ Error: Backend returned status code {e.response.status_code}. Response: {e.response.text}"
+            st.write(content)
+        except Exception as e:
+            content = f"⚠️ Error: {str(e)}"
+            st.write(content)
+    st.session_state.chat_history.append({"role": "assistant", "content": content})
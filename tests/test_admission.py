@@ -0,0 +1,64 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from backend import main
+from backend.admission import BATCH, AdmissionController, Shed
+
+
+def request_from(peer: str, forwarded: str = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 1234)})
+
+
+def test_admission_key_is_the_hop_the_trusted_proxy_added(monkeypatch):
+    monkeypatch.setattr(main, "TRUSTED_PROXY_HOPS", 1)
+    request = request_from("10.0.0.1", "1.2.3.4, 203.0.113.7")
+    assert main.admission_key(request) == "203.0.113.7"
+    # The leftmost hop is whatever the client sent; only GeoIP uses it
+    assert main.client_ip(request) == "1.2.3.4"
+
+
+def test_admission_key_without_a_proxy_is_the_peer(monkeypatch):
+    monkeypatch.setattr(main, "TRUSTED_PROXY_HOPS", 0)
+    assert main.admission_key(request_from("198.51.100.2", "1.2.3.4")) == "198.51.100.2"
+
+
+def test_batch_messages_wait_behind_interactive_requests():
+    controller = AdmissionController(enabled=True, max_in_flight=1, queue_depth=8, queue_timeout=5)
+    order = []
+
+    async def request(name: str, lane: int = None):
+        async with controller.admit(None, "I feel sad", lane=lane):
+            order.append(name)
+
+    async def scenario():
+        async with controller.admit(None, "I feel sad"):
+            batch = asyncio.create_task(request("batch", BATCH))
+            await asyncio.sleep(0)
+            normal = asyncio.create_task(request("normal"))
+            await asyncio.sleep(0)
+        await asyncio.gather(batch, normal)
+
+    asyncio.run(scenario())
+    assert order == ["normal", "batch"]
+
+
+def test_oversized_batch_is_refused():
+    client = TestClient(main.app)
+    response = client.post("/ask/batch", json={"messages": ["hi"] * (main.MAX_BATCH_MESSAGES + 1)})
+    assert response.status_code == 413
+
+
+def test_forged_forwarded_for_cannot_evade_the_rate_limit_by_default():
+    assert main.TRUSTED_PROXY_HOPS == 0
+    controller = AdmissionController(enabled=True)
+    limited = 0
+    for n in range(int(controller.buckets.burst) + 5):
+        request = request_from("198.51.100.2", f"10.0.{n}.1, 203.0.113.{n}")
+        try:
+            controller.limit_rate(main.admission_key(request))
+        except Shed:
+            limited += 1
+    assert limited == 5
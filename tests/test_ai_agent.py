@@ -0,0 +1,32 @@
+import asyncio
+
+from backend import ai_agent
+
+
+class Dispatcher:
+    def __init__(self):
+        self.enqueued = []
+
+    def enqueue(self, session_id=None, message=None):
+        self.enqueued.append((session_id, message))
+
+
+def test_batch_emergency_answer_does_not_claim_a_call(monkeypatch):
+    dispatcher = Dispatcher()
+    monkeypatch.setattr(ai_agent, "emergency_dispatcher", dispatcher)
+
+    response = asyncio.run(ai_agent.arun_tool(
+        "emergency_call_tool", "", "I want to end my life", dispatch_emergency=False
+    ))
+    assert response == ai_agent.BATCH_EMERGENCY_RESPONSE
+    assert "No emergency call was placed" in response
+    assert dispatcher.enqueued == []
+
+
+def test_emergency_answer_queues_a_call(monkeypatch):
+    dispatcher = Dispatcher()
+    monkeypatch.setattr(ai_agent, "emergency_dispatcher", dispatcher)
+
+    response = asyncio.run(ai_agent.arun_tool("emergency_call_tool", "", "I want to end my life", "s1"))
+    assert response == ai_agent.EMERGENCY_RESPONSE
+    assert dispatcher.enqueued == [("s1", "I want to end my life")]
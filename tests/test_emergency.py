@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend import emergency
+from backend.emergency import DELIVERED, EmergencyDispatcher
+
+
+class FakeTwilio:
+    """Stands in for tools.call_emergency: fails the first `failures` dials."""
+
+    def __init__(self, failures: int = 0, hang: threading.Event = None):
+        self.failures = failures
+        self.hang = hang  # the first dial blocks until this is set
+        self.dials = 0
+        self.lock = threading.Lock()
+
+    def __call__(self) -> str:
+        with self.lock:
+            self.dials += 1
+            n = self.dials
+        if n == 1 and self.hang is not None:
+            self.hang.wait()
+        if n <= self.failures:
+            raise RuntimeError("twilio unavailable")
+        return f"CA{n}"
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(emergency, "EMERGENCY_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(emergency, "EMERGENCY_DIAL_TIMEOUT", 0.5)
+
+
+def dispatcher(tmp_path, twilio: FakeTwilio) -> EmergencyDispatcher:
+    return EmergencyDispatcher(str(tmp_path / "queue.sqlite3"), dial=twilio)
+
+
+async def settle(d: EmergencyDispatcher, call_ids: list, timeout: float = 5.0) -> list:
+    """Wait until every call is delivered (or the timeout passes)."""
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        calls = [d.status(call_id) for call_id in call_ids]
+        if all(call["status"] == DELIVERED for call in calls):
+            return calls
+        await asyncio.sleep(0.01)
+    return [d.status(call_id) for call_id in call_ids]
+
+
+def test_failed_dials_are_retried(tmp_path):
+    twilio = FakeTwilio(failures=2)
+    d = dispatcher(tmp_path, twilio)
+
+    async def scenario():
+        call = d.enqueue("session-1")
+        try:
+            return await settle(d, [call["id"]])
+        finally:
+            await d.stop()
+
+    [call] = asyncio.run(scenario())
+    assert call["status"] == DELIVERED
+    assert call["attempts"] == 3
+    assert call["call_sid"] == "CA3"
+    assert d.counters["retries"] == 2
+
+
+def test_repeat_messages_from_a_session_share_one_call(tmp_path):
+    twilio = FakeTwilio()
+    d = dispatcher(tmp_path, twilio)
+
+    async def scenario():
+        first = d.enqueue("session-1")
+        second = d.enqueue("session-1")
+        other = d.enqueue(None)
+        try:
+            await settle(d, [first["id"], other["id"]])
+        finally:
+            await d.stop()
+        return first, second, other
+
+    first, second, other = asyncio.run(scenario())
+    assert second["deduplicated"] and second["id"] == first["id"]
+    assert not other["deduplicated"] and other["id"] != first["id"]
+    assert twilio.dials == 2
+
+
+def test_sessionless_retries_of_a_message_share_one_call(tmp_path):
+    twilio = FakeTwilio()
+    d = dispatcher(tmp_path, twilio)
+
+    async def scenario():
+        first = d.enqueue(None, "I want to end my life")
+        retry = d.enqueue(None, "  i want to END my life ")
+        other = d.enqueue(None, "I am going to kill myself")
+        try:
+            await settle(d, [first["id"], other["id"]])
+        finally:
+            await d.stop()
+        return first, retry, other
+
+    first, retry, other = asyncio.run(scenario())
+    assert retry["deduplicated"] and retry["id"] == first["id"]
+    assert not other["deduplicated"] and other["id"] != first["id"]
+    assert twilio.dials == 2
+
+
+def test_hung_dial_does_not_hold_up_other_calls(tmp_path):
+    hang = threading.Event()
+    twilio = FakeTwilio(hang=hang)
+    d = dispatcher(tmp_path, twilio)
+
+    async def scenario():
+        hung = d.enqueue("session-1")
+        await asyncio.sleep(0.05)  # the first dial is now blocked
+        other = d.enqueue("session-2")
+        try:
+            [delivered] = await settle(d, [other["id"]], timeout=0.3)
+            # The hung attempt is abandoned and retried
+            [retried] = await settle(d, [hung["id"]])
+            return delivered, retried
+        finally:
+            hang.set()
+            await d.stop()
+
+    delivered, retried = asyncio.run(scenario())
+    assert delivered["status"] == DELIVERED
+    assert retried["status"] == DELIVERED and retried["attempts"] == 2
+    assert d.counters["timeouts"] == 1
+
+
+def test_drain_dials_before_a_temporary_loop_ends(tmp_path):
+    twilio = FakeTwilio()
+    d = dispatcher(tmp_path, twilio)
+
+    async def request():
+        call = d.enqueue("session-1")
+        await d.drain()
+        return call
+
+    call = asyncio.run(request())
+    assert d.status(call["id"])["status"] == DELIVERED
+    assert twilio.dials == 1
+    assert d.stats()["queue_depth"] == 0
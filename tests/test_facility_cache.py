@@ -0,0 +1,50 @@
+import asyncio
+import gc
+import time
+
+from backend.deadlines import DeadlineExceeded, request_deadline, within
+from backend.facility_cache import FacilityCache
+
+CLINIC = {"name": "Clinic", "lat": 51.5, "lon": -0.1}
+
+
+def test_empty_result_expires_after_the_negative_ttl():
+    cache = FacilityCache(path="", negative_ttl=60)
+    results = [[], [CLINIC]]
+
+    async def fetch(lat, lon, radius):
+        return results.pop(0)
+
+    async def scenario():
+        first = await cache.get_or_fetch(51.5, -0.1, 5, fetch)
+        again = await cache.get_or_fetch(51.5, -0.1, 5, fetch)
+        # Age the empty entry past the negative TTL
+        for key, (fetched_at, facilities) in cache._memory.items():
+            cache._memory[key] = (fetched_at - 61, facilities)
+        return first, again, await cache.get_or_fetch(51.5, -0.1, 5, fetch)
+
+    first, again, later = asyncio.run(scenario())
+    assert first == [] and again == []
+    assert later == [CLINIC]
+
+
+def test_failed_fetch_after_the_waiter_left_is_not_reported_unretrieved():
+    cache = FacilityCache(path="")
+    errors = []
+
+    async def fetch(lat, lon, radius):
+        await asyncio.sleep(0.1)
+        raise RuntimeError("overpass down")
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        with request_deadline(time.monotonic() + 0.02):
+            try:
+                await within("search", cache.get_or_fetch(51.5, -0.1, 5, fetch))
+            except DeadlineExceeded:
+                pass
+        await asyncio.sleep(0.2)
+        gc.collect()
+
+    asyncio.run(scenario())
+    assert not [e for e in errors if "never retrieved" in e.get("message", "")]
@@ -0,0 +1,49 @@
+import pytest
+
+from backend.gazetteer import Gazetteer, build
+
+# GeoNames rows: id, name, ascii name, alternate names, lat, lon, class, code,
+# country, cc2, admin1-4, population
+PLACES = [
+    ("I", "I", "", 10.0, 10.0, "XX", 10),
+    ("Çan", "Can", "", 40.03, 27.05, "TR", 30000),
+    ("Of", "Of", "", 40.95, 40.27, "TR", 20000),
+    ("New York", "New York", "NYC", 40.71, -74.01, "US", 8000000),
+    ("Pune", "Pune", "", 18.52, 73.86, "IN", 3000000),
+]
+
+
+@pytest.fixture(scope="module")
+def gazetteer(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("gazetteer")
+    source = tmp / "cities.txt"
+    source.write_text("".join(
+        "\t".join([str(i), name, ascii_name, alt, str(lat), str(lon), "P", "PPL", cc, "", "", "", "", "",
+                   str(population)]) + "\n"
+        for i, (name, ascii_name, alt, lat, lon, cc, population) in enumerate(PLACES)
+    ), encoding="utf-8")
+    build(str(tmp / "out"), [str(source)])
+    return Gazetteer(str(tmp / "out"))
+
+
+@pytest.mark.parametrize("message", [
+    "I need a therapist",
+    "Can you find a therapist for me",
+    "Find a therapist Of course",
+    "find a therapist in a while",
+])
+def test_words_that_are_not_places(gazetteer, message):
+    assert gazetteer.mention(message) is None
+
+
+@pytest.mark.parametrize("message, place", [
+    ("find a therapist in Pune", "Pune"),
+    ("find a therapist near pune please", "pune"),
+    ("any therapists New York way?", "New York"),
+])
+def test_places(gazetteer, message, place):
+    assert gazetteer.mention(message)["text"] == place
+
+
+def test_single_word_place_needs_a_cue(gazetteer):
+    assert gazetteer.mention("I moved to a flat, Pune is nice") is None
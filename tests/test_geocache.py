@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import pytest
+
+from backend.deadlines import DeadlineExceeded, request_deadline
+from backend.geocache import GeocodeCache
+
+PLACE = {"lat": 51.5, "lon": -0.1, "display_name": "London"}
+
+
+def slow_fetch(calls: list, delay: float = 0.2):
+    async def fetch(location):
+        calls.append(location)
+        await asyncio.sleep(delay)
+        return PLACE
+    return fetch
+
+
+def cache(tmp_path) -> GeocodeCache:
+    return GeocodeCache(str(tmp_path / "geocode.sqlite3"))
+
+
+def test_leader_deadline_does_not_cut_the_shared_fetch(tmp_path):
+    geocache, calls = cache(tmp_path), []
+    fetch = slow_fetch(calls)
+
+    async def leader():
+        with request_deadline(time.monotonic() + 0.05):
+            return await geocache.get_or_fetch("London", fetch)
+
+    async def scenario():
+        first = asyncio.create_task(leader())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(geocache.get_or_fetch("london", fetch))
+        with pytest.raises(DeadlineExceeded):
+            await first
+        return await waiter
+
+    assert asyncio.run(scenario()) == PLACE
+    assert calls == ["London"]
+    assert geocache.lookup("london") == PLACE
+
+
+def test_leader_cancel_does_not_cancel_waiters(tmp_path):
+    geocache, calls = cache(tmp_path), []
+    fetch = slow_fetch(calls)
+
+    async def scenario():
+        first = asyncio.create_task(geocache.get_or_fetch("London", fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(geocache.get_or_fetch("London", fetch))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        return await waiter
+
+    assert asyncio.run(scenario()) == PLACE
+    assert calls == ["London"]
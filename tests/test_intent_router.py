@@ -0,0 +1,83 @@
+import pytest
+
+from backend.intent_router import GREETING_REPLY, classify, mentions_self_harm, route_degraded, route_locally
+
+EMERGENCY = "USE_TOOL: emergency_call_tool"
+
+# Short messages that open like a greeting but carry a crisis
+CRISIS_AFTER_GREETING = [
+    "hey, I took pills",
+    "hello I'm going to jump",
+    "hi, I have a gun",
+    "hey i can't go on",
+]
+
+
+@pytest.mark.parametrize("message", CRISIS_AFTER_GREETING)
+def test_crisis_after_greeting_is_not_answered_locally(message):
+    assert route_locally(message) is None
+
+
+@pytest.mark.parametrize("message", ["hi", "Hello", "hey there", "good morning!", "hello, how are you?", "whats up"])
+def test_plain_greetings_are_answered_locally(message):
+    assert route_locally(message) == GREETING_REPLY
+
+
+@pytest.mark.parametrize("message", [
+    "I keep overdosing", "I overdosed last night", "I feel suicidal", "I've been cutting myself",
+    "I'm killing myself slowly", "I don't want to live anymore", "hey i can't go on", "I took pills",
+])
+def test_self_harm_cues_match_inflections(message):
+    assert mentions_self_harm(message)
+
+
+@pytest.mark.parametrize("message", ["I feel sad", "find therapists near me", "I took my pills this morning"])
+def test_no_self_harm_cue(message):
+    assert not mentions_self_harm(message)
+
+
+@pytest.mark.parametrize("message", [
+    "I keep overdosing", "hey i can't go on", "I want to die laughing", "I read an article about self-harm",
+    "I want to end it all with my boyfriend",
+])
+def test_emergency_is_never_resolved_locally(message):
+    # The LLM confirms every call; the cue only prioritises the message
+    assert route_locally(message) is None
+    assert classify(message)[1] == 0.0
+
+
+@pytest.mark.parametrize("message", ["my therapist is annoying me", "I am a therapist", "how do I become a psychologist"])
+def test_therapist_mention_without_search_cue_is_not_a_search(message):
+    assert route_locally(message) != "USE_TOOL: find_nearby_therapists_by_location"
+
+
+@pytest.mark.parametrize("message", ["find therapists near me", "show me psychiatrists in London"])
+def test_therapist_search_is_routed_locally(message):
+    assert route_locally(message) == "USE_TOOL: find_nearby_therapists_by_location"
+
+
+@pytest.mark.parametrize("message", ["I keep overdosing", "hey i can't go on", "everyone would be better off if I was dead"])
+def test_degraded_routing_keeps_emergency(message):
+    assert route_degraded(message) == EMERGENCY
+
+
+def test_degraded_routing_ignores_model_emergency_prediction(monkeypatch):
+    # No cue phrase: the model rating emergency highest is not enough for a call
+    from backend import intent_router
+    monkeypatch.setattr(intent_router, "intent_probabilities", lambda text: {
+        "ask_mental_health_specialist": 0.2, "emergency_call_tool": 0.5,
+        "find_nearby_therapists_by_location": 0.1, "greeting": 0.2,
+    })
+    assert route_degraded("I am thinking about dinner") != EMERGENCY
+
+
+@pytest.mark.parametrize("message", [
+    "I am thinking about dinner", "we jump off the diving board", "I cant go on the trip tomorrow",
+    "I want to die laughing", "find therapists near me",
+])
+def test_degraded_routing_never_escalates_without_a_cue(message):
+    assert route_degraded(message) == "USE_TOOL: ask_mental_health_specialist"
+
+
+def test_degraded_routing_without_cues_goes_to_therapy():
+    assert route_degraded("my week has been rough") == "USE_TOOL: ask_mental_health_specialist"
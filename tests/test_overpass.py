@@ -0,0 +1,39 @@
+import asyncio
+
+import httpx
+
+from backend import overpass, resilience
+from backend.resilience import BREAKER_CONSECUTIVE, OPEN
+
+
+class FakeClient:
+    """Overpass mirrors where the first one is down."""
+
+    def __init__(self, urls: list):
+        self.down = urls[0]
+        self.posts = []
+
+    async def post(self, url, data=None):
+        self.posts.append(url)
+        request = httpx.Request("POST", url)
+        if url == self.down:
+            return httpx.Response(504, request=request)
+        return httpx.Response(200, json={"elements": []}, request=request)
+
+
+def test_a_failing_mirror_opens_only_its_own_circuit(monkeypatch):
+    urls = ["https://a.example/api/interpreter", "https://b.example/api/interpreter"]
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(overpass, "overpass_urls", lambda: urls)
+    monkeypatch.setattr(overpass, "_preferred", 0)
+    client = FakeClient(urls)
+    monkeypatch.setattr(overpass, "get_http_client", lambda: client)
+
+    for _ in range(BREAKER_CONSECUTIVE + 1):
+        monkeypatch.setattr(overpass, "_preferred", 0)
+        assert asyncio.run(overpass.run_query("[out:json];")) == {"elements": []}
+
+    assert overpass.mirror_breaker(0).state == OPEN
+    assert overpass.mirror_breaker(1).state != OPEN
+    # Once open, the failing mirror is skipped without a request
+    assert client.posts.count(urls[0]) == BREAKER_CONSECUTIVE
@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+import pytest
+
+from backend.deadlines import DeadlineExceeded, deadline_stats, request_deadline
+from backend.resilience import Breaker
+
+
+def consume(b: Breaker, factory) -> list:
+    async def run():
+        return [chunk async for chunk in b.stream(factory)]
+
+    return asyncio.run(run())
+
+
+def test_a_complete_stream_is_one_successful_call():
+    async def chunks():
+        yield "a"
+        yield "b"
+
+    b = Breaker("test")
+    assert consume(b, chunks) == ["a", "b"]
+    assert b.counters["calls"] == 1 and b.counters["failures"] == 0
+    assert len(b.latencies) == 1
+
+
+def test_a_mid_stream_error_is_one_failed_call():
+    async def chunks():
+        yield "a"
+        raise ConnectionError("reset")
+
+    b = Breaker("test")
+    with pytest.raises(ConnectionError):
+        consume(b, chunks)
+    assert b.counters["calls"] == 1
+    assert b.counters["failures"] == 1
+    assert b.counters["timeouts"] == 0
+    assert list(b.outcomes) == [True]
+
+
+def test_a_deadline_cut_is_left_for_the_stage_to_count():
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def run():
+        with request_deadline(time.monotonic() + 0.05):
+            await Breaker("cut_test").call(slow)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert "cut_test" not in deadline_stats()["exceeded"]
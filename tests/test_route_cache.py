@@ -0,0 +1,45 @@
+import pytest
+
+from backend.route_cache import EMERGENCY_MARKER, THERAPY_MARKER, RouteCache
+
+SEARCH = "USE_TOOL: find_nearby_therapists_by_location [Pune]"
+
+
+def cache_with(text: str, decision: str, confirmations: int = 3) -> RouteCache:
+    cache = RouteCache()
+    for _ in range(confirmations):
+        _, probe = cache.lookup(text)
+        cache.store(probe, decision, 0.5)
+    return cache
+
+
+def test_paraphrased_distress_is_served_from_a_near_duplicate():
+    cache = cache_with("I have been feeling really anxious lately", THERAPY_MARKER)
+    decision, _ = cache.lookup("I have been feeling so anxious lately")
+    assert decision == THERAPY_MARKER
+    assert cache.counters["near_hits"] == 1
+
+
+def test_exact_normalized_match_is_served():
+    cache = cache_with("I feel so sad today", THERAPY_MARKER)
+    decision, _ = cache.lookup("i feel so SAD today.")
+    assert decision == THERAPY_MARKER
+    assert cache.counters["exact_hits"] >= 1
+
+
+def test_self_harm_cue_is_never_served_from_a_near_duplicate():
+    cache = cache_with("I don't want to leave anymore", THERAPY_MARKER)
+    decision, _ = cache.lookup("I don't want to live anymore")
+    assert decision is None
+    assert cache.counters["near_hits"] == 0
+
+
+@pytest.mark.parametrize("cached, decision, message", [
+    ("nothing matters and I have a plan", EMERGENCY_MARKER, "nothing matters and I have a plan now"),
+    ("find therapists in Pune", SEARCH, "find therapists in Puno"),
+    ("I am sad", THERAPY_MARKER, "I am mad"),
+])
+def test_other_decisions_and_distant_messages_need_an_exact_match(cached, decision, message):
+    cache = cache_with(cached, decision)
+    assert cache.lookup(message)[0] is None
+    assert cache.counters["near_hits"] == 0